@@ -0,0 +1,157 @@
+"""
+后台分析任务
+
+上传的工作簿交给线程池在后台分析，上传请求立即返回任务ID。分析函数通过progress回调报告
+当前阶段和行数，前端轮询任务状态查看进度。已结束的任务按提交顺序保留有限条数。
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# 分析阶段及其显示名称，按执行顺序排列
+PHASES = OrderedDict([
+    ('loading', '读取工作簿'),
+    ('collecting', '收集参数和依赖关系'),
+    ('cycle_detection', '检测循环依赖'),
+    ('optimizing', '优化参数'),
+    ('saving', '保存优化后的文件'),
+    ('indexing', '构建参数模型'),
+])
+
+
+class AnalysisJob:
+    """一个后台分析任务的状态，由工作线程更新、请求线程读取"""
+
+    def __init__(self, job_id, session_id, filename):
+        self.id = job_id
+        self.session_id = session_id
+        self.filename = filename
+        self.status = 'queued'  # queued、running、succeeded、failed
+        self.phase = None
+        self.phases = []        # [{'name', 'label', 'rows', 'started', 'duration'}]
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def report(self, phase, rows=None):
+        """进入新的阶段（作为分析函数的progress回调）"""
+        now = time.time()
+        with self._lock:
+            self._close_phase(now)
+            self.phase = phase
+            self.phases.append({
+                'name': phase,
+                'label': PHASES.get(phase, phase),
+                'rows': rows,
+                'started': now,
+                'duration': None
+            })
+
+    def _close_phase(self, now):
+        if self.phases and self.phases[-1]['duration'] is None:
+            self.phases[-1]['duration'] = now - self.phases[-1]['started']
+
+    def _start(self):
+        with self._lock:
+            self.status = 'running'
+
+    def _finish(self, result=None, error=None):
+        now = time.time()
+        with self._lock:
+            self._close_phase(now)
+            self.result = result
+            self.error = error
+            self.status = 'failed' if error is not None else 'succeeded'
+            self.finished = now
+
+    @property
+    def done(self):
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self):
+        with self._lock:
+            now = self.finished or time.time()
+            phase_names = list(PHASES)
+            completed = sum(1 for phase in self.phases if phase['duration'] is not None)
+            return {
+                'id': self.id,
+                'filename': self.filename,
+                'status': self.status,
+                'phase': self.phase,
+                'phase_label': PHASES.get(self.phase, self.phase),
+                'progress': 1.0 if self.status == 'succeeded' else completed / len(phase_names),
+                'elapsed': now - self.created,
+                'phases': [{
+                    'name': phase['name'],
+                    'label': phase['label'],
+                    'rows': phase['rows'],
+                    'duration': phase['duration'] if phase['duration'] is not None else now - phase['started']
+                } for phase in self.phases],
+                'error': self.error
+            }
+
+
+class JobManager:
+    """
+    使用线程池执行分析任务
+
+    Args:
+        max_workers: 同时进行分析的任务数，其余任务排队
+        max_jobs: 保留的任务条数，超出时丢弃最早的已结束任务
+    """
+
+    def __init__(self, max_workers=2, max_jobs=256):
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, filename, func, *args):
+        """提交任务，func(*args, progress=回调)的返回值作为任务结果"""
+        job = AnalysisJob(uuid.uuid4().hex, session_id, filename)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _evict(self):
+        if len(self._jobs) <= self.max_jobs:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done]:
+            del self._jobs[job_id]
+            if len(self._jobs) <= self.max_jobs:
+                break
+
+    @staticmethod
+    def _run(job, func, args):
+        job._start()
+        try:
+            result = func(*args, progress=job.report)
+        except Exception as e:
+            import traceback
+            print(f"分析任务 {job.id} 出错: {str(e)}")
+            print(f"错误详情: {traceback.format_exc()}")
+            job._finish(error=str(e))
+            return
+        job._finish(result=result)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
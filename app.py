@@ -1,23 +1,92 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context
 import os
+import io
+import csv
 import json
+import math
 import uuid
 import re
+import threading
+from collections import OrderedDict, deque
 import pandas as pd
 from werkzeug.utils import secure_filename
 import excel_analyzer  # 导入现有的分析脚本
 import openpyxl  # 直接导入openpyxl，避免通过excel_analyzer调用
-import xlwings as xw  # 导入xlwings用于Excel计算
+from formula_engine import FormulaEngine  # 进程内公式计算引擎
+from model_cache import ModelCache, model_from_scan  # 工作簿解析模型缓存
+from dependency_graph import DependencyGraph  # 整数化依赖图
+import model_store  # 分析结果持久化
+from level_scheduler import LevelScheduler  # 按拓扑层级并行计算
+from batch_engine import BatchEvaluator, column_value, to_json_value  # 多方案向量化批量计算
+from sensitivity import ForwardDifferentiator, finite_or_none, tornado  # 自动微分敏感性分析
+from goal_seek import goal_seek, GoalSeekError  # 目标求解
+from analysis_jobs import JobManager  # 后台分析任务
+from excel_workers import ExcelWorkerPool, XlwingsBackend, FakeBackend, PoolBusyError  # Excel计算工作线程池
+from compressed_payload import CompressedPayload  # 预先压缩的API响应
+from param_search import ParameterSearchIndex, SearchError, CATEGORIES as SEARCH_CATEGORIES  # 参数搜索索引
+from graph_layout import layered_layout, LAYER_SPACING, NODE_SPACING  # 依赖关系图分层布局
+
+try:
+    import xlwings as xw  # 可选：使用Excel进行计算
+except ImportError:
+    xw = None
 
 # 更新说明：
 # 2023年更新 - 放弃使用formulas库进行计算，改为使用xlwings直接调用Excel进行计算
 # 通过xlwings，我们可以将前端输入的参数传入Excel，让Excel进行计算，
 # 然后读取计算结果返回给前端，实现更准确的计算和更好的兼容性。
+# 后续更新 - 默认使用进程内公式计算引擎（formula_engine），无需安装Excel，
+# 可在Linux服务器上运行；xlwings仅作为可选的计算后端保留（CALC_BACKEND='excel'）。
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['ALLOWED_EXTENSIONS'] = {'xlsx', 'xls'}
+app.config['CALC_BACKEND'] = os.environ.get('CALC_BACKEND', 'python')  # python 或 excel
+app.config['MODEL_CACHE_MAX_ENTRIES'] = 16  # 模型缓存最多保留的工作簿数
+app.config['MODEL_CACHE_MAX_BYTES'] = 512 * 1024 * 1024  # 模型缓存估算内存上限
+app.config['CALC_WORKERS'] = int(os.environ.get('CALC_WORKERS', 1))  # 并行计算的线程/进程数，默认1即串行计算
+app.config['CALC_GRAIN_SIZE'] = int(os.environ.get('CALC_GRAIN_SIZE', 256))  # 每个并行分块的参数数量
+app.config['CALC_EXECUTOR'] = os.environ.get('CALC_EXECUTOR', 'thread')  # thread（受GIL限制，不能加速纯Python求值）或 process
+app.config['ANALYSIS_WORKERS'] = int(os.environ.get('ANALYSIS_WORKERS', 2))  # 同时进行的后台分析任务数
+app.config['EXCEL_BACKEND'] = os.environ.get('EXCEL_BACKEND', 'xlwings')  # xlwings 或 fake（用进程内引擎模拟Excel）
+app.config['EXCEL_WORKERS'] = int(os.environ.get('EXCEL_WORKERS', 2))  # 常驻的Excel进程数
+app.config['EXCEL_QUEUE_SIZE'] = int(os.environ.get('EXCEL_QUEUE_SIZE', 16))  # 排队的Excel计算请求上限
+app.config['EXCEL_MAX_USES'] = int(os.environ.get('EXCEL_MAX_USES', 200))  # 每个Excel进程处理多少次请求后重启
+app.config['EXCEL_TIMEOUT'] = float(os.environ.get('EXCEL_TIMEOUT', 120))  # 等待Excel计算结果的秒数
+
+# 所有API共享的工作簿模型缓存
+model_cache = ModelCache(max_entries=app.config['MODEL_CACHE_MAX_ENTRIES'],
+                         max_bytes=app.config['MODEL_CACHE_MAX_BYTES'],
+                         loader=model_store.load_model)
+
+# 公式引擎按拓扑层级并行计算的调度器（所有模型共享）
+level_scheduler = LevelScheduler(max_workers=app.config['CALC_WORKERS'],
+                                 grain_size=app.config['CALC_GRAIN_SIZE'],
+                                 executor=app.config['CALC_EXECUTOR'])
+
+# 上传文件的后台分析任务
+analysis_jobs = JobManager(max_workers=app.config['ANALYSIS_WORKERS'])
+
+# Excel计算后端的工作线程池，首次使用Excel计算时创建
+excel_pool = None
+excel_pool_lock = threading.Lock()
+
+def get_excel_pool():
+    global excel_pool
+    with excel_pool_lock:
+        if excel_pool is None:
+            if app.config['EXCEL_BACKEND'] == 'fake':
+                backend_factory = lambda: FakeBackend(model_cache.get)
+            else:
+                if xw is None:
+                    raise RuntimeError("未安装xlwings，无法使用Excel计算后端")
+                backend_factory = lambda: XlwingsBackend(xw)
+            excel_pool = ExcelWorkerPool(backend_factory,
+                                         size=app.config['EXCEL_WORKERS'],
+                                         max_queue=app.config['EXCEL_QUEUE_SIZE'],
+                                         max_uses=app.config['EXCEL_MAX_USES'])
+        return excel_pool
 
 # 确保上传目录存在
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
@@ -52,32 +121,72 @@ def upload_file():
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{session_id}_{filename}")
         file.save(file_path)
         
-        try:
-            # 调用excel_analyzer分析文件 - 这会生成优化后的Excel文件
-            all_params = excel_analyzer.analyze_excel(file_path)
-            
-            # 获取优化后的Excel文件路径
-            optimized_file_path = os.path.splitext(file_path)[0] + "_optimized.xlsx"
-            
-            # 检查优化后的文件是否存在
-            if not os.path.exists(optimized_file_path):
-                print(f"警告: 优化后的Excel文件不存在: {optimized_file_path}")
-                print("将使用原始文件继续处理")
-                optimized_file_path = file_path
-            else:
-                print(f"使用优化后的Excel文件: {optimized_file_path}")
-            
-            # 保存优化后的文件路径到会话
-            session['file_path'] = optimized_file_path
-            session['original_file_path'] = file_path
-            session['analyzed'] = True
-            
-            return jsonify({'success': True, 'redirect': url_for('visualize')})
-        except Exception as e:
-            return jsonify({'error': f'分析文件时出错: {str(e)}'}), 500
+        # 分析在后台线程中进行，立即返回任务ID，前端轮询任务进度
+        job = analysis_jobs.submit(session_id, filename, run_analysis, file_path)
+        session['job_id'] = job.id
+        session['analyzed'] = False
+        
+        return jsonify({'success': True, 'job_id': job.id,
+                        'status_url': url_for('get_job_status', job_id=job.id)}), 202
     
     return jsonify({'error': '不支持的文件类型'}), 400
 
+def run_analysis(file_path, progress=None):
+    """后台任务：分析上传的文件、生成优化后的文件并构建持久化的参数模型"""
+    # 调用excel_analyzer分析文件 - 这会生成优化后的Excel文件，并记录写出的参数行
+    output_scan = excel_analyzer.WorkbookScan()
+    excel_analyzer.analyze_excel(file_path, progress=progress, output_scan=output_scan)
+    
+    # 获取优化后的Excel文件路径
+    optimized_file_path = os.path.splitext(file_path)[0] + "_optimized.xlsx"
+    
+    # 检查优化后的文件是否存在
+    if not os.path.exists(optimized_file_path):
+        print(f"警告: 优化后的Excel文件不存在: {optimized_file_path}")
+        print("将使用原始文件继续处理")
+        optimized_file_path = file_path
+    else:
+        print(f"使用优化后的Excel文件: {optimized_file_path}")
+    
+    # 上传时构建并持久化参数模型，之后的请求直接加载持久化文件
+    if progress:
+        progress('indexing')
+    if optimized_file_path != file_path and output_scan.sheets:
+        # 由生成优化文件时记录的参数行直接构建模型，不再重新读取优化后的xlsx
+        model = model_from_scan(optimized_file_path, output_scan)
+        model_store.store_model(model)
+        model = model_cache.put(optimized_file_path, model)
+    else:
+        model = model_cache.get(optimized_file_path)
+    # 预先序列化并压缩参数列表、依赖关系和图布局，构建搜索索引，打开可视化页面时直接返回
+    get_parameters_payload(model)
+    get_dependencies_payload(model)
+    get_layout_payload(model)
+    get_search_index(model)
+    
+    return {'file_path': optimized_file_path, 'original_file_path': file_path,
+            'param_count': len(model.all_params)}
+
+# API: 查询后台分析任务的进度
+@app.route('/api/jobs/<job_id>')
+def get_job_status(job_id):
+    job = analysis_jobs.get(job_id)
+    # 只能查询本会话提交的任务
+    if job is None or job.session_id != session.get('session_id'):
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    
+    status = job.to_dict()
+    if job.status == 'succeeded':
+        # 分析完成后将文件路径保存到会话
+        session['file_path'] = job.result['file_path']
+        session['original_file_path'] = job.result['original_file_path']
+        session['analyzed'] = True
+        status['param_count'] = job.result['param_count']
+        status['redirect'] = url_for('visualize')
+    elif job.status == 'failed':
+        status['error'] = f'分析文件时出错: {job.error}'
+    return jsonify(status)
+
 # 可视化页面路由
 @app.route('/visualize')
 def visualize():
@@ -86,89 +195,128 @@ def visualize():
     
     return render_template('visualization.html')
 
+# 获取当前会话的Excel文件路径
+def get_session_file_path():
+    """
+    返回(文件路径, 错误响应)；优化后的文件不存在时回退到原始文件
+    """
+    if not session.get('file_path'):
+        return None, (jsonify({'error': '找不到已分析的文件'}), 404)
+    
+    file_path = session['file_path']
+    if not os.path.exists(file_path):
+        print(f"文件不存在: {file_path}")
+        # 尝试回退到原始文件
+        if session.get('original_file_path') and os.path.exists(session['original_file_path']):
+            file_path = session['original_file_path']
+            print(f"回退到原始文件: {file_path}")
+        else:
+            return None, (jsonify({'error': f'文件不存在: {file_path}'}), 404)
+    
+    return file_path, None
+
+# 将参数信息转换为可JSON序列化的字典（不修改缓存中共享的模型）
+def param_to_json(param_info):
+    result = dict(param_info)
+    
+    # 将set类型转换为list类型，以便于JSON序列化
+    for field in ('依赖', '依赖描述'):
+        value = result.get(field)
+        result[field] = list(value) if value else []
+    
+    # 确保基本属性存在
+    for field in ('公式', '公式描述', '单位'):
+        if not result.get(field):
+            result[field] = ''
+    if '值' not in result:
+        result['值'] = 0
+    if '有循环依赖' not in result:
+        result['有循环依赖'] = False
+    for field in ('名称', '标识符'):
+        if field not in result:
+            result[field] = param_info.get('名称', '')
+    
+    return result
+
+def send_compressed(payload):
+    """
+    返回预先压缩的响应（CompressedPayload）：按Accept-Encoding选择编码，If-None-Match命中时返回304
+    
+    no-cache要求浏览器每次带ETag重新验证，工作簿未变化时只返回304。
+    """
+    encoding = payload.select_encoding(request.accept_encodings)
+    etag = payload.etag(encoding)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(payload.body(encoding), mimetype=payload.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.update(('Accept-Encoding', 'Cookie'))
+    return response
+
+def compress_json(data):
+    """按jsonify的格式序列化并压缩"""
+    body = app.json.dumps(data, separators=(',', ':')) + '\n'
+    return CompressedPayload(body.encode('utf-8'), mimetype=app.json.mimetype)
+
+def build_parameters(model):
+    """按分类组织参数列表，供前端使用；各分类内按参数在工作簿中的顺序排列，保证同一模型的序列化结果（和ETag）不变"""
+    all_params = model.all_params
+    return {
+        key: [param_to_json(param_info) for param_id, param_info in all_params.items() if param_id in category]
+        for key, category in (('input_params', model.input_params),
+                              ('output_params', model.output_params),
+                              ('intermediate_params', model.intermediate_params),
+                              ('independent_params', model.independent_params))
+    }
+
+def build_dependencies(model):
+    """依赖关系边表（按整数化依赖图逐条输出边）"""
+    all_params = model.all_params
+    graph = model.graph
+    names = [all_params[param_id].get('名称', param_id) for param_id in graph.ids]
+    ids = graph.ids
+    indptr = graph.indptr.tolist()
+    indices = graph.indices.tolist()
+    dependencies = []
+    for source in range(len(ids)):
+        for target in indices[indptr[source]:indptr[source + 1]]:
+            dependencies.append({
+                'source': names[source],
+                'source_id': ids[source],
+                'target': names[target],
+                'target_id': ids[target]
+            })
+    return dependencies
+
+def get_parameters_payload(model):
+    """参数列表的压缩响应，每个模型版本只序列化一次"""
+    return model.derived('parameters_payload', lambda m: compress_json(build_parameters(m)))
+
+def get_dependencies_payload(model):
+    """依赖关系的压缩响应，每个模型版本只序列化一次"""
+    return model.derived('dependencies_payload', lambda m: compress_json(build_dependencies(m)))
+
 # API: 获取所有参数及其分类
 @app.route('/api/parameters')
 def get_parameters():
-    if not session.get('file_path'):
-        return jsonify({'error': '找不到已分析的文件'}), 404
+    file_path, error_response = get_session_file_path()
+    if error_response:
+        return error_response
     
     try:
-        file_path = session['file_path']
-        print(f"正在加载优化后的文件: {file_path}")
-        
-        if not os.path.exists(file_path):
-            print(f"文件不存在: {file_path}")
-            # 尝试回退到原始文件
-            if session.get('original_file_path') and os.path.exists(session['original_file_path']):
-                file_path = session['original_file_path']
-                print(f"回退到原始文件: {file_path}")
-            else:
-                return jsonify({'error': f'文件不存在: {file_path}'}), 404
-        
         try:
-            # 重新加载Excel工作簿，确保数据是最新的
-            wb = openpyxl.load_workbook(file_path, data_only=True)
-            wb_formulas = openpyxl.load_workbook(file_path, data_only=False)
-            
-            # 打印工作表信息进行调试
-            print(f"工作表列表: {wb.sheetnames}")
-            
-            # 收集参数信息
-            all_params, formula_dependencies = excel_analyzer.collect_params_and_dependencies(wb_formulas, wb, {})
+            model = model_cache.get(file_path)
             
             # 检查结果
-            if not all_params:
+            if not model.all_params:
                 print("没有找到任何参数")
                 return jsonify({'error': '没有找到任何参数，请检查Excel文件格式是否正确'}), 400
             
-            print(f"找到 {len(all_params)} 个参数")
-            
-            # 对参数进行分类
-            input_params, output_params, intermediate_params, independent_params = excel_analyzer.categorize_parameters(all_params, formula_dependencies)
-            
-            # 将所有参数中的set类型转换为list类型，以便于JSON序列化
-            def convert_sets_to_lists(params_dict):
-                for param_id, param_info in params_dict.items():
-                    if "依赖" in param_info and isinstance(param_info["依赖"], set):
-                        param_info["依赖"] = list(param_info["依赖"])
-                    if "依赖描述" in param_info and isinstance(param_info["依赖描述"], set):
-                        param_info["依赖描述"] = list(param_info["依赖描述"])
-                return params_dict
-            
-            # 转换所有参数中的set为list
-            all_params = convert_sets_to_lists(all_params)
-            
-            # 确保参数结构一致性
-            def normalize_param_info(param_info):
-                # 确保基本属性存在
-                required_fields = ['名称', '标识符', '单位', '值', '公式', '公式描述', '依赖', '依赖描述', '有循环依赖']
-                for field in required_fields:
-                    if field not in param_info:
-                        if field in ['依赖', '依赖描述']:
-                            param_info[field] = []
-                        elif field in ['公式', '公式描述', '单位']:
-                            param_info[field] = ''
-                        elif field == '值':
-                            param_info[field] = 0
-                        elif field == '有循环依赖':
-                            param_info[field] = False
-                        else:
-                            param_info[field] = param_info.get('名称', '')
-                return param_info
-            
-            # 标准化每个参数的信息
-            for param_id in all_params:
-                all_params[param_id] = normalize_param_info(all_params[param_id])
-            
-            # 组织数据以便前端使用
-            parameters = {
-                'input_params': [all_params[param_id] for param_id in input_params],
-                'output_params': [all_params[param_id] for param_id in output_params],
-                'intermediate_params': [all_params[param_id] for param_id in intermediate_params],
-                'independent_params': [all_params[param_id] for param_id in independent_params]
-            }
-            
-            return jsonify(parameters)
+            return send_compressed(get_parameters_payload(model))
         except openpyxl.utils.exceptions.InvalidFileException as e:
             print(f"无效的Excel文件: {str(e)}")
             return jsonify({'error': f'无效的Excel文件格式，请确保文件可以正常在Excel中打开: {str(e)}'}), 400
@@ -179,134 +327,236 @@ def get_parameters():
         print(f"错误详情: {error_details}")
         return jsonify({'error': f'获取参数时出错: {str(e)}'}), 500
 
+# 参数查询每页默认返回的参数数
+SEARCH_PAGE_SIZE = 50
+
+def get_param_category(model, param_id):
+    """参数所属的分类：input、output、intermediate或independent"""
+    for category, members in zip(SEARCH_CATEGORIES, (model.input_params, model.output_params,
+                                                     model.intermediate_params, model.independent_params)):
+        if param_id in members:
+            return category
+    return None
+
+def get_search_index(model):
+    """参数搜索索引，每个模型版本只构建一次"""
+    return model.derived('search_index', ParameterSearchIndex)
+
+# API: 分页查询参数（按分类、工作表、循环依赖标记过滤，按名称前缀或子串匹配）
+@app.route('/api/parameters/search')
+def search_parameters():
+    file_path, error_response = get_session_file_path()
+    if error_response:
+        return error_response
+    
+    try:
+        model = model_cache.get(file_path)
+        index = get_search_index(model)
+        
+        categories = [item for item in request.args.get('category', '').split(',') if item]
+        circular = request.args.get('circular', '').lower()
+        circular = {'1': True, 'true': True, '0': False, 'false': False}.get(circular)
+        
+        param_ids, param_categories, next_cursor, total = index.search(
+            query=request.args.get('q', ''),
+            match=request.args.get('match', 'substring'),
+            categories=categories or None,
+            sheet=request.args.get('sheet') or None,
+            circular=circular,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', SEARCH_PAGE_SIZE, type=int)
+        )
+        
+        items = []
+        for param_id, category in zip(param_ids, param_categories):
+            item = param_to_json(model.all_params[param_id])
+            item['category'] = category
+            items.append(item)
+        
+        return jsonify({
+            'items': items,
+            'next_cursor': next_cursor,
+            'total': total,
+            'model_size': len(index),
+            'sheets': index.sheets
+        })
+    except SearchError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"查询参数时出错: {str(e)}")
+        print(f"错误详情: {error_details}")
+        return jsonify({'error': f'查询参数时出错: {str(e)}'}), 500
+
 # API: 获取依赖关系
 @app.route('/api/dependencies')
 def get_dependencies():
-    if not session.get('file_path'):
-        return jsonify({'error': '找不到已分析的文件'}), 404
+    file_path, error_response = get_session_file_path()
+    if error_response:
+        return error_response
     
     try:
-        file_path = session['file_path']
-        print(f"正在加载依赖关系的文件: {file_path}")
-        
-        if not os.path.exists(file_path):
-            print(f"文件不存在: {file_path}")
-            # 尝试回退到原始文件
-            if session.get('original_file_path') and os.path.exists(session['original_file_path']):
-                file_path = session['original_file_path']
-                print(f"回退到原始文件: {file_path}")
-            else:
-                return jsonify({'error': f'文件不存在: {file_path}'}), 404
+        model = model_cache.get(file_path)
+        return send_compressed(get_dependencies_payload(model))
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"获取依赖关系时出错: {str(e)}")
+        print(f"错误详情: {error_details}")
+        return jsonify({'error': f'获取依赖关系时出错: {str(e)}'}), 500
+
+def get_graph_layout(model):
+    """依赖关系图的分层布局（GraphLayout），每个模型版本只计算一次"""
+    return model.derived('layout', lambda m: layered_layout(m.graph))
+
+def build_layout(model):
+    """布局按列输出：ids[i]的坐标为(x[i], y[i])，所在层为layer[i]"""
+    layout = get_graph_layout(model)
+    return {
+        'ids': model.graph.ids,
+        'x': layout.x.round().astype(int).tolist(),
+        'y': layout.y.round().astype(int).tolist(),
+        'layer': layout.layer.tolist(),
+        'layers': layout.layer_count,
+        'layer_spacing': LAYER_SPACING,
+        'node_spacing': NODE_SPACING,
+        'crossings': {'before': layout.crossings_before, 'after': layout.crossings_after}
+    }
+
+def get_layout_payload(model):
+    """图布局的压缩响应，每个模型版本只序列化一次"""
+    return model.derived('layout_payload', lambda m: compress_json(build_layout(m)))
+
+# API: 获取依赖关系图的分层布局
+@app.route('/api/layout')
+def get_layout():
+    file_path, error_response = get_session_file_path()
+    if error_response:
+        return error_response
+    
+    try:
+        model = model_cache.get(file_path)
+        return send_compressed(get_layout_payload(model))
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"获取图布局时出错: {str(e)}")
+        print(f"错误详情: {error_details}")
+        return jsonify({'error': f'获取图布局时出错: {str(e)}'}), 500
+
+# 子图每个方向最多展开的跳数
+SUBGRAPH_MAX_HOPS = 50
+
+# API: 获取参数上下游k跳以内的子图
+@app.route('/api/subgraph')
+def get_subgraph():
+    file_path, error_response = get_session_file_path()
+    if error_response:
+        return error_response
+    
+    try:
+        center = request.args.get('center')
+        if not center:
+            return jsonify({'error': '缺少参数: center'}), 400
+        try:
+            up = int(request.args.get('up', 1))
+            down = int(request.args.get('down', 1))
+            max_nodes = int(request.args.get('max_nodes', DEPENDENCY_GRAPH_MAX_NODES))
+        except ValueError:
+            return jsonify({'error': 'up、down和max_nodes必须是整数'}), 400
+        up = min(max(up, 0), SUBGRAPH_MAX_HOPS)
+        down = min(max(down, 0), SUBGRAPH_MAX_HOPS)
+        max_nodes = min(max(max_nodes, 1), DEPENDENCY_GRAPH_MAX_NODES)
         
-        # 重新加载Excel工作簿
-        wb = openpyxl.load_workbook(file_path, data_only=True)
-        wb_formulas = openpyxl.load_workbook(file_path, data_only=False)
+        model = model_cache.get(file_path)
+        graph = model.graph
+        if center not in graph.index:
+            return jsonify({'error': f'参数 {center} 不存在'}), 404
         
-        # 收集参数信息和依赖关系
-        all_params, formula_dependencies = excel_analyzer.collect_params_and_dependencies(wb_formulas, wb, {})
+        # 按模型缓存的正向和反向邻接数组上做有限跳数的广度优先，不遍历整个依赖图
+        nodes, hops, truncated = graph.neighborhood(graph.index[center], up, down, max_nodes=max_nodes)
+        sources, targets = graph.induced_edges(nodes)
         
-        # 检查数据结构
-        if not formula_dependencies or not isinstance(formula_dependencies, dict):
-            print("警告: 依赖关系数据不是预期的字典格式")
-            formula_dependencies = {}
+        all_params = model.all_params
+        ids = graph.ids
+        node_list = []
+        for node, hop in zip(nodes.tolist(), hops.tolist()):
+            node_id = ids[node]
+            node_info = all_params[node_id]
+            node_list.append({
+                'id': node_id,
+                'name': node_info.get('名称', node_id),
+                'value': node_info.get('值', 0),
+                'unit': node_info.get('单位', ''),
+                'category': get_param_category(model, node_id),
+                'hops': hop,
+                'has_circular_dependency': node_info.get('有循环依赖', False)
+            })
         
-        # 格式化依赖关系
-        dependencies = []
-        for param_id, deps in formula_dependencies.items():
-            # 确保deps是列表或集合类型
-            if not deps:
-                continue
-                
-            deps_list = list(deps) if isinstance(deps, set) else deps
-            
-            source_name = "未知参数"
-            if param_id in all_params:
-                source_name = all_params[param_id].get('名称', param_id)
-            
-            for dep_id in deps_list:
-                target_name = "未知参数"
-                if dep_id in all_params:
-                    target_name = all_params[dep_id].get('名称', dep_id)
-                
-                dependencies.append({
-                    'source': source_name,
-                    'source_id': param_id,
-                    'target': target_name,
-                    'target_id': dep_id
-                })
-        
-        return jsonify(dependencies)
+        return jsonify({
+            'center': center,
+            'up': up,
+            'down': down,
+            'nodes': node_list,
+            'edges': [{'source': ids[source], 'target': ids[target]}
+                      for source, target in zip(sources.tolist(), targets.tolist())],
+            'truncated': truncated,
+            'max_nodes': max_nodes
+        })
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
-        print(f"获取依赖关系时出错: {str(e)}")
+        print(f"获取子图时出错: {str(e)}")
         print(f"错误详情: {error_details}")
-        return jsonify({'error': f'获取依赖关系时出错: {str(e)}'}), 500
+        return jsonify({'error': f'获取子图时出错: {str(e)}'}), 500
 
 # API: 获取特定参数的详细信息
 @app.route('/api/parameter_details/<param_id>')
 def get_parameter_details(param_id):
-    if not session.get('file_path'):
-        return jsonify({'error': '找不到已分析的文件'}), 404
+    file_path, error_response = get_session_file_path()
+    if error_response:
+        return error_response
     
     try:
-        file_path = session['file_path']
         print(f"正在获取参数详情的文件: {file_path}")
         
-        if not os.path.exists(file_path):
-            print(f"文件不存在: {file_path}")
-            # 尝试回退到原始文件
-            if session.get('original_file_path') and os.path.exists(session['original_file_path']):
-                file_path = session['original_file_path']
-                print(f"回退到原始文件: {file_path}")
-            else:
-                return jsonify({'error': f'文件不存在: {file_path}'}), 404
-            
-        # 重新加载Excel工作簿
-        wb = openpyxl.load_workbook(file_path, data_only=True)
-        wb_formulas = openpyxl.load_workbook(file_path, data_only=False)
-        
-        # 收集参数信息
-        all_params, formula_dependencies = excel_analyzer.collect_params_and_dependencies(wb_formulas, wb, {})
+        model = model_cache.get(file_path)
+        all_params = model.all_params
+        formula_dependencies = model.formula_dependencies
         
         if param_id not in all_params:
             return jsonify({'error': '找不到指定的参数'}), 404
         
-        param_info = all_params[param_id]
-        
-        # 将set类型转换为list类型，以便于JSON序列化
-        if "依赖" in param_info and isinstance(param_info["依赖"], set):
-            param_info["依赖"] = list(param_info["依赖"])
-        if "依赖描述" in param_info and isinstance(param_info["依赖描述"], set):
-            param_info["依赖描述"] = list(param_info["依赖描述"])
-        
-        # 获取依赖链
-        dependency_chain = get_dependency_chain(param_id, all_params, formula_dependencies)
+        param_info = param_to_json(all_params[param_id])
         
-        # 确保参数信息完整
-        name = param_info.get('名称', param_id)
-        value = param_info.get('值', 0)
-        unit = param_info.get('单位', '')
-        formula = param_info.get('公式', '')
-        formula_description = param_info.get('公式描述', '')
-        dependencies = param_info.get('依赖', [])
-        dependency_names = param_info.get('依赖描述', [])
-        has_circular_dependency = param_info.get('有循环依赖', False)
+        # 上游依赖以去重后的节点表和边表返回；tree=1时返回原有的嵌套依赖链
+        max_depth = request.args.get('max_depth', type=int)
+        max_nodes = request.args.get('max_nodes', DEPENDENCY_GRAPH_MAX_NODES, type=int)
+        as_tree = request.args.get('tree', '').lower() in ('1', 'true')
         
         # 构建详细信息
         details = {
             'id': param_id,
-            'name': name,
-            'value': value,
-            'unit': unit,
-            'formula': formula,
-            'formula_description': formula_description,
-            'dependencies': dependencies,
-            'dependency_names': dependency_names,
-            'dependency_chain': dependency_chain,
-            'has_circular_dependency': has_circular_dependency
+            'name': param_info['名称'],
+            'value': param_info['值'],
+            'unit': param_info['单位'],
+            'formula': param_info['公式'],
+            'formula_description': param_info['公式描述'],
+            'dependencies': param_info['依赖'],
+            'dependency_names': param_info['依赖描述'],
+            'has_circular_dependency': param_info['有循环依赖'],
+            'category': get_param_category(model, param_id)
         }
         
+        if as_tree:
+            details['dependency_chain'] = get_memoized_dependency_chain(model, param_id)
+        else:
+            details['dependency_graph'] = get_dependency_graph(param_id, all_params, formula_dependencies,
+                                                               max_depth=max_depth, max_nodes=max_nodes,
+                                                               graph=model.graph,
+                                                               category_of=lambda node_id: get_param_category(model, node_id))
+        
         return jsonify(details)
     except Exception as e:
         import traceback
@@ -315,8 +565,102 @@ def get_parameter_details(param_id):
         print(f"错误详情: {error_details}")
         return jsonify({'error': f'获取参数详细信息时出错: {str(e)}'}), 500
 
+# API: 模型缓存统计
+@app.route('/api/cache/stats')
+def get_cache_stats():
+    return jsonify(model_cache.stats())
+
+# API: Excel计算工作线程池状态
+@app.route('/api/excel/stats')
+def get_excel_stats():
+    if excel_pool is None:
+        return jsonify({'size': 0, 'pending': 0, 'workers': []})
+    return jsonify(excel_pool.stats())
+
+# 依赖图默认最多返回的节点数
+DEPENDENCY_GRAPH_MAX_NODES = 5000
+
+def get_dependency_graph(param_id, all_params, formula_dependencies, max_depth=None, max_nodes=DEPENDENCY_GRAPH_MAX_NODES,
+                         graph=None, category_of=None):
+    """
+    按广度优先获取参数的上游依赖闭包，每个参数只出现一次
+    
+    Args:
+        param_id: 起始参数ID
+        max_depth: 最大展开层数，None表示不限
+        max_nodes: 最多返回的节点数（含起始参数），None表示不限
+        graph: 按all_params编号的DependencyGraph，为None时临时构建
+        category_of: category_of(参数ID)返回参数分类，不为None时每个节点带category字段
+    
+    Returns:
+        {'nodes': [...], 'edges': [{'source': 参数ID, 'target': 其依赖的参数ID}], 'truncated': 是否因限制被截断}
+    """
+    if graph is None:
+        graph = DependencyGraph.from_dependencies(all_params, formula_dependencies)
+    ids = graph.ids
+    
+    def make_node(node, depth):
+        node_id = ids[node]
+        node_info = all_params[node_id]
+        result = {
+            'id': node_id,
+            'name': node_info.get('名称', node_id),
+            'value': node_info.get('值', 0),
+            'unit': node_info.get('单位', ''),
+            'depth': depth,
+            'has_circular_dependency': node_info.get('有循环依赖', False)
+        }
+        if category_of is not None:
+            result['category'] = category_of(node_id)
+        return result
+    
+    start = graph.index[param_id]
+    depth_of = {start: 0}
+    nodes = [make_node(start, 0)]
+    edges = []
+    truncated = False
+    queue = deque([start])
+    
+    while queue:
+        current = queue.popleft()
+        deps = graph.dependencies(current).tolist()
+        if not deps:
+            continue
+        
+        depth = depth_of[current]
+        if max_depth is not None and depth >= max_depth:
+            truncated = True
+            continue
+        
+        for dep in deps:
+            if dep not in depth_of:
+                if max_nodes is not None and len(nodes) >= max_nodes:
+                    truncated = True
+                    continue
+                depth_of[dep] = depth + 1
+                nodes.append(make_node(dep, depth + 1))
+                queue.append(dep)
+            edges.append({'source': ids[current], 'target': ids[dep]})
+    
+    return {
+        'nodes': nodes,
+        'edges': edges,
+        'truncated': truncated,
+        'max_depth': max_depth,
+        'max_nodes': max_nodes
+    }
+
+def get_memoized_dependency_chain(model, param_id):
+    """
+    获取嵌套形式的依赖链，按模型缓存不在循环依赖中的参数的子树
+    
+    不在循环中的参数，其上游不可能包含它的任何下游参数，因此子树与递归路径无关，可以直接复用。
+    """
+    memo = model.derived('dependency_chain_memo', lambda m: {})
+    return get_dependency_chain(param_id, model.all_params, model.formula_dependencies, memo=memo, graph=model.graph)
+
 # 递归获取依赖链
-def get_dependency_chain(param_id, all_params, formula_dependencies, visited=None):
+def get_dependency_chain(param_id, all_params, formula_dependencies, visited=None, memo=None, graph=None):
     """
     递归获取参数依赖链，添加循环检测以避免无限递归
     
@@ -325,121 +669,107 @@ def get_dependency_chain(param_id, all_params, formula_dependencies, visited=Non
         all_params: 所有参数信息
         formula_dependencies: 参数依赖关系
         visited: 已访问的参数ID集合，用于检测循环依赖
+        memo: {参数ID: 依赖链}，缓存不在循环依赖中的参数的子树
+        graph: 按all_params编号的DependencyGraph，为None时临时构建
     """
+    if graph is None:
+        graph = DependencyGraph.from_dependencies(all_params, formula_dependencies)
+    memoizable = memo is not None and not all_params.get(param_id, {}).get('有循环依赖', False)
+    if memoizable and param_id in memo:
+        return memo[param_id]
+    chain = _build_dependency_chain(param_id, all_params, graph, visited, memo)
+    if memoizable:
+        memo[param_id] = chain
+    return chain
+
+def _build_dependency_chain(param_id, all_params, graph, visited, memo):
     # 初始化已访问集合（仅在顶层调用时）
     if visited is None:
         visited = set()
     
-    # 检查formula_dependencies是否为有效字典
-    if not isinstance(formula_dependencies, dict):
-        print(f"警告: formula_dependencies不是字典类型: {type(formula_dependencies)}")
-        return []
-    
-    # 如果参数不在依赖关系中或已被访问（循环依赖），返回空列表
-    if param_id not in formula_dependencies or param_id in visited:
+    # 如果参数不在依赖图中或已被访问（循环依赖），返回空列表
+    node = graph.index.get(param_id)
+    if node is None or param_id in visited:
         return []
     
-    # 检查依赖项是否为有效集合或列表
-    deps = formula_dependencies.get(param_id, [])
+    deps = graph.to_ids(graph.dependencies(node))
     if not deps:
         return []
-        
-    # 确保deps是列表类型
-    if isinstance(deps, set):
-        deps = list(deps)
-    elif not isinstance(deps, list):
-        print(f"警告: 依赖项不是集合或列表类型: {type(deps)}")
-        return []
     
     # 标记当前参数为已访问
     visited.add(param_id)
     
     chain = []
     for dep_id in deps:
-        if dep_id in all_params:
-            # 检查是否形成循环
-            is_cycle = dep_id in visited
-            
-            # 安全获取参数信息
-            dep_name = all_params[dep_id].get('名称', dep_id)
-            dep_value = all_params[dep_id].get('值', 0)
-            dep_unit = all_params[dep_id].get('单位', '')
-            
-            dep_info = {
-                'id': dep_id,
-                'name': dep_name,
-                'value': dep_value,
-                'unit': dep_unit,
-                'is_cycle': is_cycle  # 添加循环标记
-            }
+        # 检查是否形成循环
+        is_cycle = dep_id in visited
+        
+        # 安全获取参数信息
+        dep_name = all_params[dep_id].get('名称', dep_id)
+        dep_value = all_params[dep_id].get('值', 0)
+        dep_unit = all_params[dep_id].get('单位', '')
+        
+        dep_info = {
+            'id': dep_id,
+            'name': dep_name,
+            'value': dep_value,
+            'unit': dep_unit,
+            'is_cycle': is_cycle  # 添加循环标记
+        }
+        
+        # 只有非循环依赖才继续递归
+        if not is_cycle:
+            # 创建visited的副本进行递归，避免跨分支影响
+            dep_info['children'] = get_dependency_chain(dep_id, all_params, None, visited.copy(), memo, graph)
+        else:
+            dep_info['children'] = []  # 循环依赖不再展开
             
-            # 只有非循环依赖才继续递归
-            if not is_cycle:
-                # 创建visited的副本进行递归，避免跨分支影响
-                dep_info['children'] = get_dependency_chain(dep_id, all_params, formula_dependencies, visited.copy())
-            else:
-                dep_info['children'] = []  # 循环依赖不再展开
-                
-            chain.append(dep_info)
+        chain.append(dep_info)
     
     return chain
 
 # API: 计算参数值
 @app.route('/api/calculate', methods=['POST'])
 def calculate_parameters():
-    if not session.get('file_path'):
-        return jsonify({'error': '找不到已分析的文件'}), 404
+    file_path, error_response = get_session_file_path()
+    if error_response:
+        return error_response
     
     try:
         # 获取输入参数值
         input_values = request.json
-        file_path = session['file_path']
         print(f"正在进行参数计算的文件: {file_path}")
         
-        if not os.path.exists(file_path):
-            print(f"文件不存在: {file_path}")
-            # 尝试回退到原始文件
-            if session.get('original_file_path') and os.path.exists(session['original_file_path']):
-                file_path = session['original_file_path']
-                print(f"回退到原始文件: {file_path}")
-            else:
-                return jsonify({'error': f'文件不存在: {file_path}'}), 404
-        
-        # 重新加载Excel工作簿（仅用于分析，不进行计算）
-        wb = openpyxl.load_workbook(file_path, data_only=True)
-        wb_formulas = openpyxl.load_workbook(file_path, data_only=False)
-        
-        # 收集参数信息和依赖关系
-        all_params, formula_dependencies = excel_analyzer.collect_params_and_dependencies(wb_formulas, wb, {})
-        
         # 检查并处理输入值
         if not input_values or not isinstance(input_values, dict):
             print("警告: 输入值格式不正确")
             input_values = {}
         
+        if app.config['CALC_BACKEND'] != 'excel':
+            # 使用进程内公式引擎增量计算
+            calculated_values = calculate_values_incremental(file_path, input_values)
+            return jsonify({'calculated_values': calculated_values})
+        
+        # 复制缓存中的参数信息，避免修改共享模型
+        model = model_cache.get(file_path)
+        all_params = {param_id: dict(param_info) for param_id, param_info in model.all_params.items()}
+        formula_dependencies = model.formula_dependencies
+        
         # 更新输入参数值
         for param_id, value in input_values.items():
             if param_id in all_params:
-                try:
-                    # 尝试转换为数值类型，但保留字符串格式
-                    if isinstance(value, str) and (":" in value):
-                        # 对于包含冒号的字符串，保持原始格式
-                        all_params[param_id]['值'] = value
-                    else:
-                        # 尝试转换为数值
-                        all_params[param_id]['值'] = float(value)
-                except (ValueError, TypeError):
-                    print(f"警告: 无法将输入值转换为数字: param_id={param_id}, value={value}")
-                    # 对于无法转换的值，保持原始格式
-                    all_params[param_id]['值'] = value
+                all_params[param_id]['值'] = parse_input_value(param_id, value)
         
         # 按依赖关系顺序计算所有参数值
-        sorted_params = topological_sort(all_params, formula_dependencies)
+        sorted_params = topological_sort(all_params, formula_dependencies, model.graph)
         
-        # 使用xlwings进行Excel直接计算（不再使用formulas库）
-        calculated_values = calculate_values(sorted_params, all_params, formula_dependencies)
+        # 使用Excel工作线程池计算
+        calculated_values = calculate_values(sorted_params, all_params, formula_dependencies, model.graph)
         
         return jsonify({'calculated_values': calculated_values})
+    except PoolBusyError as e:
+        print(f"Excel计算繁忙: {str(e)}")
+        return jsonify({'error': 'Excel计算繁忙，请稍后重试'}), 503, {'Retry-After': '5'}
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
@@ -447,215 +777,439 @@ def calculate_parameters():
         print(f"错误详情: {error_details}")
         return jsonify({'error': f'计算参数值时出错: {str(e)}'}), 500
 
+# 单次批量计算最多的方案数
+MAX_BATCH_SCENARIOS = 100000
+
+# API: 批量计算多组输入方案
+@app.route('/api/calculate_batch', methods=['POST'])
+def calculate_batch():
+    """
+    请求体: {"inputs": [输入参数ID, ...], "values": [[方案1的输入值, ...], ...]}
+    每个公式在所有方案上向量化计算一次；?format=csv 时以CSV流式返回结果
+    """
+    file_path, error_response = get_session_file_path()
+    if error_response:
+        return error_response
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        input_ids = data.get('inputs') or []
+        rows = data.get('values') or []
+        output_format = request.args.get('format', data.get('format', 'json'))
+        print(f"正在进行批量计算的文件: {file_path}")
+        
+        model = model_cache.get(file_path)
+        unknown = [param_id for param_id in input_ids if param_id not in model.input_params]
+        if unknown:
+            return jsonify({'error': f'不是输入参数: {", ".join(map(str, unknown))}'}), 400
+        if not isinstance(rows, list) or any(not isinstance(row, list) or len(row) != len(input_ids) for row in rows):
+            return jsonify({'error': '每个方案的输入值个数必须与输入参数个数一致'}), 400
+        if len(rows) > MAX_BATCH_SCENARIOS:
+            return jsonify({'error': f'方案数超过上限 {MAX_BATCH_SCENARIOS}'}), 400
+        
+        engine = get_formula_engine(model)
+        rows = [[parse_input_value(param_id, value) for param_id, value in zip(input_ids, row)] for row in rows]
+        evaluator = BatchEvaluator(engine)
+        columns = evaluator.run(input_ids, rows)
+        print(f"批量计算: {len(rows)} 个方案，{evaluator.vectorized} 个公式向量化计算，"
+              f"{evaluator.fallbacks} 次逐方案计算")
+        
+        result_set = model.intermediate_params | model.output_params
+        output_ids = [param_id for param_id in engine.order if param_id in result_set]
+        result_columns = [(columns.get(param_id), evaluator.errors.get(param_id, {})) for param_id in output_ids]
+        
+        def scenario_rows():
+            for i, row in enumerate(rows):
+                # 出错的方案在数值列中为NaN，实际的错误值保存在evaluator.errors中
+                yield row + [to_json_value(errors[i] if i in errors else column_value(column, i))
+                             for column, errors in result_columns]
+        
+        if output_format == 'csv':
+            def generate():
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(list(input_ids) + output_ids)
+                for i, row in enumerate(scenario_rows()):
+                    writer.writerow(row)
+                    if i % 1000 == 999:
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+                yield buffer.getvalue()
+            
+            return Response(stream_with_context(generate()), mimetype='text/csv',
+                            headers={'Content-Disposition': 'attachment; filename=batch_results.csv'})
+        
+        return jsonify({
+            'inputs': input_ids,
+            'outputs': output_ids,
+            'columns': list(input_ids) + output_ids,
+            'results': list(scenario_rows())
+        })
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"批量计算时出错: {str(e)}")
+        print(f"错误详情: {error_details}")
+        return jsonify({'error': f'批量计算时出错: {str(e)}'}), 500
+
+# API: 敏感性分析
+@app.route('/api/sensitivity')
+def get_sensitivity():
+    """
+    在当前计算结果处用前向模式自动微分求输入参数对输出参数的偏导数
+    
+    ?output=参数ID 时返回该参数的龙卷风图数据（按输入变化±change%时输出的线性变化幅度排序）；
+    不指定时返回所有输出参数对输入参数的雅可比矩阵（只包含非零偏导数）
+    """
+    file_path, error_response = get_session_file_path()
+    if error_response:
+        return error_response
+    
+    try:
+        output_id = request.args.get('output')
+        relative_change = request.args.get('change', 10, type=float) / 100
+        print(f"正在进行敏感性分析的文件: {file_path}")
+        
+        state, _ = get_calculation_state(file_path)
+        model = state['model']
+        engine = get_formula_engine(model)
+        all_params = model.all_params
+        if output_id is not None and output_id not in engine.compiled:
+            return jsonify({'error': f'参数 {output_id} 不存在或没有公式'}), 400
+        
+        with state['lock']:
+            values = dict(state['values'])
+        
+        differentiator = ForwardDifferentiator(engine)
+        if output_id is None:
+            targets = [param_id for param_id in engine.order if param_id in model.output_params]
+            input_ids = [param_id for param_id in engine.order if param_id in model.input_params]
+        else:
+            targets = [output_id]
+            upstream = engine.upstream(targets)
+            input_ids = [param_id for param_id in engine.order
+                         if param_id in model.input_params and param_id in upstream]
+        tangents = differentiator.run(values, input_ids, targets=targets)
+        print(f"敏感性分析: {len(input_ids)} 个输入，{differentiator.evaluated} 个参数求导")
+        
+        if output_id is None:
+            jacobian = {}
+            for param_id in targets:
+                gradient = tangents.get(param_id) or {}
+                jacobian[param_id] = {input_ids[i]: finite_or_none(derivative)
+                                      for i, derivative in gradient.items() if derivative != 0}
+            return jsonify({'inputs': input_ids, 'outputs': targets, 'jacobian': jacobian})
+        
+        output_info = all_params[output_id]
+        output_value = differentiator.values.get(output_id)
+        rows = tornado(output_value, input_ids, values, tangents.get(output_id), relative_change)
+        for row in rows:
+            param_info = all_params[row['id']]
+            row['name'] = param_info.get('名称', row['id'])
+            row['unit'] = param_info.get('单位', '')
+        
+        return jsonify({
+            'output': {
+                'id': output_id,
+                'name': output_info.get('名称', output_id),
+                'unit': output_info.get('单位', ''),
+                'value': output_value
+            },
+            'change': relative_change,
+            'inputs': rows
+        })
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"敏感性分析时出错: {str(e)}")
+        print(f"错误详情: {error_details}")
+        return jsonify({'error': f'敏感性分析时出错: {str(e)}'}), 500
+
+# API: 目标求解
+@app.route('/api/goal_seek', methods=['POST'])
+def goal_seek_parameters():
+    """
+    请求体: {"output": 参数ID, "target": 目标值, "inputs": [{"id": 输入参数ID, "min": 下限, "max": 上限}, ...]}
+    以当前计算结果为起点，调整可变输入使输出参数等于目标值；只返回求解结果，不修改当前计算状态
+    """
+    file_path, error_response = get_session_file_path()
+    if error_response:
+        return error_response
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        output_id = data.get('output')
+        inputs = [item if isinstance(item, dict) else {'id': item} for item in data.get('inputs') or []]
+        print(f"正在进行目标求解的文件: {file_path}")
+        
+        try:
+            target = float(data.get('target'))
+            tolerance = float(data.get('tolerance', 1e-9))
+        except (TypeError, ValueError):
+            return jsonify({'error': '目标值必须是数值'}), 400
+        if not math.isfinite(target):
+            return jsonify({'error': '目标值必须是有限的数值'}), 400
+        if not math.isfinite(tolerance) or tolerance < 0:
+            return jsonify({'error': '容差必须是非负的有限数值'}), 400
+        
+        state, _ = get_calculation_state(file_path)
+        model = state['model']
+        engine = get_formula_engine(model)
+        if output_id not in engine.compiled:
+            return jsonify({'error': f'参数 {output_id} 不存在或没有公式'}), 400
+        if not inputs:
+            return jsonify({'error': '请至少选择一个可变输入参数'}), 400
+        unknown = [item.get('id') for item in inputs if item.get('id') not in model.input_params]
+        if unknown:
+            return jsonify({'error': f'不是输入参数: {", ".join(map(str, unknown))}'}), 400
+        
+        with state['lock']:
+            values = dict(state['values'])
+        
+        try:
+            result = goal_seek(engine, values, output_id, target, inputs, tolerance)
+        except GoalSeekError as e:
+            return jsonify({'error': str(e)}), 400
+        print(f"目标求解({result['method']}): {'收敛' if result['converged'] else '未收敛'}，"
+              f"{result['iterations']} 次迭代，{result['evaluations']} 次试算")
+        
+        result['output'] = output_id
+        result['target'] = target
+        return jsonify(result)
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"目标求解时出错: {str(e)}")
+        print(f"错误详情: {error_details}")
+        return jsonify({'error': f'目标求解时出错: {str(e)}'}), 500
+
 # 拓扑排序 - 确保按依赖顺序计算参数
-def topological_sort(all_params, formula_dependencies):
+def topological_sort(all_params, formula_dependencies, graph=None):
     """
-    使用Kahn算法进行拓扑排序，能够处理循环依赖的情况
+    按整数化依赖图的Kahn分层进行拓扑排序，被依赖的参数排在依赖它的参数之前，能够处理循环依赖的情况
+    
+    graph为按all_params编号的DependencyGraph，为None时临时构建。
     """
     # 检查参数和依赖关系是否有效
     if not isinstance(all_params, dict) or not isinstance(formula_dependencies, dict):
         print(f"警告: 无效的数据结构 - all_params: {type(all_params)}, formula_dependencies: {type(formula_dependencies)}")
         # 直接返回参数ID列表，无法排序
         return list(all_params.keys())
-        
-    # 创建入度表
-    in_degree = {param_id: 0 for param_id in all_params}
     
-    # 计算每个节点的入度
-    for param_id, deps in formula_dependencies.items():
-        # 确保deps是集合或列表
-        if not deps:
-            continue
-            
-        deps_list = list(deps) if isinstance(deps, set) else deps
-        if not isinstance(deps_list, list):
-            print(f"警告: 依赖项不是有效的集合或列表: {type(deps)}")
-            continue
-            
-        for dep_id in deps_list:
-            if dep_id in all_params:  # 只考虑存在的参数
-                in_degree[dep_id] = in_degree.get(dep_id, 0) + 1
-    
-    # 获取所有入度为0的节点（没有依赖或只依赖外部参数）
-    zero_in_degree = [param_id for param_id in all_params if in_degree.get(param_id, 0) == 0]
-    
-    # 结果列表
-    result = []
-    
-    # 循环直到没有入度为0的节点
-    while zero_in_degree:
-        # 移除一个入度为0的节点
-        current = zero_in_degree.pop(0)
-        result.append(current)
-        
-        # 减少所有依赖该节点的节点的入度
-        if current in formula_dependencies:
-            deps = formula_dependencies[current]
-            deps_list = list(deps) if isinstance(deps, set) else deps
-            
-            if not isinstance(deps_list, list):
-                continue
-                
-            for neighbor in deps_list:
-                if neighbor in in_degree:
-                    in_degree[neighbor] -= 1
-                    
-                    # 如果入度变为0，则加入队列
-                    if in_degree[neighbor] == 0:
-                        zero_in_degree.append(neighbor)
+    if graph is None:
+        graph = DependencyGraph.from_dependencies(all_params, formula_dependencies)
+    levels, remaining = graph.topological_levels()
+    result = [param_id for level in levels for param_id in graph.to_ids(level)]
     
     # 检查是否有循环依赖
-    remaining = [param_id for param_id in all_params if param_id not in result]
-    if remaining:
+    if len(remaining):
+        remaining = graph.to_ids(remaining)
         print(f"警告: 检测到循环依赖，这些参数将被添加到排序尾部: {remaining}")
         result.extend(remaining)  # 将剩余的节点添加到结果末尾
     
     return result
 
+# 转换前端传入的参数值
+def parse_input_value(param_id, value):
+    try:
+        # 尝试转换为数值类型，但保留字符串格式
+        if isinstance(value, str) and (":" in value):
+            # 对于包含冒号的字符串，保持原始格式
+            return value
+        # 尝试转换为数值
+        return float(value)
+    except (ValueError, TypeError):
+        print(f"警告: 无法将输入值转换为数字: param_id={param_id}, value={value}")
+        # 对于无法转换的值，保持原始格式
+        return value
+
+# 每个会话最近一次的计算状态 {会话ID: 状态}，按最近使用顺序淘汰
+calculation_states = OrderedDict()
+calculation_states_lock = threading.Lock()
+MAX_CALCULATION_STATES = 64
+
+def get_formula_engine(model):
+    """获取模型共享的公式引擎（每个模型只构建一次）"""
+    return model.derived('engine', lambda m: FormulaEngine(
+        m.all_params, m.formula_dependencies, compiled=m.parsed_formulas, scheduler=level_scheduler, graph=m.graph))
+
+def get_base_values(model):
+    """获取模型按工作簿原始输入完整计算一次的结果"""
+    # 优化后的文件由openpyxl保存，不含公式缓存值，因此需要先完整计算一次
+    return model.derived('base_values', lambda m: get_formula_engine(m).calculate())
+
+def get_calculation_state(file_path):
+    """
+    获取当前会话的计算状态；首次计算或文件变化时从模型的完整计算结果开始
+    
+    状态包含共享的工作簿模型和该会话最近一次计算出的全部参数值
+    """
+    session_id = session.get('session_id', '')
+    model = model_cache.get(file_path)
+    
+    with calculation_states_lock:
+        state = calculation_states.get(session_id)
+        if state is not None and state['model'] is model:
+            calculation_states.move_to_end(session_id)
+            return state, False
+    
+    state = {
+        'model': model,
+        'result_params': model.input_params | model.intermediate_params | model.output_params,
+        'lock': threading.Lock(),
+        'values': dict(get_base_values(model)),
+        'inputs': set()  # 上一次请求中传入的输入参数
+    }
+    
+    with calculation_states_lock:
+        calculation_states[session_id] = state
+        calculation_states.move_to_end(session_id)
+        while len(calculation_states) > MAX_CALCULATION_STATES:
+            calculation_states.popitem(last=False)
+    
+    return state, True
+
+def calculate_values_incremental(file_path, input_values):
+    """
+    使用进程内公式引擎计算：只重算值发生变化的输入参数的下游参数
+    
+    首次计算返回全部参数值，之后只返回变化的输入参数和被重算的参数。
+    input_values是前端当前的全部输入：上一次传入而这次没有传入（或传入null、空字符串）的输入参数
+    恢复为工作簿中的值，与每次从工作簿完整计算的结果一致。
+    """
+    state, is_new = get_calculation_state(file_path)
+    model = state['model']
+    engine = get_formula_engine(model)
+    all_params = model.all_params
+    base_values = get_base_values(model)
+    
+    # 只有输入参数接受前端传入的值，与Excel后端保持一致
+    requested = {param_id: parse_input_value(param_id, value)
+                 for param_id, value in input_values.items()
+                 if param_id in model.input_params and value is not None and value != ''}
+    
+    with state['lock']:
+        changes = {param_id: base_values.get(param_id) for param_id in state['inputs'] - requested.keys()}
+        changes.update(requested)
+        state['inputs'] = set(requested)
+        changed, recalculated = engine.recalculate(state['values'], changes)
+        print(f"增量计算: {len(changed)} 个输入变化，重算 {len(recalculated)} 个参数")
+        
+        if is_new:
+            result_ids = state['result_params']
+        else:
+            result_ids = (changed | recalculated) & state['result_params']
+        
+        values = state['values']
+        calculated_values = {}
+        for param_id in result_ids:
+            param_info = all_params[param_id]
+            calculated_values[param_id] = {
+                'id': param_id,
+                'name': param_info.get('名称', param_id),
+                'value': values.get(param_id),
+                'unit': param_info.get('单位', '')
+            }
+    
+    return calculated_values
+
 # 根据参数排序计算值
-def calculate_values(sorted_params, all_params, formula_dependencies):
+def calculate_values(sorted_params, all_params, formula_dependencies, graph=None):
     calculated_values = {}
     
     try:
-        # 使用xlwings直接与Excel交互计算
+        # 使用常驻的Excel工作线程计算
         file_path = session.get('file_path')
         if not file_path or not os.path.exists(file_path):
             # 尝试回退到原始文件
             file_path = session.get('original_file_path')
             if not file_path or not os.path.exists(file_path):
-                print("找不到Excel文件，无法使用xlwings进行计算")
+                print("找不到Excel文件，无法使用Excel进行计算")
                 raise FileNotFoundError("找不到Excel文件")
         
-        print(f"使用xlwings打开Excel文件: {file_path}")
+        print(f"使用Excel计算文件: {file_path}")
         
         # 获取输入参数和依赖信息
-        input_params, output_params, intermediate_params, independent_params = excel_analyzer.categorize_parameters(all_params, formula_dependencies)
+        input_params, output_params, intermediate_params, independent_params = excel_analyzer.categorize_parameters(all_params, formula_dependencies, graph=graph)
         
-        # 使用xlwings打开Excel应用程序和工作簿
-        try:
-            # 在可见模式下启动Excel（调试时使用，部署时可设为False）
-            app = xw.App(visible=False)
-            wb = app.books.open(file_path)
-            
-            # 遍历所有参数，处理输入参数（更新Excel中的值）
-            print("更新Excel中的输入参数值...")
-            for param_id in input_params:
-                param_info = all_params.get(param_id, {})
-                if not param_info:
-                    continue
-                
-                # 获取参数位置信息
-                sheet_name = param_info.get('工作表', '')
-                row = param_info.get('行', 0)
-                value = param_info.get('值', 0)
-                
-                if sheet_name and row > 0:
-                    try:
-                        # 在Excel中更新输入值（默认第3列为值列）
-                        sheet = wb.sheets[sheet_name]
-                        cell = sheet.cells(row, 3)  # 第3列是值列
-                        print(f"更新参数 {param_id} 在单元格 {sheet_name}!C{row} 的值为 {value}")
-                        cell.value = value
-                    except Exception as e:
-                        print(f"更新Excel中的输入参数 {param_id} 时出错: {str(e)}")
-            
-            # 等待Excel重新计算
-            print("等待Excel重新计算...")
-            wb.app.calculate()
+        # 输入参数的单元格和值（默认第3列为值列）
+        input_cells = []
+        input_values = []
+        for param_id in input_params:
+            param_info = all_params.get(param_id, {})
+            sheet_name = param_info.get('工作表', '')
+            row = param_info.get('行', 0)
+            if sheet_name and row > 0:
+                input_cells.append((sheet_name, row))
+                input_values.append(param_info.get('值', 0))
+        
+        # 需要读取计算结果的输出和中间参数
+        result_ids = []
+        result_cells = []
+        for param_id in intermediate_params.union(output_params):
+            param_info = all_params.get(param_id, {})
+            sheet_name = param_info.get('工作表', '')
+            row = param_info.get('行', 0)
+            if sheet_name and row > 0:
+                result_ids.append(param_id)
+                result_cells.append((sheet_name, row))
+        
+        print(f"更新Excel中的 {len(input_cells)} 个输入参数并读取 {len(result_cells)} 个计算结果...")
+        results = get_excel_pool().calculate(file_path, input_cells, input_values, result_cells,
+                                             timeout=app.config['EXCEL_TIMEOUT'])
+        
+        for param_id, calculated_value in zip(result_ids, results):
+            param_info = all_params[param_id]
+            name = param_info.get('名称', param_id)
+            unit = param_info.get('单位', '')
+            formula = param_info.get('公式', '')
             
-            # 读取计算后的输出和中间参数值
-            print("读取Excel中的计算结果...")
-            result_params = intermediate_params.union(output_params)
+            # 特殊处理坡度表示格式和其他字符串类型结果
+            if isinstance(calculated_value, str):
+                # 已经是字符串格式，保持不变
+                formatted_value = calculated_value
+            elif isinstance(formula, str) and ('&' in formula or 'CONCATENATE' in formula.upper()):
+                # 检查公式包含字符串连接操作，但结果可能被转为数值
+                # 尝试根据公式特征自行格式化结果
+                if "1:" in formula or "1：" in formula:
+                    # 对于坡度表示，添加"1:"前缀
+                    formatted_value = f"1:{calculated_value}" if calculated_value else "1:0"
+                else:
+                    # 其他情况仍使用原始值
+                    formatted_value = calculated_value
+            else:
+                # 使用原始值
+                formatted_value = calculated_value
             
-            for param_id in result_params:
-                param_info = all_params.get(param_id, {})
-                if not param_info:
-                    continue
-                
-                # 获取参数位置信息
-                sheet_name = param_info.get('工作表', '')
-                row = param_info.get('行', 0)
-                name = param_info.get('名称', param_id)
-                unit = param_info.get('单位', '')
-                formula = param_info.get('公式', '')
-                
-                if sheet_name and row > 0:
-                    try:
-                        # 从Excel中读取计算后的值
-                        sheet = wb.sheets[sheet_name]
-                        cell = sheet.cells(row, 3)  # 第3列是值列
-                        calculated_value = cell.value
-                        print(f"读取参数 {param_id} 在单元格 {sheet_name}!C{row} 的计算结果: {calculated_value}")
-                        
-                        # 特殊处理坡度表示格式和其他字符串类型结果
-                        if isinstance(calculated_value, str):
-                            # 已经是字符串格式，保持不变
-                            formatted_value = calculated_value
-                        elif isinstance(formula, str) and ('&' in formula or 'CONCATENATE' in formula.upper()):
-                            # 检查公式包含字符串连接操作，但结果可能被转为数值
-                            # 尝试根据公式特征自行格式化结果
-                            if "1:" in formula or "1：" in formula:
-                                # 对于坡度表示，添加"1:"前缀
-                                formatted_value = f"1:{calculated_value}" if calculated_value else "1:0"
-                            else:
-                                # 其他情况仍使用原始值
-                                formatted_value = calculated_value
-                        else:
-                            # 使用原始值
-                            formatted_value = calculated_value
-                        
-                        calculated_values[param_id] = {
-                            'id': param_id,
-                            'name': name,
-                            'value': formatted_value,
-                            'unit': unit
-                        }
-                    except Exception as e:
-                        print(f"读取Excel中的参数 {param_id} 计算结果时出错: {str(e)}")
-                        # 使用原始值作为备选
-                        calculated_values[param_id] = {
-                            'id': param_id,
-                            'name': name,
-                            'value': param_info.get('值', 0),
-                            'unit': unit,
-                            'error': f"读取错误: {str(e)}"
-                        }
+            calculated_values[param_id] = {
+                'id': param_id,
+                'name': name,
+                'value': formatted_value,
+                'unit': unit
+            }
+        
+        # 保存输入参数的计算结果
+        for param_id in input_params:
+            param_info = all_params.get(param_id, {})
+            if not param_info:
+                continue
             
-            # 保存输入参数的计算结果
-            for param_id in input_params:
-                param_info = all_params.get(param_id, {})
-                if not param_info:
-                    continue
-                
-                name = param_info.get('名称', param_id)
-                value = param_info.get('值', 0)
-                unit = param_info.get('单位', '')
-                
-                calculated_values[param_id] = {
-                    'id': param_id,
-                    'name': name,
-                    'value': value,
-                    'unit': unit
-                }
-                
-        except Exception as e:
-            print(f"xlwings操作Excel时出错: {str(e)}")
-            raise
-        finally:
-            # 清理资源，确保关闭Excel
-            try:
-                if 'wb' in locals() and wb:
-                    wb.close()
-                if 'app' in locals() and app:
-                    app.quit()
-            except Exception as e:
-                print(f"关闭Excel资源时出错: {str(e)}")
+            calculated_values[param_id] = {
+                'id': param_id,
+                'name': param_info.get('名称', param_id),
+                'value': param_info.get('值', 0),
+                'unit': param_info.get('单位', '')
+            }
         
         return calculated_values
+    except PoolBusyError:
+        # 由调用方返回503
+        raise
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
-        print(f"使用xlwings计算时出错: {str(e)}")
+        print(f"使用Excel计算时出错: {str(e)}")
         print(f"错误详情: {error_details}")
         
         # 如果xlwings方法失败，提供合理的错误信息并返回
@@ -0,0 +1,479 @@
+"""
+多方案批量计算
+
+同一个工作簿的多组输入（方案）一起计算：每个公式只遍历一次语法树，运算在NumPy数组上完成，
+数组的每个元素对应一个方案。数值运算、比较、IF/IFERROR以及常用数学和聚合函数可以向量化；
+包含文本运算等无法向量化的公式，以及向量化结果中出现Excel错误（NaN/无穷大）或依赖了错误值的方案，
+回退到FormulaEngine逐个方案计算，保证结果与单方案计算一致。
+数值列中的错误值在数组中记为NaN，具体的错误代码另外按方案记录。
+"""
+
+import bisect
+import math
+
+import numpy as np
+
+from formula_engine import FUNCTIONS, NAME_COL, UNIT_COL, VALUE_COL, ErrorValue, FormulaError
+
+
+class _NotVectorizable(Exception):
+    """公式（或其中的某个值）无法向量化计算"""
+
+
+class _ScenarioValues:
+    """某一个方案的参数值视图，供FormulaEngine逐方案计算时读取"""
+
+    def __init__(self, columns, errors, index):
+        self.columns = columns
+        self.errors = errors
+        self.index = index
+
+    def get(self, param_id, default=None):
+        errors = self.errors.get(param_id)
+        if errors and self.index in errors:
+            return errors[self.index]
+        return column_value(self.columns.get(param_id, default), self.index)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def make_column(values, errors=None):
+    """
+    将一组方案值转换为数组：全为数值时为float数组，全为布尔值时为bool数组，否则为object数组
+
+    传入errors字典时，数值和错误值混合的列也转换为float数组，错误值记为NaN，并以{方案序号: 错误值}写入errors
+    """
+    if all(_is_number(value) for value in values):
+        return np.array(values, dtype=float)
+    if errors is not None and all(_is_number(value) or isinstance(value, ErrorValue) for value in values):
+        column = np.empty(len(values), dtype=float)
+        for i, value in enumerate(values):
+            if isinstance(value, ErrorValue):
+                errors[i] = value
+                column[i] = np.nan
+            else:
+                column[i] = value
+        return column
+    if all(isinstance(value, bool) for value in values):
+        return np.array(values, dtype=bool)
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def column_value(column, index):
+    """取出某个方案的值（转换为Python类型）"""
+    if isinstance(column, np.ndarray):
+        value = column[index]
+        return value.item() if column.dtype != object else value
+    return column
+
+
+# ---------------------------------------------------------------------------
+# 向量化运算的操作数转换
+# ---------------------------------------------------------------------------
+
+def _numeric(value):
+    """按Excel规则转换为数值（float数组或Python数值），无法向量化时抛出_NotVectorizable"""
+    if value is None:
+        return 0.0
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    if _is_number(value):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        if value.dtype == bool:
+            return value.astype(float)
+        if value.dtype.kind == 'f':
+            return value
+    raise _NotVectorizable()
+
+
+def _comparable(value):
+    """比较运算的操作数：只向量化数值之间的比较（布尔值和文本的排序规则交给逐方案计算）"""
+    if value is None:
+        return 0.0
+    if _is_number(value):
+        return float(value)
+    if isinstance(value, np.ndarray) and value.dtype.kind == 'f':
+        return value
+    raise _NotVectorizable()
+
+
+def _condition(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, np.ndarray) and value.dtype == bool:
+        return value
+    return _numeric(value) != 0
+
+
+def _kind(value):
+    """'bool'或'number'，用于判断IF两个分支的类型是否一致"""
+    if isinstance(value, bool) or (isinstance(value, np.ndarray) and value.dtype == bool):
+        return 'bool'
+    return 'number'
+
+
+_UNARY_FUNCTIONS = {
+    'ABS': np.abs,
+    'SQRT': np.sqrt,
+    'EXP': np.exp,
+    'LN': np.log,
+    'LOG10': np.log10,
+    'INT': np.floor,
+    'SIN': np.sin,
+    'COS': np.cos,
+    'TAN': np.tan,
+    'ASIN': np.arcsin,
+    'ACOS': np.arccos,
+    'ATAN': np.arctan,
+    'RADIANS': np.radians,
+    'DEGREES': np.degrees,
+}
+
+_ROUNDING_FUNCTIONS = ('ROUND', 'ROUNDUP', 'ROUNDDOWN')
+
+
+def _round_array(name, number, digits):
+    """
+    向量化的十进制舍入，与单方案计算的ROUND/ROUNDUP/ROUNDDOWN一致
+
+    先按15位有效数字规整（与'%.15g'相同），再按舍入规则取整。规整后正好处于舍入边界附近的元素，
+    以及数值过大的元素，逐个调用单方案的实现。
+    """
+    func = FUNCTIONS[name]
+    finite = np.isfinite(number)
+    scaled = np.abs(np.where(finite, number, 0.0)) * (10.0 ** digits)
+
+    # 规整到15位有效数字，消除二进制浮点误差（如2.675*100=267.49999999999997）
+    magnitude = np.floor(np.log10(np.where(scaled > 0, scaled, 1.0)))
+    factor = 10.0 ** (14 - magnitude)
+    scaled = np.round(scaled * factor) / factor
+    fraction = scaled - np.floor(scaled)
+
+    if name == 'ROUND':
+        rounded = np.floor(scaled + 0.5)
+        ambiguous = np.abs(fraction - 0.5) < 1e-9
+    else:
+        rounded = np.ceil(scaled) if name == 'ROUNDUP' else np.floor(scaled)
+        ambiguous = (fraction < 1e-9) | (fraction > 1 - 1e-9)
+    ambiguous |= scaled >= 1e15
+
+    # 整数除以（或乘以）10的幂，结果与十进制数转换为浮点数相同
+    if digits >= 0:
+        result = np.copysign(rounded / (10.0 ** digits), number)
+    else:
+        result = np.copysign(rounded * (10.0 ** -digits), number)
+    result = np.where(finite, result, number)
+
+    for i in np.flatnonzero(ambiguous & finite):
+        result[i] = func(float(number[i]), digits)
+    return result
+
+
+class BatchEvaluator:
+    """基于FormulaEngine的语法树和拓扑顺序，对多组输入一次性计算所有公式"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.vectorized = 0   # 完全向量化计算的公式数
+        self.fallbacks = 0    # 需要逐方案计算的(公式, 方案)数
+        self.errors = {}      # {参数ID: {方案序号: 错误值}}，对应数值列中的NaN
+
+    def run(self, input_ids, rows):
+        """
+        计算所有方案
+
+        Args:
+            input_ids: 输入参数ID列表（矩阵的列）
+            rows: 每个方案一行的输入值矩阵
+
+        Returns:
+            {参数ID: 列}，列为长度等于方案数的数组，或所有方案相同的标量
+        """
+        engine = self.engine
+        count = len(rows)
+        self.errors = {}
+        columns = engine.initial_values()
+        for j, param_id in enumerate(input_ids):
+            columns[param_id] = make_column([row[j] for row in rows])
+
+        overrides = set(input_ids)
+        for param_id in engine.order:
+            if param_id in engine.compiled and param_id not in overrides:
+                columns[param_id] = self._evaluate_param(param_id, columns, count)
+        return columns
+
+    def _evaluate_param(self, param_id, columns, count):
+        engine = self.engine
+        sheet = engine.all_params[param_id].get('工作表', '')
+        try:
+            with np.errstate(all='ignore'):
+                result = self._vec(engine.compiled[param_id], sheet, columns)
+        except (_NotVectorizable, FormulaError):
+            return self._fallback(param_id, columns, range(count), count)
+
+        if not isinstance(result, np.ndarray):
+            if isinstance(result, bool) or _is_number(result):
+                # 所有方案结果相同
+                result = np.full(count, result, dtype=bool if isinstance(result, bool) else float)
+            else:
+                return self._fallback(param_id, columns, range(count), count)
+        if result.dtype == object:
+            return self._fallback(param_id, columns, range(count), count)
+
+        # 依赖了错误值的方案，以及结果为NaN/无穷大的方案，按Excel规则逐个计算
+        bad = set()
+        deps = engine.dependencies.get(param_id, ())
+        for dep_id, dep_errors in self.errors.items():
+            if dep_id in deps:
+                bad.update(dep_errors)
+        if result.dtype.kind == 'f':
+            bad.update(np.flatnonzero(~np.isfinite(result)).tolist())
+        if bad:
+            return self._fallback(param_id, columns, sorted(bad), count, result)
+
+        self.vectorized += 1
+        return result
+
+    def _fallback(self, param_id, columns, indexes, count, partial=None):
+        """对指定方案逐个用FormulaEngine计算，partial为其余方案的向量化结果"""
+        values = [None] * count if partial is None else partial.tolist()
+        for i in indexes:
+            values[i] = self.engine.evaluate_param(param_id, _ScenarioValues(columns, self.errors, int(i)))
+            self.fallbacks += 1
+        errors = {}
+        column = make_column(values, errors)
+        if errors:
+            self.errors[param_id] = errors
+        return column
+
+    def _cell(self, sheet, row, col, columns):
+        engine = self.engine
+        param_id = engine.cell_map.get((sheet, row))
+        if param_id is None:
+            return None
+        if col == VALUE_COL:
+            value = columns.get(param_id)
+            if isinstance(value, np.ndarray) and value.dtype == object:
+                raise _NotVectorizable()
+            if isinstance(value, str):  # 文本和错误值
+                raise _NotVectorizable()
+            return value
+        if col in (NAME_COL, UNIT_COL):
+            raise _NotVectorizable()  # 参数名称和单位是文本
+        return None
+
+    def _range(self, ref, sheet, columns):
+        """范围内各单元格的列值列表"""
+        engine = self.engine
+        sheet = ref.sheet or sheet
+        rows = engine.sheet_rows.get(sheet, [])
+        start, end = ref.start, ref.end
+        if start.row is None:
+            selected = rows
+        else:
+            selected = rows[bisect.bisect_left(rows, min(start.row, end.row)):
+                            bisect.bisect_right(rows, max(start.row, end.row))]
+        first_col, last_col = sorted((start.col, end.col))
+        return [self._range_cell(sheet, row, col, columns)
+                for row in selected for col in range(first_col, last_col + 1)]
+
+    def _range_cell(self, sheet, row, col, columns):
+        # 聚合函数忽略范围中的文本，因此这里不需要向量化文本值
+        param_id = self.engine.cell_map.get((sheet, row))
+        if param_id is None or col != VALUE_COL:
+            return None
+        value = columns.get(param_id)
+        if isinstance(value, ErrorValue) or (isinstance(value, np.ndarray) and value.dtype == object):
+            raise _NotVectorizable()
+        return value
+
+    def _vec(self, node, sheet, columns):
+        """向量化计算语法树节点，NumPy标量和0维数组转换为Python值"""
+        value = self._vec_node(node, sheet, columns)
+        if isinstance(value, np.ndarray) and value.ndim == 0:
+            return value.item()
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    def _vec_node(self, node, sheet, columns):
+        kind = node[0]
+
+        if kind == 'num':
+            return node[1]
+        if kind == 'bool':
+            return node[1]
+        if kind == 'ref':
+            ref = node[1]
+            return self._cell(ref.sheet or sheet, ref.row, ref.col, columns)
+        if kind == 'binop':
+            op = node[1]
+            left = self._vec(node[2], sheet, columns)
+            right = self._vec(node[3], sheet, columns)
+            if op in ('+', '-', '*', '/', '^'):
+                left, right = _numeric(left), _numeric(right)
+                if op == '+':
+                    return left + right
+                if op == '-':
+                    return left - right
+                if op == '*':
+                    return left * right
+                if op == '/':
+                    return np.divide(left, right)
+                return np.power(left, right)
+            if op in ('=', '<>', '<', '>', '<=', '>='):
+                left, right = _comparable(left), _comparable(right)
+                return {
+                    '=': np.equal, '<>': np.not_equal, '<': np.less,
+                    '>': np.greater, '<=': np.less_equal, '>=': np.greater_equal
+                }[op](left, right)
+            raise _NotVectorizable()  # 文本连接
+        if kind == 'neg':
+            return -_numeric(self._vec(node[1], sheet, columns))
+        if kind == 'pos':
+            return self._vec(node[1], sheet, columns)
+        if kind == 'pct':
+            return _numeric(self._vec(node[1], sheet, columns)) / 100
+        if kind == 'func':
+            return self._call(node[1], node[2], sheet, columns)
+        # 文本、错误值、名称、范围（函数参数之外）等交给逐方案计算
+        raise _NotVectorizable()
+
+    def _call(self, name, arg_nodes, sheet, columns):
+        if name == 'IF':
+            if len(arg_nodes) != 3 or any(arg[0] == 'empty' for arg in arg_nodes):
+                raise _NotVectorizable()
+            condition = _condition(self._vec(arg_nodes[0], sheet, columns))
+            when_true = self._vec(arg_nodes[1], sheet, columns)
+            when_false = self._vec(arg_nodes[2], sheet, columns)
+            if _kind(when_true) != _kind(when_false):
+                raise _NotVectorizable()
+            if _kind(when_true) == 'number':
+                when_true, when_false = _numeric(when_true), _numeric(when_false)
+            return np.where(condition, when_true, when_false)
+        if name == 'IFERROR':
+            if len(arg_nodes) != 2:
+                raise _NotVectorizable()
+            value = _numeric(self._vec(arg_nodes[0], sheet, columns))
+            fallback = _numeric(self._vec(arg_nodes[1], sheet, columns))
+            return np.where(np.isfinite(value), value, fallback)
+
+        if name in ('SUM', 'PRODUCT', 'MIN', 'MAX', 'AVERAGE', 'COUNT'):
+            return self._aggregate(name, arg_nodes, sheet, columns)
+
+        args = []
+        for arg in arg_nodes:
+            if arg[0] in ('range', 'empty'):
+                raise _NotVectorizable()
+            args.append(self._vec(arg, sheet, columns))
+
+        if name in _UNARY_FUNCTIONS and len(args) == 1:
+            return _UNARY_FUNCTIONS[name](_numeric(args[0]))
+        if name == 'PI' and not args:
+            return math.pi
+        if name == 'POWER' and len(args) == 2:
+            return np.power(_numeric(args[0]), _numeric(args[1]))
+        if name == 'MOD' and len(args) == 2:
+            number, divisor = _numeric(args[0]), _numeric(args[1])
+            # 除数为0时得到NaN，由逐方案计算给出#DIV/0!
+            return number - divisor * np.floor(np.divide(number, divisor))
+        if name == 'LOG' and len(args) in (1, 2):
+            number = _numeric(args[0])
+            base = _numeric(args[1]) if len(args) == 2 else 10.0
+            invalid = (np.asarray(number) <= 0) | (np.asarray(base) <= 0) | (np.asarray(base) == 1)
+            return np.where(invalid, np.nan, np.log(number) / np.log(base))
+        if name in _ROUNDING_FUNCTIONS and len(args) in (1, 2):
+            digits = args[1] if len(args) == 2 else 0
+            if isinstance(digits, np.ndarray):
+                raise _NotVectorizable()
+            number = _numeric(args[0])
+            if not isinstance(number, np.ndarray):
+                return FUNCTIONS[name](number, digits)
+            return _round_array(name, number, int(_numeric(digits)))
+        if name in ('AND', 'OR') and args:
+            conditions = [_condition(arg) for arg in args]
+            reduce = np.logical_and.reduce if name == 'AND' else np.logical_or.reduce
+            return reduce(np.broadcast_arrays(*conditions)) if len(conditions) > 1 else np.asarray(conditions[0], dtype=bool)
+        if name == 'NOT' and len(args) == 1:
+            return np.logical_not(_condition(args[0]))
+        raise _NotVectorizable()
+
+    def _aggregate(self, name, arg_nodes, sheet, columns):
+        """聚合函数：范围内只统计数值，直接参数按Excel规则转换"""
+        if name == 'COUNT':
+            # COUNT只统计数值本身，直接参数中的布尔值和文本不计数，交给逐方案计算
+            if any(arg[0] != 'range' for arg in arg_nodes):
+                raise _NotVectorizable()
+            return sum(1 for arg in arg_nodes for value in self._range(arg[1], sheet, columns)
+                       if _is_number(value) or isinstance(value, np.ndarray) and value.dtype.kind == 'f')
+        numbers = []
+        for arg in arg_nodes:
+            if arg[0] == 'range':
+                for value in self._range(arg[1], sheet, columns):
+                    if _is_number(value) or (isinstance(value, np.ndarray) and value.dtype.kind == 'f'):
+                        numbers.append(value if isinstance(value, np.ndarray) else float(value))
+            elif arg[0] == 'empty':
+                raise _NotVectorizable()
+            else:
+                value = self._vec(arg, sheet, columns)
+                if value is not None:
+                    numbers.append(_numeric(value))
+
+        if not numbers:
+            if name == 'AVERAGE':
+                raise _NotVectorizable()
+            # 与Excel一致：没有数值时PRODUCT也返回0
+            return 0 if name in ('MIN', 'MAX') else 0.0
+
+        stacked = np.broadcast_arrays(*[np.asarray(number, dtype=float) for number in numbers])
+        stacked = np.stack(stacked)
+        if name == 'SUM':
+            return _fsum_columns(stacked)
+        if name == 'PRODUCT':
+            # 逐行依次相乘，与FormulaEngine从左到右的乘法顺序相同
+            return stacked.prod(axis=0)
+        if name == 'MIN':
+            return stacked.min(axis=0)
+        if name == 'MAX':
+            return stacked.max(axis=0)
+        return _fsum_columns(stacked) / len(stacked)
+
+
+def _fsum_columns(stacked):
+    """
+    每个方案（列）的精确和，与FormulaEngine的math.fsum结果逐位相同
+
+    NumPy的sum按成对或逐行累加，舍入误差与fsum不同。溢出或出现相反符号的无穷大时该方案记为NaN，
+    由逐方案计算给出与FormulaEngine相同的结果。
+    """
+    if stacked.ndim == 1:
+        # 所有参数都是标量
+        return _fsum_or_nan(stacked.tolist())
+    sums = stacked.sum(axis=0)
+    if len(stacked) <= 2:
+        # 两个数相加只舍入一次，与fsum相同
+        return sums
+    # 整数且绝对值之和不超过2**53的列，逐行累加没有舍入误差；其余列用fsum
+    exact = (np.abs(stacked).sum(axis=0) <= 2.0 ** 53) & (stacked == np.round(stacked)).all(axis=0)
+    for i in np.flatnonzero(~exact).tolist():
+        sums[i] = _fsum_or_nan(stacked[:, i].tolist())
+    return sums
+
+
+def _fsum_or_nan(numbers):
+    try:
+        return math.fsum(numbers)
+    except (OverflowError, ValueError):
+        return math.nan
+
+
+def to_json_value(value):
+    """将计算结果转换为可JSON序列化的值"""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
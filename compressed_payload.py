@@ -0,0 +1,58 @@
+"""
+预先序列化并压缩的API响应
+
+参数列表、依赖关系等只随工作簿变化的大型JSON在每个模型版本上只序列化一次，保存gzip和
+brotli（已安装brotli时）压缩后的字节。请求时按Accept-Encoding选择编码直接返回已有的字节，
+并带强ETag；浏览器带If-None-Match重新验证且内容未变时返回304，不再传输响应体。
+不压缩的原文只在客户端不接受任何压缩编码时临时解压，不常驻内存。
+"""
+
+import gzip
+import hashlib
+
+try:
+    import brotli  # 可选：支持br编码
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 9  # 11压缩率略高，但数MB的JSON要压缩数秒
+
+
+class CompressedPayload:
+    """
+    一个响应体的各种编码及其ETag
+
+    Args:
+        body: 未压缩的响应体（bytes）
+        mimetype: 响应的Content-Type
+    """
+
+    def __init__(self, body, mimetype='application/json'):
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self.size = len(body)
+        self.bodies = {'gzip': gzip.compress(body, GZIP_LEVEL, mtime=0)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+        self.encodings = [encoding for encoding in ('br', 'gzip') if encoding in self.bodies] + ['identity']
+
+    def body(self, encoding):
+        """指定编码的响应体"""
+        if encoding == 'identity':
+            return gzip.decompress(self.bodies['gzip'])
+        return self.bodies[encoding]
+
+    def etag(self, encoding):
+        """各编码的字节不同，强ETag按编码区分"""
+        return self.digest if encoding == 'identity' else f'{self.digest}-{encoding}'
+
+    def select_encoding(self, accept_encodings):
+        """按请求的Accept-Encoding（werkzeug的Accept对象）选择编码，都不接受时返回原文"""
+        return accept_encodings.best_match(self.encodings, default='identity') or 'identity'
+
+    def sizes(self):
+        """各编码的字节数"""
+        sizes = {'identity': self.size}
+        sizes.update((encoding, len(body)) for encoding, body in self.bodies.items())
+        return sizes
@@ -0,0 +1,365 @@
+"""
+参数依赖图的整数化CSR表示
+
+参数ID按顺序编号为0..n-1，依赖边以NumPy的CSR数组保存：
+正向 indptr/indices 中 indices[indptr[i]:indptr[i+1]] 为参数i依赖的参数，
+反向 rindptr/rindices 为依赖参数i的参数。每条边在两个方向各占一个int32，
+一百万条边约8MB；拓扑分层、可达性等遍历按层批量处理数组，不再对字符串ID做哈希。
+"""
+
+from itertools import repeat
+
+import numpy as np
+
+from dependency_index import DependencySet
+
+
+def _gather(indptr, indices, nodes):
+    """返回nodes中所有节点的邻居（按节点顺序拼接，可能重复）"""
+    if len(nodes) == 0:
+        return indices[:0]
+    starts = indptr[nodes]
+    lengths = indptr[nodes + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return indices[:0]
+    # 每个邻居在indices中的位置 = 所属节点的起点 + 在该节点内的偏移
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return indices[offsets + np.arange(total)]
+
+
+class DependencyGraph:
+    """
+    参数依赖图
+
+    Args:
+        ids: 编号 -> 参数ID
+        indptr, indices: 正向CSR（参数依赖的参数），每个节点的邻居按编号升序且不重复
+    """
+
+    def __init__(self, ids, indptr, indices):
+        self.ids = ids
+        self.index = {param_id: i for i, param_id in enumerate(ids)}
+        self.indptr = indptr
+        self.indices = indices
+
+        # 反向CSR：按被依赖的参数稳定排序，邻居仍按编号升序
+        n = len(ids)
+        sources = np.repeat(np.arange(n, dtype=np.int32), np.diff(indptr))
+        order = np.argsort(indices, kind='stable')
+        self.rindices = sources[order]
+        self.rindptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices, minlength=n), out=self.rindptr[1:])
+
+    @classmethod
+    def from_dependencies(cls, nodes, formula_dependencies):
+        """
+        由formula_dependencies构建依赖图
+
+        nodes为参与编号的参数ID（如all_params），不在其中的依赖被忽略。
+        DependencySet中的范围段按工作表行索引整体映射为编号数组，不逐个展开成字符串。
+        """
+        ids = list(nodes)
+        node_of = {param_id: i for i, param_id in enumerate(ids)}
+        n = len(ids)
+
+        direct_owners, direct_counts, direct_ids = [], [], []
+        range_sources, range_targets = [], []
+        row_nodes = {}  # {id(RowIndex): (RowIndex, 各行对应的编号数组，不在nodes中为-1)}
+
+        for param_id, deps in formula_dependencies.items():
+            source = node_of.get(param_id)
+            if source is None or not deps:
+                continue
+            if type(deps) is DependencySet:  # 避免ABC的isinstance开销
+                direct, ranges = deps.direct, deps.ranges
+            else:
+                direct, ranges = deps, ()
+
+            if direct:
+                direct_owners.append(source)
+                direct_counts.append(len(direct))
+                direct_ids.extend(direct)
+
+            for index, lo, hi in ranges:
+                entry = row_nodes.get(id(index))
+                if entry is None:
+                    entry = (index, np.fromiter(map(node_of.get, index.ids, repeat(-1)), dtype=np.int64,
+                                                count=len(index.ids)))
+                    row_nodes[id(index)] = entry
+                segment = entry[1][lo:hi]
+                segment = segment[segment >= 0]
+                range_sources.append(np.full(len(segment), source, dtype=np.int64))
+                range_targets.append(segment)
+
+        # 直接引用一次性映射为编号，不在nodes中的依赖为-1
+        sources = np.repeat(np.array(direct_owners, dtype=np.int64), direct_counts)
+        targets = np.fromiter(map(node_of.get, direct_ids, repeat(-1)), dtype=np.int64, count=len(direct_ids))
+        known = targets >= 0
+        sources = np.concatenate([sources[known]] + range_sources)
+        targets = np.concatenate([targets[known]] + range_targets)
+
+        # 按(起点, 终点)排序去重即得到CSR顺序
+        keys = sources * max(n, 1) + targets
+        keys.sort()
+        if len(keys):
+            keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+        sources, targets = np.divmod(keys, max(n, 1))
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+        return cls(ids, indptr, targets.astype(np.int32))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def edge_count(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        """CSR数组占用的字节数"""
+        return self.indptr.nbytes + self.indices.nbytes + self.rindptr.nbytes + self.rindices.nbytes
+
+    def __getstate__(self):
+        # 编号字典可由ids重建，不随进程池传输
+        state = dict(self.__dict__)
+        del state['index']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.index = {param_id: i for i, param_id in enumerate(self.ids)}
+
+    # ------------------------------------------------------------------
+    # 编号转换
+    # ------------------------------------------------------------------
+
+    def nodes(self, param_ids):
+        """参数ID -> 编号数组，忽略不在图中的参数"""
+        index = self.index
+        return np.array([index[param_id] for param_id in param_ids if param_id in index], dtype=np.int64)
+
+    def to_ids(self, nodes):
+        ids = self.ids
+        return [ids[i] for i in np.asarray(nodes).tolist()]
+
+    def dependencies(self, node):
+        """节点直接依赖的节点（编号升序）"""
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def dependents(self, node):
+        """直接依赖该节点的节点（编号升序）"""
+        return self.rindices[self.rindptr[node]:self.rindptr[node + 1]]
+
+    def dependencies_of(self, nodes):
+        """nodes（编号数组）中所有节点直接依赖的节点（去重，编号升序）"""
+        return np.unique(_gather(self.indptr, self.indices, np.asarray(nodes, dtype=np.int64)))
+
+    def out_degrees(self):
+        """每个节点依赖的参数数"""
+        return np.diff(self.indptr)
+
+    def in_degrees(self):
+        """每个节点被多少个参数依赖"""
+        return np.diff(self.rindptr)
+
+    # ------------------------------------------------------------------
+    # 图算法
+    # ------------------------------------------------------------------
+
+    def reachable(self, seeds, reverse=False):
+        """
+        从seeds（编号数组）出发沿依赖（reverse=True时沿反向依赖）可达的节点，返回布尔掩码（含起点）
+
+        每轮把整层前沿的邻居一次性取出，按层批量处理。
+        """
+        indptr, indices = (self.rindptr, self.rindices) if reverse else (self.indptr, self.indices)
+        reached = np.zeros(len(self.ids), dtype=bool)
+        frontier = np.unique(np.asarray(seeds, dtype=np.int64))
+        reached[frontier] = True
+        while len(frontier):
+            neighbors = _gather(indptr, indices, frontier)
+            neighbors = neighbors[~reached[neighbors]]
+            frontier = np.unique(neighbors).astype(np.int64)
+            reached[frontier] = True
+        return reached
+
+    def neighborhood(self, center, up=1, down=1, max_nodes=None):
+        """
+        center上游up跳（沿依赖）和下游down跳（沿反向依赖）以内的节点
+
+        只访问邻域内节点的邻接段，耗时与邻域大小成正比，与整个图的大小无关。
+        节点数超过max_nodes时按发现顺序截断（先上游后下游，同一跳内按编号）。
+
+        Returns:
+            (nodes, hops, truncated): nodes为编号数组，依次为中心、上游逐跳、下游逐跳的节点；
+            hops为对应的跳数，上游为负、下游为正、中心为0（循环依赖中既在上游又在下游的节点记为上游）；
+            truncated表示是否因max_nodes未包含全部节点
+        """
+        found = np.array([center], dtype=np.int64)  # 已收录的节点（升序）
+        parts = [found]
+        hop_parts = [np.zeros(1, dtype=np.int64)]
+        count = 1
+        truncated = False
+        for sign, limit, (indptr, indices) in ((-1, up, (self.indptr, self.indices)),
+                                               (1, down, (self.rindptr, self.rindices))):
+            seen = frontier = np.array([center], dtype=np.int64)  # 本方向已遍历的节点（升序）
+            for hop in range(1, limit + 1):
+                if truncated:
+                    break
+                neighbors = np.setdiff1d(_gather(indptr, indices, frontier), seen).astype(np.int64)
+                if len(neighbors) == 0:
+                    break
+                new = np.setdiff1d(neighbors, found, assume_unique=True)
+                if max_nodes is not None and count + len(new) > max_nodes:
+                    new = new[:max_nodes - count]
+                    truncated = True
+                parts.append(new)
+                hop_parts.append(np.full(len(new), sign * hop, dtype=np.int64))
+                count += len(new)
+                found = np.union1d(found, new)
+                seen = np.union1d(seen, neighbors)
+                frontier = neighbors
+        return np.concatenate(parts), np.concatenate(hop_parts), truncated
+
+    def induced_edges(self, nodes):
+        """
+        两端都在nodes（编号数组）中的依赖边
+
+        依赖数不超过len(nodes)的节点取出全部依赖再筛选；依赖更多的节点（如引用整列的汇总公式）
+        反过来在其有序的依赖中二分查找nodes，耗时与nodes的大小相关而与该节点的依赖数无关。
+
+        Returns:
+            (sources, targets): sources[i]依赖targets[i]，按sources在nodes中的顺序排列
+        """
+        nodes = np.asarray(nodes, dtype=np.int64)
+        members = np.sort(nodes)
+        degrees = self.indptr[nodes + 1] - self.indptr[nodes]
+        dense = degrees > len(nodes)
+
+        sparse_nodes = nodes[~dense]
+        sources = np.repeat(sparse_nodes, degrees[~dense])
+        targets = _gather(self.indptr, self.indices, sparse_nodes)
+        pos = np.minimum(np.searchsorted(members, targets), max(len(members) - 1, 0))
+        keep = members[pos] == targets
+        source_parts, target_parts = [sources[keep]], [targets[keep]]
+
+        for node in nodes[dense].tolist():
+            deps = self.dependencies(node)
+            pos = np.minimum(np.searchsorted(deps, members), len(deps) - 1)
+            found = members[deps[pos] == members]
+            source_parts.append(np.full(len(found), node, dtype=np.int64))
+            target_parts.append(found)
+
+        sources = np.concatenate(source_parts)
+        targets = np.concatenate(target_parts).astype(np.int64)
+        if dense.any():
+            # 恢复按sources在nodes中的顺序
+            position = np.empty(len(members), dtype=np.int64)
+            position[np.searchsorted(members, nodes)] = np.arange(len(nodes))
+            order = np.argsort(position[np.searchsorted(members, sources)], kind='stable')
+            sources, targets = sources[order], targets[order]
+        return sources, targets
+
+    def topological_levels(self):
+        """
+        Kahn算法分层：第0层不依赖任何参数，之后每层只依赖之前层级的参数
+
+        Returns:
+            (levels, remaining): levels为编号数组列表，层内按编号升序；
+            remaining为处于循环依赖中或依赖循环的节点（编号升序）
+        """
+        in_degree = self.out_degrees().copy()  # 尚未计算的依赖数
+        current = np.flatnonzero(in_degree == 0)
+        levels = []
+        while len(current):
+            levels.append(current)
+            dependents = _gather(self.rindptr, self.rindices, current)
+            if len(dependents) == 0:
+                break
+            candidates, counts = np.unique(dependents, return_counts=True)
+            in_degree[candidates] -= counts
+            current = candidates[in_degree[candidates] == 0]
+        placed = np.zeros(len(self.ids), dtype=bool)
+        for level in levels:
+            placed[level] = True
+        return levels, np.flatnonzero(~placed)
+
+    def topological_order(self):
+        """被依赖的节点排在前面的顺序，循环依赖相关的节点放在最后"""
+        levels, remaining = self.topological_levels()
+        return np.concatenate(levels + [remaining]) if levels else remaining
+
+    def cycle_components(self):
+        """
+        循环依赖组：包含多于一个节点或依赖自身的强连通分量，返回编号列表的列表
+
+        先用Kahn分层剥离所有无环部分，只在剩余节点构成的子图上运行迭代的Tarjan算法。
+        """
+        _, remaining = self.topological_levels()
+        if len(remaining) == 0:
+            return []
+
+        in_rest = set(remaining.tolist())
+        indptr = memoryview(self.indptr)
+        indices = memoryview(self.indices)
+
+        def successors(node):
+            return [dep for dep in indices[indptr[node]:indptr[node + 1]].tolist() if dep in in_rest]
+
+        order = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        for root in remaining.tolist():
+            if root in order:
+                continue
+            order[root] = lowlink[root] = len(order)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(successors(root)))]
+
+            while work:
+                node, deps = work[-1]
+
+                # 继续遍历当前节点的依赖，遇到未访问的节点时先深入
+                descended = False
+                for dep in deps:
+                    if dep not in order:
+                        order[dep] = lowlink[dep] = len(order)
+                        stack.append(dep)
+                        on_stack.add(dep)
+                        work.append((dep, iter(successors(dep))))
+                        descended = True
+                        break
+                    if dep in on_stack and order[dep] < lowlink[node]:
+                        lowlink[node] = order[dep]
+                if descended:
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if lowlink[node] < lowlink[parent]:
+                        lowlink[parent] = lowlink[node]
+
+                if lowlink[node] == order[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or self._has_edge(node, node):
+                        components.append(component)
+
+        return components
+
+    def _has_edge(self, source, target):
+        deps = self.dependencies(source)
+        pos = np.searchsorted(deps, target)
+        return pos < len(deps) and deps[pos] == target
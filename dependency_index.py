@@ -0,0 +1,153 @@
+"""
+参数依赖的紧凑表示
+
+每个工作表按行号排序保存参数行索引(RowIndex)，范围引用（如C2:C50000）通过二分查找定位为索引中的一段。
+依赖集合(DependencySet)只保存直接引用和若干段范围，不把范围展开成成千上万个单独的条目；
+它实现了只读集合接口，遍历、成员判断和长度与展开后的集合一致，现有代码可以照常按集合使用。
+收集完成后compact()把直接引用和范围段转为元组，空的部分共享同一个空元组。
+"""
+
+from bisect import bisect_left, bisect_right
+from collections.abc import Set
+
+
+class RowIndex:
+    """一个工作表中参数行的有序索引：rows为行号，ids/names为对应的参数ID和参数名"""
+
+    def __init__(self, sheet, rows, ids, names):
+        self.sheet = sheet
+        self.rows = rows
+        self.ids = ids
+        self.names = names
+        self._positions = {}  # {字段: {值: [位置]}}，成员判断时按需构建
+
+    def __len__(self):
+        return len(self.rows)
+
+    def find(self, row):
+        """行号在索引中的位置，不是参数行时返回None"""
+        pos = bisect_left(self.rows, row)
+        if pos < len(self.rows) and self.rows[pos] == row:
+            return pos
+        return None
+
+    def span(self, start_row, end_row):
+        """行号范围[start_row, end_row]在索引中对应的位置区间[lo, hi)；None表示不限"""
+        lo = 0 if start_row is None else bisect_left(self.rows, start_row)
+        hi = len(self.rows) if end_row is None else bisect_right(self.rows, end_row)
+        return lo, max(lo, hi)
+
+    def positions(self, field, value):
+        """字段（ids或names）中等于value的所有位置"""
+        table = self._positions.get(field)
+        if table is None:
+            table = {}
+            for pos, item in enumerate(getattr(self, field)):
+                table.setdefault(item, []).append(pos)
+            self._positions[field] = table
+        return table.get(value, ())
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_positions'] = {}
+        return state
+
+
+class DependencySet(Set):
+    """
+    由直接引用和范围段组成的依赖集合
+
+    field为'ids'时元素是参数ID，为'names'时元素是参数名（用于依赖描述）。
+    direct和ranges在第一次添加时才分配。
+    """
+
+    __slots__ = ('field', 'direct', 'ranges')
+
+    def __init__(self, field='ids', direct=(), ranges=()):
+        self.field = field
+        self.direct = direct  # 直接引用（不重复，按添加顺序）
+        self.ranges = ranges  # [(RowIndex, lo, hi)]
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        # 集合运算（&、|、-）的结果为普通set
+        return set(iterable)
+
+    def add(self, item):
+        if type(self.direct) is not dict:
+            self.direct = dict.fromkeys(self.direct)  # 保持添加顺序，序列化结果不受哈希随机化影响
+        self.direct[item] = None
+
+    def add_range(self, index, lo, hi):
+        if lo < hi:
+            if type(self.ranges) is not list:
+                self.ranges = list(self.ranges)
+            self.ranges.append((index, lo, hi))
+
+    def compact(self):
+        """收集完成后调用：直接引用和范围段转为元组，之后仍可继续add"""
+        self.direct = tuple(self.direct)
+        self.ranges = tuple(self.ranges)
+        return self
+
+    def __contains__(self, item):
+        if item in self.direct:
+            return True
+        for index, lo, hi in self.ranges:
+            for pos in index.positions(self.field, item):
+                if lo <= pos < hi:
+                    return True
+        return False
+
+    def __iter__(self):
+        if not self.ranges:
+            yield from self.direct
+            return
+        seen = set(self.direct)
+        yield from self.direct
+        for index, lo, hi in self.ranges:
+            for item in getattr(index, self.field)[lo:hi]:
+                if item not in seen:
+                    seen.add(item)
+                    yield item
+
+    def __len__(self):
+        if not self.ranges:
+            return len(self.direct)
+        return sum(1 for _ in self)
+
+    def __bool__(self):
+        return bool(self.direct) or bool(self.ranges)
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + self.direct.__sizeof__() + self.ranges.__sizeof__()
+
+    def __repr__(self):
+        return f"DependencySet({len(self.direct)} 个直接引用, {len(self.ranges)} 段范围)"
+
+
+class FrozenDependencySet(DependencySet):
+    """不可修改的依赖集合，供多个参数共享（如没有依赖的参数共享的空集合）；add、add_range和属性赋值抛出TypeError"""
+
+    __slots__ = ()
+
+    def __init__(self, field='ids', direct=(), ranges=()):
+        object.__setattr__(self, 'field', field)
+        object.__setattr__(self, 'direct', tuple(direct))
+        object.__setattr__(self, 'ranges', tuple(ranges))
+
+    def __setattr__(self, name, value):
+        raise TypeError("FrozenDependencySet不可修改")
+
+    def add(self, item):
+        raise TypeError("FrozenDependencySet不可修改")
+
+    def add_range(self, index, lo, hi):
+        raise TypeError("FrozenDependencySet不可修改")
+
+    def compact(self):
+        return self
+
+    def __reduce__(self):
+        return (type(self), (self.field, self.direct, self.ranges))
+
@@ -1,30 +1,52 @@
 import openpyxl
-from openpyxl.utils import get_column_letter
-import re
+from openpyxl.worksheet.formula import ArrayFormula
+try:
+    # 私有接口：一次解析同时得到公式和缓存值，openpyxl版本不兼容时scan_workbook改用公开的iter_rows
+    from openpyxl.worksheet._reader import WorkSheetParser, FORMULA_TAG
+except ImportError:
+    WorkSheetParser = FORMULA_TAG = None
+from openpyxl.cell import WriteOnlyCell
 import os
+from copy import copy
+from itertools import zip_longest
 from openpyxl.styles import PatternFill, Font
+from formula_parser import rewrite_references
+from dependency_index import RowIndex, DependencySet
+from dependency_graph import DependencyGraph
+from param_record import ParamRecord
+import numpy as np
 
-def analyze_excel(file_path):
-    """分析Excel文件中的参数、公式和依赖关系，并生成优化后的Excel文件"""
-    # 加载Excel工作簿（一个包含公式，一个包含计算后的值）
-    wb = openpyxl.load_workbook(file_path, data_only=False)
-    wb_data = openpyxl.load_workbook(file_path, data_only=True)
+def analyze_excel(file_path, progress=None, output_scan=None):
+    """
+    分析Excel文件中的参数、公式和依赖关系，并生成优化后的Excel文件
     
-    # 收集所有参数和依赖关系
-    all_params = {}
-    formula_dependencies = {}
+    progress(phase, rows=None)在每个阶段开始时被调用，用于报告进度：
+    loading、collecting、cycle_detection、optimizing、saving
+    
+    output_scan不为None时（WorkbookScan），记录优化后的文件中写出的参数行，
+    可以直接构建优化后文件的模型，不需要再读取一遍该文件。
+    """
+    report = progress or (lambda phase, rows=None: None)
     
-    # 存储重名参数信息
-    duplicate_params = collect_duplicate_params(wb)
+    # 以只读流式方式顺序扫描一遍工作簿（公式和计算后的值同时读取）
+    report('loading')
+    scan = scan_workbook(file_path)
     
-    # 收集参数和依赖关系
-    all_params, formula_dependencies = collect_params_and_dependencies(wb, wb_data, duplicate_params)
+    # 重名参数信息在扫描时一并收集
+    duplicate_params = scan.duplicate_params
+    
+    # 收集参数、依赖关系和循环依赖组
+    report('collecting', sum(len(sheet_scan.rows) for sheet_scan in scan.sheets.values()))
+    all_params, formula_dependencies, cycle_components = collect_model_from_scan(scan, duplicate_params, progress)
     
     # 处理重名参数、依赖关系和参数分类
+    report('optimizing', len(all_params))
     param_replacements, different_value_groups, optimized_dependencies, renamed_params = process_parameters(all_params, formula_dependencies)
     
     # 生成优化后的Excel文件
-    optimized_excel_path = generate_optimized_excel(file_path, all_params, param_replacements, different_value_groups, formula_dependencies)
+    sheet_max_cols = {sheet: sheet_scan.max_col for sheet, sheet_scan in scan.sheets.items()}
+    optimized_excel_path = generate_optimized_excel(file_path, all_params, param_replacements, different_value_groups, formula_dependencies,
+                                                    cycle_components, progress, sheet_max_cols, output_scan)
     
     if optimized_excel_path:
         print(f"优化后的Excel文件已保存至: {optimized_excel_path}")
@@ -33,226 +55,333 @@ def analyze_excel(file_path):
     
     return all_params
 
-def collect_duplicate_params(wb):
-    """收集Excel中的重名参数"""
-    duplicate_params = {}  # 格式: {参数名: [位置1, 位置2, ...]}
+class SheetScan:
+    """一个工作表顺序扫描后的数据"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.rows = []      # [(行号, 参数名, 单位, 值或公式, 计算后的值, 是否公式)]，仅包含有参数名的数据行
+        self.names = {}     # {行号: 参数名}
+        self.max_row = 0    # 最后一行的行号
+        self.max_col = 0    # 有内容的最大列号
+
+class WorkbookScan:
+    """整个工作簿顺序扫描后的数据"""
     
-    for sheet in wb.sheetnames:
-        ws = wb[sheet]
-        name_col = 1
+    def __init__(self):
+        self.sheets = {}            # {工作表名: SheetScan}，保持工作表顺序
+        self.duplicate_params = {}  # {参数名: [(工作表, 行号), ...]}
+
+NAME_COL = 1
+UNIT_COL = 2
+VALUE_COL = 3
+
+def _record_row(scan, sheet_scan, row, param_name, param_unit, raw_value, cached_value, is_formula):
+    """记录一个参数行，并登记重名参数的位置"""
+    sheet_scan.rows.append((row, param_name, param_unit, raw_value, cached_value, is_formula))
+    sheet_scan.names[row] = param_name
+    scan.duplicate_params.setdefault(param_name, []).append((sheet_scan.name, row))
+
+if WorkSheetParser is not None:
+    class _FormulaValueParser(WorkSheetParser):
+        """工作表XML解析器：公式单元格同时保留公式文本和Excel缓存的计算结果"""
         
-        # 遍历所有行（从第二行开始，第一行是表头）
-        for row in range(2, ws.max_row + 1):
-            param_name = ws.cell(row=row, column=name_col).value
-            if not param_name:
-                continue  # 跳过没有参数名的行
+        def parse_cell(self, element):
+            # 以data_only模式解析得到缓存值，再单独解析公式
+            cell = super().parse_cell(element)
+            if element.find(FORMULA_TAG) is not None:
+                cell['formula'] = self.parse_formula(element)
+            return cell
+
+def scan_workbook(file_path):
+    """
+    以只读模式打开工作簿，对每个工作表的XML只顺序解析一遍，
+    同时得到公式和Excel缓存的计算结果
+    
+    解析依赖openpyxl的内部接口（requirements.txt限定了openpyxl的次版本），
+    接口不可用时改用公开的只读iter_rows接口读取两遍（公式和缓存值各一遍）。
+    """
+    if WorkSheetParser is not None:
+        try:
+            return _scan_with_parser(file_path)
+        except (AttributeError, TypeError) as e:
+            print(f"openpyxl内部解析接口不可用（{str(e)}），改用iter_rows读取工作簿")
+    return _scan_with_iter_rows(file_path)
+
+def _scan_with_parser(file_path):
+    """用openpyxl的工作表解析器一次读取公式和缓存值"""
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    scan = WorkbookScan()
+    
+    try:
+        for ws in wb.worksheets:
+            sheet = ws.title
+            sheet_scan = SheetScan(sheet)
+            scan.sheets[sheet] = sheet_scan
             
-            # 记录重名参数
-            if param_name in duplicate_params:
-                duplicate_params[param_name].append((sheet, row))
-            else:
-                duplicate_params[param_name] = [(sheet, row)]
+            max_row = 0
+            max_col = 0
+            with ws._get_source() as src:
+                parser = _FormulaValueParser(src, ws._shared_strings, data_only=True, epoch=wb.epoch,
+                                             date_formats=wb._date_formats, timedelta_formats=wb._timedelta_formats)
+                for row, cells in parser.parse():
+                    param_name = param_unit = raw_value = cached_value = None
+                    is_formula = False
+                    
+                    for cell in cells:
+                        col = cell['column']
+                        value = cell['value']
+                        formula = cell.get('formula')
+                        if value is None and formula is None:
+                            continue
+                        max_row = row
+                        if col > max_col:
+                            max_col = col
+                        
+                        if col == NAME_COL:
+                            param_name = value
+                        elif col == UNIT_COL:
+                            param_unit = value
+                        elif col == VALUE_COL:
+                            cached_value = value
+                            if formula is not None:
+                                raw_value = formula.text if isinstance(formula, ArrayFormula) else formula
+                                is_formula = True
+                            else:
+                                raw_value = value
+                    
+                    if row == 1 or not param_name:
+                        continue  # 跳过表头和没有参数名的行
+                    
+                    _record_row(scan, sheet_scan, row, param_name, param_unit, raw_value, cached_value, is_formula)
+            
+            sheet_scan.max_row = max_row
+            sheet_scan.max_col = max_col
+    finally:
+        wb.close()
     
-    return duplicate_params
+    return scan
 
-def collect_params_and_dependencies(wb, wb_data, duplicate_params):
-    """收集所有参数和依赖关系"""
-    all_params = {}
-    formula_dependencies = {}
+def _scan_with_iter_rows(file_path):
+    """用公开的只读接口读取：公式和缓存值各打开一份工作簿，逐行同步遍历"""
+    wb = openpyxl.load_workbook(file_path, read_only=True)
+    wb_data = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    scan = WorkbookScan()
     
     try:
-        for sheet in wb.sheetnames:
-            ws = wb[sheet]
-            ws_data = wb_data[sheet]
+        for ws in wb.worksheets:
+            sheet = ws.title
+            sheet_scan = SheetScan(sheet)
+            scan.sheets[sheet] = sheet_scan
+            
+            formula_rows = ws.iter_rows(values_only=True)
+            value_rows = wb_data[sheet].iter_rows(values_only=True)
             
-            name_col = 1
-            unit_col = 2
-            value_col = 3
+            max_row = 0
+            max_col = 0
+            for row, (formula_row, value_row) in enumerate(zip_longest(formula_rows, value_rows, fillvalue=()), start=1):
+                # 记录有内容的最大行列
+                for col in range(len(formula_row), 0, -1):
+                    if formula_row[col - 1] is not None:
+                        max_row = row
+                        max_col = max(max_col, col)
+                        break
+                
+                if row == 1 or len(formula_row) < NAME_COL:
+                    continue  # 第一行是表头
+                
+                param_name = formula_row[NAME_COL - 1]
+                if not param_name:
+                    continue  # 跳过没有参数名的行
+                
+                param_unit = formula_row[UNIT_COL - 1] if len(formula_row) >= UNIT_COL else None
+                raw_value = formula_row[VALUE_COL - 1] if len(formula_row) >= VALUE_COL else None
+                cached_value = value_row[VALUE_COL - 1] if len(value_row) >= VALUE_COL else None
+                
+                # 判断是否为公式
+                if isinstance(raw_value, ArrayFormula):
+                    raw_value = raw_value.text
+                    is_formula = True
+                else:
+                    is_formula = isinstance(raw_value, str) and raw_value.startswith('=') and len(raw_value) > 1
+                
+                _record_row(scan, sheet_scan, row, param_name, param_unit, raw_value, cached_value, is_formula)
             
+            sheet_scan.max_row = max_row
+            sheet_scan.max_col = max_col
+    finally:
+        wb.close()
+        wb_data.close()
+    
+    return scan
+
+def analyze_formula_references(formula, sheet, row, row_indexes):
+    """
+    分析公式引用的参数，返回(直接引用[(参数ID, 参数名)], 范围引用[(RowIndex, lo, hi)], 公式描述)
+    
+    row_indexes为{工作表: RowIndex}。范围引用通过二分查找定位为索引中的区间，不逐行展开。
+    公式描述中单元格引用替换为参数名，范围引用保留原文。
+    """
+    references = []
+    ranges = []
+    
+    def describe(kind, ref):
+        ref_sheet = ref.sheet or sheet
+        index = row_indexes.get(ref_sheet)
+        if index is None:
+            return None
+        
+        if kind == 'ref':
+            pos = index.find(ref.row) if ref.row is not None else None
+            if pos is None or (ref_sheet == sheet and ref.row == row):  # 不是参数行，或引用了自己
+                return None
+            references.append((index.ids[pos], index.names[pos]))
+            return index.names[pos]
+        
+        # 范围引用（整列引用的行号为None）
+        start_row, end_row = ref.start.row, ref.end.row
+        if start_row is not None and end_row is not None and start_row > end_row:
+            start_row, end_row = end_row, start_row
+        lo, hi = index.span(start_row, end_row)
+        
+        # 排除公式所在的行
+        self_pos = index.find(row) if ref_sheet == sheet else None
+        if self_pos is not None and lo <= self_pos < hi:
+            spans = [(lo, self_pos), (self_pos + 1, hi)]
+        else:
+            spans = [(lo, hi)]
+        ranges.extend((index, span_lo, span_hi) for span_lo, span_hi in spans if span_lo < span_hi)
+        return None
+    
+    return references, ranges, rewrite_references(formula, describe)
+
+def build_row_indexes(scan, duplicate_params):
+    """为每个工作表构建参数行索引 {工作表: RowIndex}（跳过表头）"""
+    row_indexes = {}
+    for sheet, sheet_scan in scan.sheets.items():
+        rows, ids, names = [], [], []
+        for row in sorted(sheet_scan.names):
+            if row < 2:
+                continue
+            param_name = sheet_scan.names[row]
+            if not param_name:
+                continue
+            # 检查是否为重名参数
+            is_duplicate = len(duplicate_params.get(param_name, [])) > 1
+            rows.append(row)
+            ids.append(f"{param_name}_{sheet}_r{row}" if is_duplicate else param_name)
+            names.append(param_name)
+        row_indexes[sheet] = RowIndex(sheet, rows, ids, names)
+    return row_indexes
+
+def collect_model_from_scan(scan, duplicate_params, progress=None):
+    """
+    根据工作簿扫描结果收集所有参数、依赖关系和循环依赖组，返回(all_params, formula_dependencies, cycle_components)
+    
+    progress不为None时，在开始检测循环依赖前调用progress('cycle_detection', 公式参数数)
+    """
+    all_params = {}
+    formula_dependencies = {}
+    cycle_components = []
+    
+    row_indexes = build_row_indexes(scan, duplicate_params)
+    
+    try:
+        for sheet, sheet_scan in scan.sheets.items():
             # 检查工作表结构
-            if ws.max_row < 2 or ws.max_column < 3:
+            if sheet_scan.max_row < 2 or sheet_scan.max_col < 3:
                 print(f"警告: 工作表 {sheet} 结构不符合要求")
                 continue
             
-            # 创建单元格到参数名的映射
-            cell_to_param_map = {}
-            
-            # 先建立单元格地址到参数标识符的映射
-            for row in range(2, ws.max_row + 1):
-                param_name = ws.cell(row=row, column=name_col).value
-                if param_name:
-                    # 检查是否为重名参数
-                    is_duplicate = len(duplicate_params.get(param_name, [])) > 1
-                    
-                    # 为重名参数创建唯一标识符
-                    param_id = f"{param_name}_{sheet}_r{row}" if is_duplicate else param_name
-                    
-                    cell_addr = f"{get_column_letter(name_col)}{row}"
-                    cell_to_param_map[cell_addr] = param_id
-            
             # 遍历所有行收集参数信息和依赖关系
-            for row in range(2, ws.max_row + 1):
-                param_name = ws.cell(row=row, column=name_col).value
-                if not param_name:
-                    continue  # 跳过没有参数名的行
-                
+            for row, param_name, param_unit, raw_value, cached_value, is_formula in sheet_scan.rows:
                 # 检查是否为重名参数
                 is_duplicate = len(duplicate_params.get(param_name, [])) > 1
                 
                 # 为重名参数创建唯一标识符
                 param_id = f"{param_name}_{sheet}_r{row}" if is_duplicate else param_name
                 
-                param_unit = ws.cell(row=row, column=unit_col).value
-                
                 # 存储参数信息
-                param_info = {
-                    "名称": param_name,
-                    "标识符": param_id,
-                    "单位": param_unit if param_unit else "",
-                    "工作表": sheet,
-                    "行": row,
-                    "值": None,
-                    "公式": "",
-                    "公式描述": "",
-                    "依赖": set(),
-                    "依赖描述": set(),
-                    "是否继承": False,
-                    "有循环依赖": False
-                }
-                
-                # 获取数值
-                value_cell = ws.cell(row=row, column=value_col)
-                calculated_cell = ws_data.cell(row=row, column=value_col)
+                param_info = ParamRecord(param_name, param_id, param_unit if param_unit else "", sheet, row)
                 
                 # 检查是否为公式
-                if value_cell.data_type == 'f':
-                    original_formula = str(value_cell.value)
+                if is_formula:
+                    original_formula = str(raw_value)
                     
                     # 去除公式前的等号
                     if original_formula.startswith('='):
                         original_formula = original_formula[1:]
                     
-                    calculated_value = calculated_cell.value
-                    
-                    param_info["值"] = calculated_value
-                    param_info["公式"] = original_formula
+                    param_info.value = cached_value
+                    param_info.formula = original_formula
                     
-                    # 分析公式中的依赖关系
+                    # 分析公式中的依赖关系（基于词法分析，支持跨工作表引用）
                     try:
-                        direct_refs = re.findall(r'([A-Z]+)([0-9]+)', original_formula)
-                        range_refs = re.findall(r'([A-Z]+)([0-9]+):([A-Z]+)([0-9]+)', original_formula)
+                        references, ranges, human_readable_formula = analyze_formula_references(
+                            original_formula, sheet, row, row_indexes)
                         
-                        human_readable_formula = original_formula
-                        
-                        # 处理直接引用分析
-                        for col_letter, row_num in direct_refs:
-                            cell_addr = f"{col_letter}{row_num}"
-                            ref_row = int(row_num)
+                        if references or ranges:
+                            # 存储依赖关系（范围引用以区间形式保存），参数信息与formula_dependencies共享同一集合
+                            deps = DependencySet('ids')
+                            dep_names = DependencySet('names')
                             
-                            # 如果引用了另一个参数（行）
-                            if ref_row != row and ref_row >= 2:  # 不是自己且不是表头
-                                ref_param_name = ws.cell(row=ref_row, column=name_col).value
-                                if ref_param_name:
-                                    # 检查被引用参数是否为重名参数
-                                    is_ref_duplicate = len(duplicate_params.get(ref_param_name, [])) > 1
-                                    ref_param_id = f"{ref_param_name}_{sheet}_r{ref_row}" if is_ref_duplicate else ref_param_name
-                                    
-                                    param_info["依赖"].add(ref_param_id)
-                                    param_info["依赖描述"].add(ref_param_name)
-                                    
-                                    # 存储依赖关系
-                                    if param_id not in formula_dependencies:
-                                        formula_dependencies[param_id] = set()
-                                    formula_dependencies[param_id].add(ref_param_id)
-                                    
-                                    # 替换公式中的单元格引用为参数名
-                                    if cell_addr in human_readable_formula:
-                                        human_readable_formula = human_readable_formula.replace(cell_addr, ref_param_name)
-                        
-                        # 处理范围引用
-                        for start_col_letter, start_row, end_col_letter, end_row in range_refs:
-                            start_row = int(start_row)
-                            end_row = int(end_row)
+                            for ref_param_id, ref_param_name in references:
+                                deps.add(ref_param_id)
+                                dep_names.add(ref_param_name)
                             
-                            for r in range(start_row, end_row + 1):
-                                if r != row and r >= 2:  # 不是自己且不是表头
-                                    ref_param_name = ws.cell(row=r, column=name_col).value
-                                    if ref_param_name:
-                                        # 检查被引用参数是否为重名参数
-                                        is_ref_duplicate = len(duplicate_params.get(ref_param_name, [])) > 1
-                                        ref_param_id = f"{ref_param_name}_{sheet}_r{r}" if is_ref_duplicate else ref_param_name
-                                        
-                                        param_info["依赖"].add(ref_param_id)
-                                        param_info["依赖描述"].add(ref_param_name)
-                                        
-                                        # 存储依赖关系
-                                        if param_id not in formula_dependencies:
-                                            formula_dependencies[param_id] = set()
-                                        formula_dependencies[param_id].add(ref_param_id)
+                            for index, lo, hi in ranges:
+                                deps.add_range(index, lo, hi)
+                            
+                            deps.compact()
+                            dep_names.compact()
+                            dep_names.ranges = deps.ranges  # 范围段相同，共享同一个元组
+                            formula_dependencies[param_id] = param_info.deps = deps
+                            param_info.dep_names = dep_names
                         
                         # 更新公式描述
-                        param_info["公式描述"] = human_readable_formula
+                        param_info.formula_description = human_readable_formula
                     except Exception as e:
                         print(f"分析公式时出错: {str(e)}")
-                        param_info["公式描述"] = "公式分析错误: " + original_formula
+                        param_info.formula_description = "公式分析错误: " + original_formula
                 else:
                     # 非公式值
-                    param_info["值"] = value_cell.value
+                    param_info.value = raw_value
                 
                 # 将参数信息添加到总字典中
                 all_params[param_id] = param_info
         
         # 检测循环依赖
-        circular_dependencies, cycle_paths = detect_circular_dependencies(formula_dependencies)
+        if progress:
+            progress('cycle_detection', len(formula_dependencies))
+        circular_dependencies, cycle_components = detect_circular_dependencies(formula_dependencies)
         
         # 在参数信息中标记循环依赖
         for param_id in circular_dependencies:
             if param_id in all_params:
-                all_params[param_id]["有循环依赖"] = True
+                all_params[param_id].circular = True
         
-        return all_params, formula_dependencies
+        return all_params, formula_dependencies, cycle_components
     except Exception as e:
         print(f"收集参数和依赖关系时出错: {str(e)}")
-        return all_params, formula_dependencies
+        return all_params, formula_dependencies, cycle_components
 
-def detect_circular_dependencies(formula_dependencies):
-    """简化的循环依赖检测算法"""
-    circular_params = set()  # 存储有循环依赖的参数ID
-    cycle_paths = []  # 存储发现的循环路径
-    
-    # 使用简化的DFS算法
-    for start_node in formula_dependencies:
-        visited = set()
-        stack = [(start_node, [start_node])]
-        
-        while stack:
-            node, path = stack.pop()
-            
-            # 获取当前节点的依赖
-            deps = formula_dependencies.get(node, set())
-            for dep in deps:
-                # 如果依赖已在当前路径中，发现循环
-                if dep in path:
-                    cycle = path[path.index(dep):] + [dep]
-                    cycle_paths.append(cycle)
-                    circular_params.update(cycle)
-                # 否则继续DFS
-                elif dep in formula_dependencies and dep not in visited:
-                    visited.add(dep)
-                    stack.append((dep, path + [dep]))
-    
-    # 去除重复循环路径
-    unique_paths = []
-    seen = set()
-    
-    for cycle in cycle_paths:
-        # 标准化循环路径以检测重复
-        cycle_str = '->'.join(sorted(cycle))
-        if cycle_str not in seen:
-            seen.add(cycle_str)
-            unique_paths.append(cycle)
-    
-    return circular_params, unique_paths
+def detect_circular_dependencies(formula_dependencies, graph=None):
+    """
+    检测循环依赖，返回(有循环依赖的参数集合, 循环依赖组列表)
+    
+    每个组是一个强连通分量，包含多于一个参数，或是依赖自身的单个参数。参数先编号为整数依赖图，
+    用Kahn分层剥离无环部分后，只在剩余的参数上运行Tarjan算法，时间复杂度O(V+E)。
+    没有依赖的参数不可能处于循环中，graph为None时只对formula_dependencies中的参数编号。
+    """
+    if graph is None:
+        graph = DependencyGraph.from_dependencies(formula_dependencies, formula_dependencies)
+    components = [graph.to_ids(component) for component in graph.cycle_components()]
+    
+    circular_params = set()
+    for component in components:
+        circular_params.update(component)
+    
+    return circular_params, components
 
 def process_parameters(all_params, formula_dependencies):
     """处理参数：先处理同名同值参数，再处理同名不同值参数"""
@@ -383,15 +512,32 @@ def process_parameters(all_params, formula_dependencies):
     
     return param_replacements, different_value_groups, optimized_dependencies, renamed_params
 
-def generate_optimized_excel(file_path, all_params, param_replacements, different_value_groups, formula_dependencies):
-    """生成优化后的Excel文件，处理同名同值参数"""
+# 优化后文件中参数行的颜色填充方案
+OPTIMIZED_FILLS = {
+    'input': PatternFill(start_color="ADD8E6", end_color="ADD8E6", fill_type="solid"),  # 浅蓝色-输入参数
+    'output': PatternFill(start_color="F08080", end_color="F08080", fill_type="solid"),  # 浅红色-输出参数
+    'intermediate': PatternFill(start_color="90EE90", end_color="90EE90", fill_type="solid"),  # 浅绿色-中间参数
+    'circular': PatternFill(start_color="FFD700", end_color="FFD700", fill_type="solid"),  # 黄色-循环依赖
+}
+
+def generate_optimized_excel(file_path, all_params, param_replacements, different_value_groups, formula_dependencies,
+                             cycle_components=None, progress=None, sheet_max_cols=None, output_scan=None):
+    """
+    生成优化后的Excel文件，处理同名同值参数；progress不为None时在保存前调用progress('saving', 保留的参数数)
+    
+    以只读模式顺序读取原工作簿，同时以只写模式逐行写出优化后的工作簿：被替换的参数行直接跳过，
+    其余行的行号和公式引用按删除的行重新编号，颜色标记和依赖关系/公式列在同一遍中写入，
+    不需要把整个工作簿载入内存。只写模式不保留合并单元格、列宽、批注等工作表级设置。
+    
+    sheet_max_cols为{工作表: 有内容的最大列号}（如扫描结果中的max_col），为None时先扫描一遍求出。
+    
+    output_scan不为None时，把写出的每一行按scan_workbook读取优化后文件的结果记入其中：
+    公式单元格没有缓存的计算结果，参数行的行号为删除行之后的新行号。生成失败时output_scan被清空。
+    """
     output_path = os.path.splitext(file_path)[0] + "_optimized.xlsx"
     
     try:
-        # 加载原始Excel工作簿
-        wb = openpyxl.load_workbook(file_path, data_only=False)
-        
-        # 创建参数ID到位置的映射
+        # 创建参数位置映射
         param_id_to_location = {}
         location_to_param_id = {}
         
@@ -402,286 +548,320 @@ def generate_optimized_excel(file_path, all_params, param_replacements, differen
             location_to_param_id[(sheet_name, row)] = param_id
         
         # 确定参数类型
-        input_params, output_params, intermediate_params, _ = categorize_parameters(all_params, formula_dependencies)
+        input_params, output_params, intermediate_params, _ = categorize_parameters(all_params, formula_dependencies, cycle_components)
         
-        # 定义颜色填充方案
-        fills = {
-            'input': PatternFill(start_color="ADD8E6", end_color="ADD8E6", fill_type="solid"),  # 浅蓝色-输入参数
-            'output': PatternFill(start_color="F08080", end_color="F08080", fill_type="solid"),  # 浅红色-输出参数
-            'intermediate': PatternFill(start_color="90EE90", end_color="90EE90", fill_type="solid"),  # 浅绿色-中间参数
-            'circular': PatternFill(start_color="FFD700", end_color="FFD700", fill_type="solid"),  # 黄色-循环依赖
-            'replaced': PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")   # 灰色-被替换参数
-        }
+        # 被替换的参数行将被删除
+        deleted_rows = {}
+        for param_id in param_replacements:
+            if param_id in param_id_to_location:
+                sheet_name, row = param_id_to_location[param_id]
+                deleted_rows.setdefault(sheet_name, set()).add(row)
+        row_shifts = RowShifts(deleted_rows)
         
-        # 更新Excel中的参数名称并添加颜色标记
-        for sheet_name in wb.sheetnames:
-            ws = wb[sheet_name]
-            name_col = 1
-            
-            # 找出每个工作表的实际最大列，避免出现空列
-            actual_max_col = 0
-            for col in range(1, ws.max_column + 1):
-                for row in range(1, ws.max_row + 1):
-                    if ws.cell(row=row, column=col).value is not None:
-                        actual_max_col = max(actual_max_col, col)
-            
-            # 设置依赖关系和公式列的位置（紧接实际数据列）
-            dependency_col = actual_max_col + 1
-            formula_col = actual_max_col + 2
-            
-            # 更新参数名称和添加颜色标记
-            for row in range(2, ws.max_row + 1):
-                param_id = location_to_param_id.get((sheet_name, row))
-                if not param_id or param_id not in all_params:
-                    continue
-                
-                # 更新参数名称
-                param_name = all_params[param_id].get("名称")
-                if param_name:
-                    ws.cell(row=row, column=name_col).value = param_name
-                
-                # 添加颜色标记
-                fill = None
-                
-                # 对被替换的参数进行灰色标记（将被删除）
-                if param_id in param_replacements:
-                    fill = fills['replaced']
-                    source_id = param_replacements[param_id]
-                    source_name = all_params[source_id]["名称"]
-                    # 在备注中添加被替换信息
-                    cell = ws.cell(row=row, column=name_col)
-                    if not cell.comment:
-                        comment = f"此参数将被删除，使用 {source_name} 替代"
-                        cell.comment = openpyxl.comments.Comment(comment, "Excel分析工具")
-                # 对其他类型参数进行颜色标记
-                elif all_params[param_id].get("有循环依赖", False):
-                    fill = fills['circular']  # 循环依赖
-                elif param_id in input_params:
-                    fill = fills['input']  # 输入参数
-                elif param_id in intermediate_params:
-                    fill = fills['intermediate']  # 中间参数
-                elif param_id in output_params:
-                    fill = fills['output']  # 输出参数
-                
-                # 应用颜色
-                if fill:
-                    for col in range(1, 4):  # 只为前三列添加颜色（名称、单位、值）
-                        ws.cell(row=row, column=col).fill = fill
-            
-            # 添加依赖关系和公式列
-            ws.cell(row=1, column=dependency_col).value = "依赖关系"
-            ws.cell(row=1, column=formula_col).value = "公式"
-            ws.cell(row=1, column=dependency_col).font = Font(bold=True)
-            ws.cell(row=1, column=formula_col).font = Font(bold=True)
-            
-            # 填充依赖关系和公式
-            for row in range(2, ws.max_row + 1):
-                param_id = location_to_param_id.get((sheet_name, row))
-                if not param_id or param_id not in all_params:
-                    continue
-                
-                param_info = all_params[param_id]
+        remap = make_reference_remapper(param_id_to_location, param_replacements, row_shifts.new_row)
+        
+        if sheet_max_cols is None:
+            sheet_max_cols = find_sheet_max_cols(file_path)
+        
+        source = openpyxl.load_workbook(file_path, read_only=True, data_only=False)
+        output = openpyxl.Workbook(write_only=True)
+        try:
+            for ws in source.worksheets:
+                sheet_name = ws.title
+                out_ws = output.create_sheet(sheet_name)
+                max_col = sheet_max_cols.get(sheet_name, 0)
+                deleted = row_shifts.deleted(sheet_name)
+                out_scan = None
+                if output_scan is not None:
+                    out_scan = SheetScan(sheet_name)
+                    output_scan.sheets[sheet_name] = out_scan
+                out_row_number = 0
                 
-                # 填充依赖关系
-                dependencies = list(param_info.get("依赖描述", set()))
-                if dependencies:
-                    ws.cell(row=row, column=dependency_col).value = ", ".join(dependencies)
+                # 依赖关系和公式列紧接实际数据列
+                dependency_col = max_col + 1
+                styles = {}  # {(原样式ID, 颜色标记): 新工作簿中的样式}，相同组合只计算一次
                 
-                # 填充公式
-                formula_desc = param_info.get("公式描述", "")
-                if formula_desc:
-                    ws.cell(row=row, column=formula_col).value = formula_desc
+                for row, cells in enumerate(ws.iter_rows(max_col=max_col or None), start=1):
+                    if row in deleted:
+                        continue
                     
-                # 对于被替换的参数，添加替换信息
-                if param_id in param_replacements:
-                    source_id = param_replacements[param_id]
-                    source_info = all_params[source_id]
-                    replacement_note = f"将被 {source_info['名称']} (工作表:{source_info['工作表']}, 行:{source_info['行']}) 替代"
-                    ws.cell(row=row, column=formula_col+1).value = replacement_note
-        
-        # 删除被替换的参数行
-        row_shifts = delete_replaced_rows(wb, all_params, param_replacements, location_to_param_id)
-        
-        # 修复公式引用
-        fix_formula_references(wb, param_id_to_location, param_replacements, row_shifts)
-        
-        # 保存优化后的Excel
-        wb.save(output_path)
+                    param_id = location_to_param_id.get((sheet_name, row)) if row > 1 else None
+                    param_info = all_params.get(param_id) if param_id else None
+                    fill = None
+                    if param_info is not None:
+                        if param_info.get("有循环依赖", False):
+                            fill = 'circular'  # 循环依赖
+                        elif param_id in input_params:
+                            fill = 'input'  # 输入参数
+                        elif param_id in intermediate_params:
+                            fill = 'intermediate'  # 中间参数
+                        elif param_id in output_params:
+                            fill = 'output'  # 输出参数
+                    
+                    out_row = []
+                    for col, cell in enumerate(cells, start=1):
+                        value = cell.value
+                        if col == 1 and param_info is not None and param_info.get("名称"):
+                            value = param_info["名称"]  # 更新参数名称
+                        elif cell.data_type == 'f':
+                            value = _rewrite_formula_value(value, remap, sheet_name)
+                        
+                        out_cell = WriteOnlyCell(out_ws, value)
+                        # 只为前三列添加颜色（名称、单位、值）；补齐的空单元格没有样式
+                        style_id = cell._style_id if getattr(cell, 'has_style', False) else None
+                        cell_fill = fill if col <= 3 else None
+                        if style_id is not None or cell_fill is not None:
+                            _copy_cell_style(cell, out_cell, style_id, cell_fill, styles)
+                        out_row.append(out_cell)
+                    
+                    if row == 1:
+                        # 表头：依赖关系和公式列
+                        out_row.extend([None] * (dependency_col - 1 - len(out_row)))
+                        for title in ("依赖关系", "公式"):
+                            header = WriteOnlyCell(out_ws, title)
+                            header.font = Font(bold=True)
+                            out_row.append(header)
+                    elif param_info is not None:
+                        dependencies = list(param_info.get("依赖描述", set()))
+                        formula_desc = param_info.get("公式描述", "")
+                        if dependencies or formula_desc:
+                            out_row.extend([None] * (dependency_col - 1 - len(out_row)))
+                            out_row.append(", ".join(dependencies) if dependencies else None)
+                            out_row.append(formula_desc or None)
+                    
+                    # 记录在写出之前进行：只写工作表写出单元格时会修改单元格对象
+                    out_row_number += 1
+                    if out_scan is not None:
+                        _record_written_row(output_scan, out_scan, out_row_number, out_row)
+                    out_ws.append(out_row)
+            
+            # 保存优化后的Excel
+            if progress:
+                progress('saving', len(all_params) - len(param_replacements))
+            output.save(output_path)
+        finally:
+            source.close()
         return output_path
     
     except Exception as e:
         print(f"生成优化后的Excel时出错: {str(e)}")
+        if output_scan is not None:
+            output_scan.sheets.clear()
+            output_scan.duplicate_params.clear()
         return None
 
-def categorize_parameters(all_params, formula_dependencies):
-    """对参数进行分类"""
-    # 找出所有参与依赖关系的参数
-    all_dependent_params = set()  # 被依赖的参数
-    all_dependency_params = set()  # 依赖其他参数的参数
-    circular_params = set()  # 循环依赖的参数
-    
-    # 找出循环依赖参数
-    for param_id, param_info in all_params.items():
-        if param_info.get("有循环依赖", False):
-            circular_params.add(param_id)
+def _record_written_row(scan, sheet_scan, row, out_row):
+    """把写入优化后文件的一行（只写单元格或普通值的列表）按读取该文件时的结果记入sheet_scan"""
+    values = [getattr(cell, 'value', cell) for cell in out_row]
+    last_col = next((col for col in range(len(values), 0, -1) if values[col - 1] is not None), 0)
+    if last_col == 0:
+        return
+    sheet_scan.max_row = row
+    sheet_scan.max_col = max(sheet_scan.max_col, last_col)
+    
+    values.extend([None] * (VALUE_COL - len(values)))
+    param_name, param_unit, raw_value = values[NAME_COL - 1], values[UNIT_COL - 1], values[VALUE_COL - 1]
+    if row == 1 or not param_name:
+        return
+    if isinstance(raw_value, ArrayFormula):
+        raw_value = raw_value.text
+        is_formula = True
+    else:
+        is_formula = isinstance(raw_value, str) and raw_value.startswith('=') and len(raw_value) > 1
+    # 新写出的公式单元格没有缓存的计算结果
+    cached_value = None if is_formula else raw_value
+    _record_row(scan, sheet_scan, row, param_name, param_unit, raw_value, cached_value, is_formula)
+
+def find_sheet_max_cols(file_path):
+    """以只读模式扫描一遍工作簿，返回{工作表: 有内容的最大列号}"""
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=False)
+    try:
+        max_cols = {}
+        for ws in wb.worksheets:
+            max_col = 0
+            for row in ws.iter_rows(values_only=True):
+                for col in range(len(row), max_col, -1):
+                    if row[col - 1] is not None:
+                        max_col = col
+                        break
+            max_cols[ws.title] = max_col
+        return max_cols
+    finally:
+        wb.close()
+
+def _copy_cell_style(cell, out_cell, style_id, fill, styles):
+    """
+    把只读单元格的样式（style_id为None时为默认样式）复制到只写单元格，fill不为None时换成对应的颜色标记
+    
+    样式对象加入新工作簿时需要计算哈希，按(原样式ID, 颜色标记)缓存计算结果。
+    """
+    key = (style_id, fill)
+    style = styles.get(key)
+    if style is None:
+        if style_id is not None:
+            out_cell.font = copy(cell.font)
+            out_cell.fill = copy(cell.fill)
+            out_cell.border = copy(cell.border)
+            out_cell.alignment = copy(cell.alignment)
+            out_cell.protection = copy(cell.protection)
+            out_cell.number_format = cell.number_format
+        if fill is not None:
+            out_cell.fill = OPTIMIZED_FILLS[fill]
+        styles[key] = copy(out_cell._style)
+    else:
+        out_cell._style = copy(style)
+
+def _rewrite_formula_value(value, remap, sheet_name):
+    """按remap重写公式单元格的值（公式文本或数组公式），无法解析时保持原样"""
+    if not isinstance(value, (str, ArrayFormula)):
+        return value
+    formula = value.text if isinstance(value, ArrayFormula) else str(value)
+    try:
+        new_formula = rewrite_references(formula, lambda kind, ref: remap(kind, ref, sheet_name))
+    except Exception as e:
+        print(f"无法解析公式 {sheet_name}!{formula}: {str(e)}")
+        return value
+    if new_formula == formula:
+        return value
+    if isinstance(value, ArrayFormula):
+        return ArrayFormula(value.ref, new_formula)
+    return new_formula
+
+def categorize_parameters(all_params, formula_dependencies, cycle_components=None, graph=None):
+    """
+    对参数进行分类；cycle_components为detect_circular_dependencies返回的循环依赖组
+    
+    graph为按all_params编号的DependencyGraph，为None时临时构建；分类只需比较每个参数的出度和入度。
+    """
+    if graph is None:
+        graph = DependencyGraph.from_dependencies(all_params, formula_dependencies)
+    
+    circular = np.zeros(len(graph), dtype=bool)  # 循环依赖的参数
+    
+    # 找出循环依赖参数（未提供循环依赖组时使用参数上的标记）
+    if cycle_components is not None:
+        for component in cycle_components:
+            circular[graph.nodes(component)] = True
+    else:
+        for param_id, param_info in all_params.items():
+            if param_info.get("有循环依赖", False):
+                circular[graph.index[param_id]] = True
     
-    # 收集依赖关系
-    for param, deps in formula_dependencies.items():
-        all_dependency_params.add(param)
-        for dep in deps:
-            all_dependent_params.add(dep)
+    has_dependencies = graph.out_degrees() > 0  # 依赖其他参数的参数
+    has_dependents = graph.in_degrees() > 0     # 被依赖的参数
     
     # 分类参数
-    input_params = (all_dependent_params - all_dependency_params) - circular_params
-    output_params = (all_dependency_params - all_dependent_params) - circular_params
-    intermediate_params = (all_dependent_params.intersection(all_dependency_params)) | circular_params
+    input_params = set(graph.to_ids(np.flatnonzero(has_dependents & ~has_dependencies & ~circular)))
+    output_params = set(graph.to_ids(np.flatnonzero(has_dependencies & ~has_dependents & ~circular)))
+    intermediate_params = set(graph.to_ids(np.flatnonzero((has_dependents & has_dependencies) | circular)))
     
     # 独立参数
-    independent_params = set()
-    for param_id in all_params:
-        if param_id not in input_params and param_id not in output_params and param_id not in intermediate_params:
-            independent_params.add(param_id)
+    independent_params = set(graph.to_ids(np.flatnonzero(~has_dependents & ~has_dependencies & ~circular)))
     
     return input_params, output_params, intermediate_params, independent_params
 
-def delete_replaced_rows(wb, all_params, param_replacements, location_to_param_id):
-    """删除被替换的参数行，并处理相关行号变化"""
-    row_shifts = {}  # {(sheet_name, original_row): shift_count}
-    
-    for sheet_name in wb.sheetnames:
-        ws = wb[sheet_name]
-        name_col = 1
-        
-        # 收集要删除的行
-        rows_to_delete = []
-        for row in range(2, ws.max_row + 1):
-            param_id = location_to_param_id.get((sheet_name, row))
-            if param_id and param_id in param_replacements:
-                # 这一行将被删除，因为它是被替换的参数
-                rows_to_delete.append(row)
-        
-        if not rows_to_delete:
-            continue
-        
-        # 从后往前删除行，避免索引变化影响
-        rows_to_delete.sort(reverse=True)
-        shift_count = 0
-        
-        for row in rows_to_delete:
-            # 更新此行之后所有行的位移信息
-            for r in range(row + 1, ws.max_row + 2):
-                row_shifts[(sheet_name, r)] = shift_count
-            
-            # 删除行
-            ws.delete_rows(row)
-            shift_count += 1
+class RowShifts:
+    """
+    删除行后的行号映射表
+    
+    每个工作表保存一个前缀和数组：removed[r]为行号小于r的已删除行数，新行号 = 原行号 - removed[r]，
+    查询为O(1)。行号超过最后一个删除行时位移都等于删除的总行数。
+    """
+    
+    def __init__(self, deleted_rows):
+        """deleted_rows: {工作表: 删除的行号集合}"""
+        self._deleted = {}
+        self._removed = {}
+        for sheet_name, rows in deleted_rows.items():
+            rows = set(rows)
+            if not rows:
+                continue
+            last_row = max(rows)
+            removed = [0] * (last_row + 2)
+            count = 0
+            for row in range(1, last_row + 2):
+                removed[row] = count
+                if row in rows:
+                    count += 1
+            self._deleted[sheet_name] = rows
+            self._removed[sheet_name] = removed
+    
+    def deleted(self, sheet_name):
+        """工作表中删除的行号集合"""
+        return self._deleted.get(sheet_name, frozenset())
+    
+    def new_row(self, sheet_name, row, end=False):
+        """
+        原行号在删除行之后的新行号；整列引用（row为None）保持None
         
-        # 更新最终的位移计数
-        if rows_to_delete:
-            min_deleted_row = min(rows_to_delete)
-            for r in range(min_deleted_row, ws.max_row + 2):
-                row_shifts[(sheet_name, r)] = shift_count
-    
-    return row_shifts
+        被删除的行映射到其后第一个保留行的位置；end=True（范围的结束行）时映射到其前一个保留行，
+        使包含被删除行的范围向上收缩。
+        """
+        if row is None:
+            return None
+        removed = self._removed.get(sheet_name)
+        if removed is None:
+            return row
+        new_row = row - removed[min(row, len(removed) - 1)]
+        if end and row in self._deleted[sheet_name]:
+            new_row -= 1
+        return new_row
+    
+    def __bool__(self):
+        return bool(self._removed)
 
-def fix_formula_references(wb, param_id_to_location, param_replacements, row_shifts=None):
-    """修复公式引用，将被替换参数的引用替换为源参数引用"""
-    if row_shifts is None:
-        row_shifts = {}
-    
-    # 创建源参数位置查找表，考虑行位移
-    source_locations = {}
+def make_reference_remapper(param_id_to_location, param_replacements, shift_row):
+    """
+    返回remap(kind, ref, formula_sheet)：计算引用在优化后文件中的新位置，不变时返回None
+    
+    被替换参数的引用（参数名称列和值列）改为源参数引用；shift_row(工作表, 原行号, end=False)给出
+    删除行后的新行号，end=True表示范围的结束行（如RowShifts.new_row）。
+    
+    替换目标预先合并了行位移，每个引用只需一次字典查找；同一工作表中相同引用的结果会被缓存，
+    公式重写的耗时与公式中引用词法单元的总数成正比。
+    """
+    # 被替换参数位置（删除行之前的行号） -> 源参数在删除行之后的位置
+    replacement_targets = {}
     for dependent_id, source_id in param_replacements.items():
         if dependent_id in param_id_to_location and source_id in param_id_to_location:
-            dependent_loc = param_id_to_location[dependent_id]
-            source_loc = param_id_to_location[source_id]
-            source_sheet, source_row = source_loc
-            
-            # 应用行位移调整
-            adjusted_row = source_row - row_shifts.get((source_sheet, source_row), 0)
-            source_locations[dependent_id] = (source_sheet, adjusted_row)
+            source_sheet, source_row = param_id_to_location[source_id]
+            replacement_targets[param_id_to_location[dependent_id]] = (source_sheet, shift_row(source_sheet, source_row))
+    
+    remapped = {}  # {(公式所在工作表, 类型, 原引用): 新引用或None}
     
-    for sheet_name in wb.sheetnames:
-        ws = wb[sheet_name]
+    def compute(kind, ref, formula_sheet):
+        ref_sheet = ref.sheet or formula_sheet
         
-        for row in range(1, ws.max_row + 1):
-            for col in range(1, ws.max_column + 1):
-                cell = ws.cell(row=row, column=col)
-                
-                if cell.data_type == 'f':
-                    original_formula = str(cell.value)
-                    new_formula = original_formula
-                    has_changes = False
-                    
-                    # 1. 替换从属参数引用为源参数引用
-                    for dependent_id, source_id in param_replacements.items():
-                        if dependent_id not in param_id_to_location or source_id not in param_id_to_location:
-                            continue
-                            
-                        dependent_sheet, dependent_row = param_id_to_location[dependent_id]
-                        source_sheet, adjusted_row = source_locations.get(dependent_id, param_id_to_location[source_id])
-                        
-                        # 替换带工作表名称的引用
-                        for col_letter in ['A', 'C']:  # 参数名称列和值列
-                            dep_addr = f"{dependent_sheet}!{col_letter}{dependent_row}"
-                            src_addr = f"{source_sheet}!{col_letter}{adjusted_row}"
-                            
-                            if dep_addr in new_formula:
-                                new_formula = new_formula.replace(dep_addr, src_addr)
-                                has_changes = True
-                        
-                        # 替换同一工作表内的简单引用
-                        if sheet_name == dependent_sheet:
-                            for col_letter in ['A', 'C']:
-                                dep_addr = f"{col_letter}{dependent_row}"
-                                
-                                if source_sheet == sheet_name:
-                                    src_addr = f"{col_letter}{adjusted_row}"
-                                else:
-                                    src_addr = f"{source_sheet}!{col_letter}{adjusted_row}"
-                                    
-                                if dep_addr in new_formula:
-                                    new_formula = new_formula.replace(dep_addr, src_addr)
-                                    has_changes = True
-                    
-                    # 2. 处理行位移引起的单元格引用变化
-                    if row_shifts:
-                        # 处理直接引用
-                        cell_refs = re.findall(r'([A-Za-z]+)([0-9]+)', new_formula)
-                        for col_letter, row_num in cell_refs:
-                            ref_row = int(row_num)
-                            shift = row_shifts.get((sheet_name, ref_row), 0)
-                            
-                            if shift > 0:
-                                new_row = ref_row - shift
-                                old_ref = f"{col_letter}{row_num}"
-                                new_ref = f"{col_letter}{new_row}"
-                                new_formula = new_formula.replace(old_ref, new_ref)
-                                has_changes = True
-                        
-                        # 处理范围引用
-                        range_refs = re.findall(r'([A-Za-z]+)([0-9]+):([A-Za-z]+)([0-9]+)', new_formula)
-                        for start_col, start_row, end_col, end_row in range_refs:
-                            # 处理范围的行位移
-                            start_shift = row_shifts.get((sheet_name, int(start_row)), 0)
-                            end_shift = row_shifts.get((sheet_name, int(end_row)), 0)
-                            
-                            if start_shift > 0 or end_shift > 0:
-                                new_start = int(start_row) - start_shift
-                                new_end = int(end_row) - end_shift
-                                
-                                old_range = f"{start_col}{start_row}:{end_col}{end_row}"
-                                new_range = f"{start_col}{new_start}:{end_col}{new_end}"
-                                
-                                new_formula = new_formula.replace(old_range, new_range)
-                                has_changes = True
-                    
-                    # 更新单元格公式
-                    if has_changes:
-                        try:
-                            cell.value = new_formula
-                        except Exception as e:
-                            print(f"无法更新公式: {str(e)}")
+        if kind == 'range':
+            # 范围的起止行分别按行位移调整
+            start_row = shift_row(ref_sheet, ref.start.row)
+            end_row = shift_row(ref_sheet, ref.end.row, end=True)
+            if start_row == ref.start.row and end_row == ref.end.row:
+                return None
+            return ref._replace(start=ref.start._replace(row=start_row), end=ref.end._replace(row=end_row))
+        
+        # 被替换参数的引用（参数名称列和值列）改为源参数引用，其余引用只按行位移调整
+        target = replacement_targets.get((ref_sheet, ref.row)) if ref.col in (1, 3) else None
+        if target is None:
+            target_sheet, new_row = ref_sheet, shift_row(ref_sheet, ref.row)
+        else:
+            target_sheet, new_row = target
+        
+        if target_sheet == ref_sheet and new_row == ref.row:
+            return None
+        if target_sheet == ref_sheet:
+            new_sheet = ref.sheet
+        else:
+            new_sheet = None if target_sheet == formula_sheet else target_sheet
+        return ref._replace(sheet=new_sheet, row=new_row)
+    
+    def remap(kind, ref, formula_sheet):
+        key = (formula_sheet, kind, ref)
+        if key not in remapped:
+            remapped[key] = compute(kind, ref, formula_sheet)
+        return remapped[key]
+    
+    return remap
 
 def main():
     print("Excel参数分析工具")
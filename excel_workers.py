@@ -0,0 +1,374 @@
+"""
+Excel计算后端的常驻工作进程池
+
+每个工作线程独占一个计算后端实例（如一个Excel进程），工作簿在请求之间保持打开；
+同一个工作簿的请求优先交给已经打开它的工作线程。所有工作线程共享一个有上限的排队数，
+排满时直接拒绝新请求（PoolBusyError），由调用方返回503。后端使用一定次数后或健康检查失败时重启。
+
+xlwings的COM对象只能在创建它的线程中使用，因此对后端的所有调用都在工作线程内完成。
+后端通过CalculationBackend接口访问，测试和基准测试中可用FakeBackend代替Excel。
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from formula_engine import FormulaEngine
+
+VALUE_COL = 3  # 第3列是值列
+READ_GAP = 256  # 读取时同一工作表上相隔不超过该行数的单元格合并为一次读取
+
+
+def cell_blocks(cells, max_gap=1):
+    """
+    把[(工作表, 行)]按工作表分组为值列上的行区间块
+
+    相邻两个行号之差不超过max_gap时合并为同一块；max_gap=1时每块都由连续的行组成，
+    写入时必须如此，以免覆盖块内不属于cells的单元格。
+
+    Returns:
+        list: [(工作表, 起始行, 结束行)]
+    """
+    rows_by_sheet = OrderedDict()
+    for sheet_name, row in cells:
+        rows_by_sheet.setdefault(sheet_name, set()).add(row)
+
+    blocks = []
+    for sheet_name, rows in rows_by_sheet.items():
+        rows = sorted(rows)
+        first = previous = rows[0]
+        for row in rows[1:]:
+            if row - previous > max_gap:
+                blocks.append((sheet_name, first, previous))
+                first = row
+            previous = row
+        blocks.append((sheet_name, first, previous))
+    return blocks
+
+
+class PoolBusyError(RuntimeError):
+    """排队的计算请求已满"""
+
+
+class CalculationBackend:
+    """
+    计算后端接口：一个后端实例对应一个计算进程，只在一个工作线程中使用
+
+    cells为[(工作表, 行)]，值都位于第3列。后端只需实现按行区间整块读写值列的set_range/get_range，
+    set_values/get_values把单元格按工作表分组为行区间块，每块只调用一次，
+    跨进程调用次数与工作表（和不连续的行区间）数量相关，而与参数个数无关。
+    """
+
+    def start(self):
+        """启动计算进程"""
+        raise NotImplementedError
+
+    def open_workbook(self, file_path):
+        raise NotImplementedError
+
+    def close_workbook(self, file_path):
+        raise NotImplementedError
+
+    def set_range(self, file_path, sheet_name, first_row, values):
+        """从first_row开始向下连续写入值列"""
+        raise NotImplementedError
+
+    def get_range(self, file_path, sheet_name, first_row, last_row):
+        """读取值列first_row到last_row（含）的值"""
+        raise NotImplementedError
+
+    def calculate(self, file_path):
+        raise NotImplementedError
+
+    def set_values(self, file_path, cells, values):
+        latest = {}
+        for cell, value in zip(cells, values):
+            latest[cell] = value
+        for sheet_name, first_row, last_row in cell_blocks(latest):
+            self.set_range(file_path, sheet_name, first_row,
+                           [latest[(sheet_name, row)] for row in range(first_row, last_row + 1)])
+
+    def get_values(self, file_path, cells):
+        values = {}
+        for sheet_name, first_row, last_row in cell_blocks(cells, READ_GAP):
+            block = self.get_range(file_path, sheet_name, first_row, last_row)
+            for row, value in zip(range(first_row, last_row + 1), block):
+                values[(sheet_name, row)] = value
+        return [values.get(cell) for cell in cells]
+
+    def is_healthy(self):
+        return True
+
+    def quit(self):
+        """关闭计算进程及其打开的所有工作簿"""
+        raise NotImplementedError
+
+
+class XlwingsBackend(CalculationBackend):
+    """通过xlwings驱动一个不可见的Excel进程"""
+
+    def __init__(self, xw):
+        self.xw = xw
+        self.app = None
+        self.books = {}
+
+    def start(self):
+        self.app = self.xw.App(visible=False, add_book=False)
+        self.app.display_alerts = False
+        self.app.screen_updating = False
+
+    def open_workbook(self, file_path):
+        self.books[file_path] = self.app.books.open(file_path)
+
+    def close_workbook(self, file_path):
+        book = self.books.pop(file_path, None)
+        if book is not None:
+            book.close()
+
+    def _range(self, file_path, sheet_name, first_row, last_row):
+        sheet = self.books[file_path].sheets[sheet_name]
+        return sheet.range((first_row, VALUE_COL), (last_row, VALUE_COL)).options(ndim=2)
+
+    def set_range(self, file_path, sheet_name, first_row, values):
+        last_row = first_row + len(values) - 1
+        self._range(file_path, sheet_name, first_row, last_row).value = [[value] for value in values]
+
+    def get_range(self, file_path, sheet_name, first_row, last_row):
+        return [row[0] for row in self._range(file_path, sheet_name, first_row, last_row).value]
+
+    def calculate(self, file_path):
+        self.app.calculate()
+
+    def is_healthy(self):
+        try:
+            return self.app is not None and self.app.pid is not None and self.app.books is not None
+        except Exception:
+            return False
+
+    def quit(self):
+        self.books.clear()
+        if self.app is not None:
+            try:
+                self.app.quit()
+            except Exception:
+                self.app.kill()
+            self.app = None
+
+
+class FakeBackend(CalculationBackend):
+    """
+    用进程内公式引擎模拟Excel的后端，供测试和基准测试使用
+
+    calls记录各方法的调用次数，可用来统计一次计算需要多少次跨进程读写。
+
+    Args:
+        loader: loader(file_path)返回WorkbookModel（如model_cache.get）
+        latency: 每次计算额外等待的秒数，用于模拟Excel的计算耗时
+    """
+
+    def __init__(self, loader, latency=0.0):
+        self.loader = loader
+        self.latency = latency
+        self.books = {}
+        self.started = False
+        self.calls = {'start': 0, 'open_workbook': 0, 'set_range': 0, 'get_range': 0, 'calculate': 0}
+
+    def start(self):
+        self.started = True
+        self.calls['start'] += 1
+
+    def open_workbook(self, file_path):
+        model = self.loader(file_path)
+        engine = FormulaEngine(model.all_params, model.formula_dependencies, compiled=model.parsed_formulas,
+                               graph=model.graph)
+        self.books[file_path] = {'engine': engine, 'inputs': {}, 'values': engine.calculate()}
+        self.calls['open_workbook'] += 1
+
+    def close_workbook(self, file_path):
+        self.books.pop(file_path, None)
+
+    def set_range(self, file_path, sheet_name, first_row, values):
+        book = self.books[file_path]
+        cell_map = book['engine'].cell_map
+        for row, value in enumerate(values, first_row):
+            param_id = cell_map.get((sheet_name, row))
+            if param_id is not None:
+                book['inputs'][param_id] = value
+        self.calls['set_range'] += 1
+
+    def calculate(self, file_path):
+        book = self.books[file_path]
+        if self.latency:
+            time.sleep(self.latency)
+        book['values'] = book['engine'].calculate(book['inputs'])
+        self.calls['calculate'] += 1
+
+    def get_range(self, file_path, sheet_name, first_row, last_row):
+        book = self.books[file_path]
+        cell_map = book['engine'].cell_map
+        self.calls['get_range'] += 1
+        return [book['values'].get(cell_map.get((sheet_name, row))) for row in range(first_row, last_row + 1)]
+
+    def is_healthy(self):
+        return self.started
+
+    def quit(self):
+        self.books.clear()
+        self.started = False
+
+
+class ExcelWorker:
+    """
+    一个常驻工作线程：独占一个后端实例，按LRU保持最多max_workbooks个工作簿打开
+
+    后端累计处理max_uses个请求后重启，重启前检查健康状态失败时也会重启。
+    """
+
+    def __init__(self, index, backend_factory, max_uses=200, max_workbooks=4):
+        self.index = index
+        self.backend_factory = backend_factory
+        self.max_uses = max_uses
+        self.max_workbooks = max_workbooks
+        self.tasks = queue.Queue()
+        self.pending = 0          # 已分配给该线程但尚未完成的请求数（由池在锁内维护）
+        self.open_books = OrderedDict()  # {文件路径: 打开时的文件修改时间}
+        self.backend = None
+        self.uses = 0
+        self.restarts = 0
+        self.completed = 0
+        self.thread = threading.Thread(target=self._loop, name=f'excel-worker-{index}', daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                self._stop_backend()
+                return
+            file_path, func, future, on_done = task
+            if future.set_running_or_notify_cancel():
+                try:
+                    backend = self._ensure_backend()
+                    self._ensure_workbook(file_path)
+                    self.uses += 1
+                    future.set_result(func(backend, file_path))
+                except Exception as e:
+                    future.set_exception(e)
+                    # 出错后重启后端，避免后续请求使用状态异常的Excel进程
+                    self._stop_backend()
+            self.completed += 1
+            on_done(self, file_path)
+
+    def _ensure_backend(self):
+        if self.backend is not None and (self.uses >= self.max_uses or not self.backend.is_healthy()):
+            print(f"Excel工作线程 {self.index} 已使用 {self.uses} 次或状态异常，正在重启")
+            self._stop_backend()
+        if self.backend is None:
+            self.backend = self.backend_factory()
+            self.backend.start()
+            self.uses = 0
+            self.restarts += 1
+        return self.backend
+
+    def _ensure_workbook(self, file_path):
+        mtime = os.path.getmtime(file_path) if os.path.exists(file_path) else None
+        if file_path in self.open_books:
+            if self.open_books[file_path] == mtime:
+                self.open_books.move_to_end(file_path)
+                return
+            self.backend.close_workbook(file_path)
+            del self.open_books[file_path]
+
+        while len(self.open_books) >= self.max_workbooks:
+            oldest, _ = self.open_books.popitem(last=False)
+            self.backend.close_workbook(oldest)
+        self.backend.open_workbook(file_path)
+        self.open_books[file_path] = mtime
+
+    def _stop_backend(self):
+        if self.backend is not None:
+            try:
+                self.backend.quit()
+            except Exception as e:
+                print(f"关闭Excel工作线程 {self.index} 的后端时出错: {str(e)}")
+        self.backend = None
+        self.open_books.clear()
+
+
+class ExcelWorkerPool:
+    """
+    固定大小的Excel计算工作线程池
+
+    Args:
+        backend_factory: 无参数调用时返回新的CalculationBackend
+        size: 工作线程数（即同时存在的Excel进程数）
+        max_queue: 所有工作线程上等待和正在处理的请求总数上限，超出时抛出PoolBusyError
+        max_uses: 每个后端实例处理的请求数上限，达到后重启
+        max_workbooks: 每个工作线程保持打开的工作簿数
+    """
+
+    def __init__(self, backend_factory, size=2, max_queue=16, max_uses=200, max_workbooks=4):
+        self.max_queue = max_queue
+        self.workers = [ExcelWorker(i, backend_factory, max_uses, max_workbooks) for i in range(size)]
+        self._affinity = {}  # {文件路径: 最近处理它的工作线程}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def submit(self, file_path, func):
+        """
+        将func(backend, file_path)交给工作线程执行，返回Future
+
+        优先选择已打开该工作簿的线程，除非它的排队数比最空闲的线程多出一个以上。
+        """
+        with self._lock:
+            pending = sum(worker.pending for worker in self.workers)
+            if pending >= self.max_queue:
+                self.rejected += 1
+                raise PoolBusyError(f"Excel计算队列已满（{pending} 个请求）")
+
+            idle = min(self.workers, key=lambda worker: worker.pending)
+            worker = self._affinity.get(file_path)
+            if worker is None or worker.pending > idle.pending + 1:
+                worker = idle
+            self._affinity[file_path] = worker
+            worker.pending += 1
+
+        future = Future()
+        worker.tasks.put((file_path, func, future, self._task_done))
+        return future
+
+    def _task_done(self, worker, file_path):
+        with self._lock:
+            worker.pending -= 1
+
+    def calculate(self, file_path, input_cells, input_values, result_cells, timeout=None):
+        """写入输入值、重算并读取结果单元格的值"""
+        def run(backend, path):
+            backend.set_values(path, input_cells, input_values)
+            backend.calculate(path)
+            return backend.get_values(path, result_cells)
+
+        return self.submit(file_path, run).result(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self.workers),
+                'max_queue': self.max_queue,
+                'pending': sum(worker.pending for worker in self.workers),
+                'rejected': self.rejected,
+                'workers': [{
+                    'pending': worker.pending,
+                    'completed': worker.completed,
+                    'uses': worker.uses,
+                    'restarts': worker.restarts,
+                    'open_workbooks': list(worker.open_books)
+                } for worker in self.workers]
+            }
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.tasks.put(None)
@@ -0,0 +1,679 @@
+"""
+进程内公式计算引擎
+
+基于formula_parser解析出的语法树，在Python进程内按依赖顺序计算参数公式，
+不再依赖xlwings和Microsoft Excel。单元格引用按"第一列名称、第二列单位、第三列数值"
+的表格结构映射到参数上。
+
+引擎使用整数化的依赖图(DependencyGraph)，输入变化时沿反向依赖只重算受影响的下游参数。
+参数按拓扑层级计算，同一层级的参数可通过LevelScheduler并行计算。
+"""
+
+import bisect
+import math
+from decimal import Decimal, ROUND_HALF_UP, ROUND_UP, ROUND_DOWN, InvalidOperation
+
+from formula_parser import parse_formula, FormulaSyntaxError, ERROR_CODES
+import numpy as np
+
+from level_scheduler import topological_levels
+from dependency_graph import DependencyGraph
+
+NAME_COL = 1
+UNIT_COL = 2
+VALUE_COL = 3
+
+
+class ErrorValue(str):
+    """Excel错误值（如#DIV/0!），作为字符串可直接序列化为JSON"""
+
+
+class FormulaError(Exception):
+    """公式计算过程中产生的Excel错误，沿表达式向上传播"""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+class RangeValue(list):
+    """范围引用求值后的单元格值列表（按行优先顺序）"""
+
+
+def normalize_value(value):
+    """将从工作簿中读到的缓存值转换为引擎内部表示"""
+    if isinstance(value, str) and value in ERROR_CODES:
+        return ErrorValue(value)
+    return value
+
+
+# ---------------------------------------------------------------------------
+# 类型转换
+# ---------------------------------------------------------------------------
+
+def to_number(value):
+    """按Excel规则将值转换为数值"""
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1 if value else 0
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, ErrorValue):
+        raise FormulaError(str(value))
+    if isinstance(value, str):
+        text = value.strip()
+        try:
+            if text.endswith('%'):
+                return float(text[:-1]) / 100
+            return float(text)
+        except ValueError:
+            raise FormulaError('#VALUE!')
+    raise FormulaError('#VALUE!')
+
+
+def to_text(value):
+    """按Excel规则将值转换为文本"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, ErrorValue):
+        raise FormulaError(str(value))
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return '%.15g' % value
+    return str(value)
+
+
+def to_bool(value):
+    """按Excel规则将值转换为逻辑值"""
+    if value is None:
+        return False
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    if isinstance(value, ErrorValue):
+        raise FormulaError(str(value))
+    if isinstance(value, str):
+        upper = value.strip().upper()
+        if upper == 'TRUE':
+            return True
+        if upper == 'FALSE':
+            return False
+    raise FormulaError('#VALUE!')
+
+
+def _check_number(value):
+    """数值溢出或非法时转换为#NUM!"""
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        raise FormulaError('#NUM!')
+    return value
+
+
+def _scalar(value):
+    """范围值在标量上下文中只允许单个单元格"""
+    if isinstance(value, RangeValue):
+        if len(value) == 1:
+            return value[0]
+        raise FormulaError('#VALUE!')
+    return value
+
+
+def _type_rank(value):
+    if isinstance(value, bool):
+        return 2
+    if isinstance(value, str):
+        return 1
+    return 0
+
+
+def compare(op, left, right):
+    """按Excel规则比较两个值：数值 < 文本 < 逻辑值，文本不区分大小写"""
+    for value in (left, right):
+        if isinstance(value, ErrorValue):
+            raise FormulaError(str(value))
+    # 空单元格视为与另一侧同类型的空值
+    if left is None:
+        left = '' if isinstance(right, str) else (False if isinstance(right, bool) else 0)
+    if right is None:
+        right = '' if isinstance(left, str) else (False if isinstance(left, bool) else 0)
+
+    left_rank, right_rank = _type_rank(left), _type_rank(right)
+    if left_rank != right_rank:
+        left, right = left_rank, right_rank
+    elif left_rank == 1:
+        left, right = left.lower(), right.lower()
+
+    if op == '=':
+        return left == right
+    if op == '<>':
+        return left != right
+    if op == '<':
+        return left < right
+    if op == '>':
+        return left > right
+    if op == '<=':
+        return left <= right
+    return left >= right
+
+
+def arithmetic(op, left, right):
+    """四则运算与乘方"""
+    left, right = to_number(left), to_number(right)
+    if op == '+':
+        return _check_number(left + right)
+    if op == '-':
+        return _check_number(left - right)
+    if op == '*':
+        return _check_number(left * right)
+    if op == '/':
+        if right == 0:
+            raise FormulaError('#DIV/0!')
+        return _check_number(left / right)
+    # 乘方
+    if left == 0 and right < 0:
+        raise FormulaError('#DIV/0!')
+    if left < 0 and not float(right).is_integer():
+        raise FormulaError('#NUM!')
+    try:
+        return _check_number(float(left) ** right)
+    except OverflowError:
+        raise FormulaError('#NUM!')
+
+
+# ---------------------------------------------------------------------------
+# 内置函数
+# ---------------------------------------------------------------------------
+
+def _iter_args(args):
+    """展开函数参数中的范围值"""
+    for arg in args:
+        if isinstance(arg, RangeValue):
+            for value in arg:
+                yield value, True
+        else:
+            yield arg, False
+
+
+def _numbers(args):
+    """聚合函数的数值参数：范围内只统计数值，直接参数按规则转换"""
+    numbers = []
+    for value, from_range in _iter_args(args):
+        if isinstance(value, ErrorValue):
+            raise FormulaError(str(value))
+        if from_range:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                numbers.append(value)
+        elif value is not None:
+            numbers.append(to_number(value))
+    return numbers
+
+
+def _logicals(args):
+    values = []
+    for value, from_range in _iter_args(args):
+        if from_range and not isinstance(value, (bool, int, float)):
+            if isinstance(value, ErrorValue):
+                raise FormulaError(str(value))
+            continue
+        values.append(to_bool(value))
+    if not values:
+        raise FormulaError('#VALUE!')
+    return values
+
+
+def _round_decimal(value, digits, rounding):
+    """按十进制舍入，避免二进制浮点导致2.675舍入为2.67"""
+    value = to_number(value)
+    digits = int(to_number(digits))
+    try:
+        quantum = Decimal(1).scaleb(-digits)
+        result = Decimal('%.15g' % value).quantize(quantum, rounding=rounding)
+    except InvalidOperation:
+        raise FormulaError('#NUM!')
+    return float(result)
+
+
+def _fsum(numbers):
+    """精确求和；中间结果溢出或出现相反符号的无穷大时为#NUM!"""
+    try:
+        return _check_number(math.fsum(numbers))
+    except (OverflowError, ValueError):
+        raise FormulaError('#NUM!')
+
+
+def _fn_sum(*args):
+    return _fsum(_numbers(args))
+
+
+def _fn_product(*args):
+    numbers = _numbers(args)
+    if not numbers:
+        return 0.0  # 与Excel一致：没有数值时PRODUCT返回0而不是1
+    result = 1.0
+    for number in numbers:
+        result *= number
+    return _check_number(result)
+
+
+def _fn_min(*args):
+    numbers = _numbers(args)
+    return min(numbers) if numbers else 0
+
+
+def _fn_max(*args):
+    numbers = _numbers(args)
+    return max(numbers) if numbers else 0
+
+
+def _fn_average(*args):
+    numbers = _numbers(args)
+    if not numbers:
+        raise FormulaError('#DIV/0!')
+    return _fsum(numbers) / len(numbers)
+
+
+def _fn_count(*args):
+    count = 0
+    for value, _ in _iter_args(args):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            count += 1
+    return count
+
+
+def _fn_round(value, digits=0):
+    return _round_decimal(value, digits, ROUND_HALF_UP)
+
+
+def _fn_roundup(value, digits=0):
+    return _round_decimal(value, digits, ROUND_UP)
+
+
+def _fn_rounddown(value, digits=0):
+    return _round_decimal(value, digits, ROUND_DOWN)
+
+
+def _fn_int(value):
+    return math.floor(to_number(value))
+
+
+def _fn_abs(value):
+    return abs(to_number(value))
+
+
+def _fn_sqrt(value):
+    number = to_number(value)
+    if number < 0:
+        raise FormulaError('#NUM!')
+    return math.sqrt(number)
+
+
+def _fn_power(base, exponent):
+    return arithmetic('^', base, exponent)
+
+
+def _fn_mod(number, divisor):
+    number, divisor = to_number(number), to_number(divisor)
+    if divisor == 0:
+        raise FormulaError('#DIV/0!')
+    return number - divisor * math.floor(number / divisor)
+
+
+def _fn_log(value, base=10):
+    number, base = to_number(value), to_number(base)
+    if number <= 0 or base <= 0 or base == 1:
+        raise FormulaError('#NUM!' if base != 1 else '#DIV/0!')
+    return math.log(number, base)
+
+
+def _fn_ln(value):
+    number = to_number(value)
+    if number <= 0:
+        raise FormulaError('#NUM!')
+    return math.log(number)
+
+
+def _fn_log10(value):
+    return _fn_log(value, 10)
+
+
+def _fn_exp(value):
+    try:
+        return math.exp(to_number(value))
+    except OverflowError:
+        raise FormulaError('#NUM!')
+
+
+def _unary_math(func):
+    def wrapper(value):
+        try:
+            return _check_number(func(to_number(value)))
+        except ValueError:
+            raise FormulaError('#NUM!')
+    return wrapper
+
+
+def _fn_and(*args):
+    return all(_logicals(args))
+
+
+def _fn_or(*args):
+    return any(_logicals(args))
+
+
+def _fn_not(value):
+    return not to_bool(value)
+
+
+def _fn_concatenate(*args):
+    return ''.join(to_text(_scalar(arg)) for arg in args)
+
+
+def _fn_concat(*args):
+    return ''.join(to_text(value) for value, _ in _iter_args(args))
+
+
+FUNCTIONS = {
+    'SUM': _fn_sum,
+    'PRODUCT': _fn_product,
+    'MIN': _fn_min,
+    'MAX': _fn_max,
+    'AVERAGE': _fn_average,
+    'COUNT': _fn_count,
+    'ROUND': _fn_round,
+    'ROUNDUP': _fn_roundup,
+    'ROUNDDOWN': _fn_rounddown,
+    'INT': _fn_int,
+    'ABS': _fn_abs,
+    'SQRT': _fn_sqrt,
+    'POWER': _fn_power,
+    'MOD': _fn_mod,
+    'LOG': _fn_log,
+    'LN': _fn_ln,
+    'LOG10': _fn_log10,
+    'EXP': _fn_exp,
+    'PI': lambda: math.pi,
+    'SIN': _unary_math(math.sin),
+    'COS': _unary_math(math.cos),
+    'TAN': _unary_math(math.tan),
+    'ASIN': _unary_math(math.asin),
+    'ACOS': _unary_math(math.acos),
+    'ATAN': _unary_math(math.atan),
+    'RADIANS': _unary_math(math.radians),
+    'DEGREES': _unary_math(math.degrees),
+    'AND': _fn_and,
+    'OR': _fn_or,
+    'NOT': _fn_not,
+    'CONCATENATE': _fn_concatenate,
+    'CONCAT': _fn_concat,
+}
+
+# 这些函数的标量参数不允许传入多单元格范围
+_RANGE_FUNCTIONS = {'SUM', 'PRODUCT', 'MIN', 'MAX', 'AVERAGE', 'COUNT', 'AND', 'OR', 'CONCAT'}
+
+
+# ---------------------------------------------------------------------------
+# 计算引擎
+# ---------------------------------------------------------------------------
+
+def compile_formulas(all_params):
+    """解析所有参数的公式，返回{参数ID: 语法树}；无法解析的公式计算结果为#NAME?"""
+    compiled = {}
+    for param_id, param_info in all_params.items():
+        formula = param_info.get('公式', '')
+        if formula:
+            try:
+                compiled[param_id] = parse_formula(formula)
+            except FormulaSyntaxError as e:
+                print(f"无法解析参数 {param_id} 的公式 {formula}: {str(e)}")
+                compiled[param_id] = ('err', '#NAME?')
+    return compiled
+
+
+class FormulaEngine:
+    """按参数表结构在进程内计算公式"""
+
+    def __init__(self, all_params, formula_dependencies, compiled=None, scheduler=None, graph=None):
+        self.all_params = all_params
+        self.dependencies = formula_dependencies
+        self.scheduler = scheduler  # LevelScheduler，为None时串行计算
+        # 按all_params编号的依赖图，可由模型共享
+        self.graph = graph if graph is not None else DependencyGraph.from_dependencies(all_params, formula_dependencies)
+
+        # 拓扑层级：同一层级的参数互不依赖；循环依赖中的参数放在最后串行计算
+        self.levels, self.tail = topological_levels(all_params, formula_dependencies, self.graph)
+        self.order = [param_id for level in self.levels for param_id in level] + self.tail
+        self.order_index = {param_id: i for i, param_id in enumerate(self.order)}
+        self.level_of = {param_id: i for i, level in enumerate(self.levels) for param_id in level}
+        self.compiled = compiled if compiled is not None else compile_formulas(all_params)  # {参数ID: 语法树}
+        self._index_cells()
+
+    def _index_cells(self):
+        """按参数所在的工作表和行建立单元格索引"""
+        self.cell_map = {}      # {(工作表, 行): 参数ID}
+        self.sheet_rows = {}    # {工作表: 有序的参数行号列表}
+        for param_id, param_info in self.all_params.items():
+            sheet = param_info.get('工作表', '')
+            row = param_info.get('行', 0)
+            self.cell_map[(sheet, row)] = param_id
+            self.sheet_rows.setdefault(sheet, []).append(row)
+
+        for rows in self.sheet_rows.values():
+            rows.sort()
+
+    def initial_values(self):
+        """以工作簿中的缓存值作为初始状态"""
+        return {param_id: normalize_value(param_info.get('值'))
+                for param_id, param_info in self.all_params.items()}
+
+    def calculate(self, overrides=None):
+        """按依赖顺序计算所有公式参数，overrides中的参数作为常量输入"""
+        values = self.initial_values()
+        overrides = overrides or {}
+        values.update(overrides)
+
+        for level in self.levels:
+            self._run_level([param_id for param_id in level
+                             if param_id in self.compiled and param_id not in overrides], values)
+        for param_id in self.tail:
+            if param_id in self.compiled and param_id not in overrides:
+                values[param_id] = self.evaluate_param(param_id, values)
+        return values
+
+    def _run_level(self, param_ids, values):
+        """计算同一拓扑层级中的参数并写入values"""
+        if not param_ids:
+            return
+        if self.scheduler is None:
+            for param_id in param_ids:
+                values[param_id] = self.evaluate_param(param_id, values)
+            return
+        values.update(self.scheduler.run_level(self, param_ids, values))
+
+    def dependency_values(self, param_ids, values):
+        """计算给定参数所需的依赖值（供进程池传输）"""
+        graph = self.graph
+        needed = graph.dependencies_of(graph.nodes(param_ids))
+        return {dep_id: values.get(dep_id) for dep_id in graph.to_ids(needed)}
+
+    def chunk_engine(self, param_ids):
+        """
+        只包含给定参数及其直接依赖的精简引擎，只能用于evaluate_param（供进程池按分块传输）
+
+        参数信息只保留求值用到的工作表、行、名称和单位，不携带依赖集合、依赖图和拓扑层级。
+        """
+        graph = self.graph
+        needed = set(param_ids)
+        needed.update(graph.to_ids(graph.dependencies_of(graph.nodes(param_ids))))
+
+        engine = FormulaEngine.__new__(FormulaEngine)
+        engine.scheduler = None
+        engine.all_params = {}
+        for param_id in needed:
+            param_info = self.all_params[param_id]
+            engine.all_params[param_id] = {'工作表': param_info.get('工作表', ''), '行': param_info.get('行', 0),
+                                           '名称': param_info.get('名称'), '单位': param_info.get('单位')}
+        engine.compiled = {param_id: self.compiled[param_id] for param_id in param_ids if param_id in self.compiled}
+        engine._index_cells()
+        return engine
+
+    def __getstate__(self):
+        # 调度器（线程池/进程池）不随引擎传到工作进程
+        state = dict(self.__dict__)
+        state['scheduler'] = None
+        return state
+
+    def downstream(self, param_ids):
+        """返回从给定参数出发沿反向依赖可达的所有参数（不含起点本身）"""
+        seeds = self.graph.nodes(param_ids)
+        reached = self.graph.reachable(seeds, reverse=True)
+        reached[seeds] = False
+        return set(self.graph.to_ids(np.flatnonzero(reached)))
+
+    def upstream(self, param_ids):
+        """返回给定参数及其沿依赖关系可达的所有上游参数"""
+        return set(param_ids) | set(self.graph.to_ids(np.flatnonzero(self.graph.reachable(self.graph.nodes(param_ids)))))
+
+    def recalculate(self, values, changes):
+        """
+        增量重算：将changes写入values，只按拓扑顺序重算值真正发生变化的输入的下游参数
+
+        Returns:
+            (changed, recalculated): 值发生变化的输入集合与被重算的参数集合
+        """
+        changed = {param_id for param_id, value in changes.items()
+                   if param_id in self.all_params and values.get(param_id) != value}
+        for param_id in changed:
+            values[param_id] = changes[param_id]
+
+        cone = self.downstream(changed)
+
+        # 按拓扑层级分组重算，层级内可并行；循环依赖中的参数最后按顺序串行重算
+        by_level = {}
+        cyclic = []
+        for param_id in cone:
+            if param_id not in self.compiled:
+                continue
+            level = self.level_of.get(param_id)
+            if level is None:
+                cyclic.append(param_id)
+            else:
+                by_level.setdefault(level, []).append(param_id)
+
+        for level in sorted(by_level):
+            self._run_level(by_level[level], values)
+        position = self.order_index
+        for param_id in sorted(cyclic, key=lambda p: position.get(p, len(position))):
+            values[param_id] = self.evaluate_param(param_id, values)
+        return changed, cone
+
+    def evaluate_param(self, param_id, values):
+        """计算单个参数的公式，错误以ErrorValue形式返回"""
+        sheet = self.all_params[param_id].get('工作表', '')
+        try:
+            result = _scalar(self._eval(self.compiled[param_id], sheet, values))
+        except FormulaError as e:
+            return ErrorValue(e.code)
+        if result is None:
+            return 0
+        return result
+
+    def _cell_value(self, sheet, row, col, values):
+        param_id = self.cell_map.get((sheet, row))
+        if param_id is None:
+            return None
+        if col == VALUE_COL:
+            return values.get(param_id)
+        if col == NAME_COL:
+            return self.all_params[param_id].get('名称')
+        if col == UNIT_COL:
+            return self.all_params[param_id].get('单位') or None
+        return None
+
+    def _range_values(self, ref, sheet, values):
+        sheet = ref.sheet or sheet
+        rows = self.sheet_rows.get(sheet, [])
+        start, end = ref.start, ref.end
+        if start.row is None:
+            # 整列引用，如C:C
+            lo, hi = 0, len(rows)
+        else:
+            lo = bisect.bisect_left(rows, min(start.row, end.row))
+            hi = bisect.bisect_right(rows, max(start.row, end.row))
+        first_col, last_col = sorted((start.col, end.col))
+
+        result = RangeValue()
+        for row in rows[lo:hi]:
+            for col in range(first_col, last_col + 1):
+                result.append(self._cell_value(sheet, row, col, values))
+        return result
+
+    def _eval(self, node, sheet, values):
+        kind = node[0]
+
+        if kind == 'num' or kind == 'str' or kind == 'bool':
+            return node[1]
+        if kind == 'ref':
+            ref = node[1]
+            value = self._cell_value(ref.sheet or sheet, ref.row, ref.col, values)
+            if isinstance(value, ErrorValue):
+                raise FormulaError(str(value))
+            return value
+        if kind == 'binop':
+            op = node[1]
+            left = _scalar(self._eval(node[2], sheet, values))
+            right = _scalar(self._eval(node[3], sheet, values))
+            if op == '&':
+                return to_text(left) + to_text(right)
+            if op in ('+', '-', '*', '/', '^'):
+                return arithmetic(op, left, right)
+            return compare(op, left, right)
+        if kind == 'func':
+            return self._call(node[1], node[2], sheet, values)
+        if kind == 'neg':
+            return -to_number(_scalar(self._eval(node[1], sheet, values)))
+        if kind == 'pos':
+            return _scalar(self._eval(node[1], sheet, values))
+        if kind == 'pct':
+            return to_number(_scalar(self._eval(node[1], sheet, values))) / 100
+        if kind == 'range':
+            return self._range_values(node[1], sheet, values)
+        if kind == 'empty':
+            return None
+        if kind == 'err':
+            raise FormulaError(node[1])
+        # 未定义的名称
+        raise FormulaError('#NAME?')
+
+    def _call(self, name, arg_nodes, sheet, values):
+        # IF和IFERROR只计算需要的分支
+        if name == 'IF':
+            if not 1 <= len(arg_nodes) <= 3:
+                raise FormulaError('#VALUE!')
+            condition = to_bool(_scalar(self._eval(arg_nodes[0], sheet, values)))
+            if condition:
+                return self._eval(arg_nodes[1], sheet, values) if len(arg_nodes) > 1 else True
+            return self._eval(arg_nodes[2], sheet, values) if len(arg_nodes) > 2 else False
+        if name == 'IFERROR':
+            if len(arg_nodes) != 2:
+                raise FormulaError('#VALUE!')
+            try:
+                return _scalar(self._eval(arg_nodes[0], sheet, values))
+            except FormulaError:
+                return self._eval(arg_nodes[1], sheet, values)
+
+        func = FUNCTIONS.get(name)
+        if func is None:
+            raise FormulaError('#NAME?')
+
+        args = [self._eval(arg, sheet, values) for arg in arg_nodes]
+        if name not in _RANGE_FUNCTIONS:
+            args = [_scalar(arg) for arg in args]
+        try:
+            return func(*args)
+        except TypeError:
+            # 参数个数不正确
+            raise FormulaError('#VALUE!')
@@ -0,0 +1,300 @@
+"""
+Excel公式词法分析与语法解析
+
+将公式文本切分为词法单元（数值、字符串、单元格引用、范围引用、函数调用、运算符等），
+并按Excel的运算符优先级解析为由元组构成的语法树。依赖关系提取、公式描述生成、
+引用修复和公式计算引擎都基于这里的结果，同一公式文本的词法和语法分析结果会被缓存。
+"""
+
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+
+class FormulaSyntaxError(ValueError):
+    """公式无法解析时抛出"""
+
+
+# 词法单元：kind为类型，text为原始文本，value为解析后的值，start/end为在公式中的位置
+Token = namedtuple('Token', ['kind', 'text', 'value', 'start', 'end'])
+
+# 单元格引用：sheet为None表示当前工作表；列范围引用中row为None
+CellRef = namedtuple('CellRef', ['sheet', 'col', 'row', 'col_abs', 'row_abs'])
+
+# 范围引用：start/end为不带工作表的CellRef
+RangeRef = namedtuple('RangeRef', ['sheet', 'start', 'end'])
+
+ERROR_CODES = ('#DIV/0!', '#N/A', '#NAME?', '#NULL!', '#NUM!', '#REF!', '#VALUE!')
+
+_SHEET = r"(?:'(?:[^']|'')+'|[^\W\d][\w.]*)!"
+_CELL = r"\$?[A-Za-z]{1,3}\$?\d+"
+_COLUMN = r"\$?[A-Za-z]{1,3}"
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<string>"(?:[^"]|"")*")
+  | (?P<error>\#DIV/0!|\#N/A|\#NAME\?|\#NULL!|\#NUM!|\#REF!|\#VALUE!)
+  | (?P<ref>(?:{sheet})?(?:{cell}(?::{cell})?|{column}:{column}))(?![\w(!])
+  | (?P<func>(?:_xlfn\.)?[A-Za-z_][\w.]*)(?=\s*\()
+  | (?P<bool>(?i:TRUE|FALSE))(?![\w(])
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[^\W\d][\w.]*)
+  | (?P<op><>|<=|>=|[-+*/^&=<>%])
+  | (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<comma>,)
+""".format(sheet=_SHEET, cell=_CELL, column=_COLUMN), re.VERBOSE)
+
+_REF_PART_RE = re.compile(r"(\$?)([A-Za-z]{1,3})(\$?)(\d*)$")
+_PLAIN_SHEET_RE = re.compile(r"[^\W\d][\w.]*$")
+
+# 缓存的公式条数（词法单元和语法树各自缓存）
+CACHE_SIZE = 65536
+
+
+def _parse_cell(text, sheet=None):
+    """解析不带工作表前缀的单元格或列引用"""
+    match = _REF_PART_RE.match(text)
+    col_abs, col_letters, row_abs, row_digits = match.groups()
+    row = int(row_digits) if row_digits else None
+    return CellRef(sheet, column_index_from_string(col_letters.upper()), row,
+                   bool(col_abs), bool(row_abs))
+
+
+def _parse_reference(text):
+    """将引用文本解析为CellRef或RangeRef"""
+    sheet = None
+    if '!' in text:
+        sheet_text, text = text.rsplit('!', 1)
+        if sheet_text.startswith("'"):
+            sheet_text = sheet_text[1:-1].replace("''", "'")
+        sheet = sheet_text
+
+    if ':' in text:
+        start_text, end_text = text.split(':', 1)
+        return 'range', RangeRef(sheet, _parse_cell(start_text), _parse_cell(end_text))
+    return 'ref', _parse_cell(text, sheet)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def tokenize(formula):
+    """将公式文本切分为词法单元元组（忽略空白），结果按公式文本缓存"""
+    tokens = []
+    pos = 1 if formula.startswith('=') else 0
+    length = len(formula)
+    while pos < length:
+        match = _TOKEN_RE.match(formula, pos)
+        if not match:
+            raise FormulaSyntaxError(f"无法识别的字符 '{formula[pos]}' (位置 {pos})")
+
+        kind = match.lastgroup
+        text = match.group(kind)
+        start, end = match.start(), match.end()
+        pos = end
+
+        if kind == 'ws':
+            continue
+        elif kind == 'string':
+            value = text[1:-1].replace('""', '"')
+        elif kind == 'number':
+            value = float(text)
+        elif kind == 'bool':
+            value = text.upper() == 'TRUE'
+        elif kind == 'func':
+            value = text.upper()
+            if value.startswith('_XLFN.'):
+                value = value[len('_XLFN.'):]
+        elif kind == 'ref':
+            kind, value = _parse_reference(text)
+        else:
+            value = text
+
+        tokens.append(Token(kind, text, value, start, end))
+
+    return tuple(tokens)
+
+
+# 二元运算符优先级（数值越大结合越紧）
+_BINARY_PRECEDENCE = {
+    '=': 1, '<>': 1, '<': 1, '>': 1, '<=': 1, '>=': 1,
+    '&': 2,
+    '+': 3, '-': 3,
+    '*': 4, '/': 4,
+    '^': 5,
+}
+
+
+class _Parser:
+    """按Excel运算符优先级进行递归下降解析"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise FormulaSyntaxError("公式意外结束")
+        self.pos += 1
+        return token
+
+    def expect(self, kind):
+        token = self.next()
+        if token.kind != kind:
+            raise FormulaSyntaxError(f"期望 {kind}，实际为 '{token.text}'")
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise FormulaSyntaxError("空公式")
+        node = self.parse_expression(1)
+        if self.peek() is not None:
+            raise FormulaSyntaxError(f"多余的内容 '{self.peek().text}'")
+        return node
+
+    def parse_expression(self, min_precedence):
+        left = self.parse_unary()
+        while True:
+            token = self.peek()
+            if token is None or token.kind != 'op' or token.value not in _BINARY_PRECEDENCE:
+                return left
+            precedence = _BINARY_PRECEDENCE[token.value]
+            if precedence < min_precedence:
+                return left
+            self.next()
+            # Excel中所有二元运算符（包括^）都是左结合
+            right = self.parse_expression(precedence + 1)
+            left = ('binop', token.value, left, right)
+
+    def parse_unary(self):
+        token = self.peek()
+        if token is not None and token.kind == 'op' and token.value in ('-', '+'):
+            self.next()
+            operand = self.parse_unary()
+            return ('neg', operand) if token.value == '-' else ('pos', operand)
+        return self.parse_postfix(self.parse_primary())
+
+    def parse_postfix(self, node):
+        token = self.peek()
+        while token is not None and token.kind == 'op' and token.value == '%':
+            self.next()
+            node = ('pct', node)
+            token = self.peek()
+        return node
+
+    def parse_primary(self):
+        token = self.next()
+        kind = token.kind
+        if kind == 'number':
+            return ('num', token.value)
+        if kind == 'string':
+            return ('str', token.value)
+        if kind == 'bool':
+            return ('bool', token.value)
+        if kind == 'error':
+            return ('err', token.value)
+        if kind == 'ref':
+            return ('ref', token.value)
+        if kind == 'range':
+            return ('range', token.value)
+        if kind == 'name':
+            return ('name', token.value)
+        if kind == 'func':
+            return self.parse_call(token.value)
+        if kind == 'lparen':
+            node = self.parse_expression(1)
+            self.expect('rparen')
+            return node
+        raise FormulaSyntaxError(f"意外的符号 '{token.text}'")
+
+    def parse_call(self, name):
+        self.expect('lparen')
+        args = []
+        token = self.peek()
+        if token is not None and token.kind == 'rparen':
+            self.next()
+            return ('func', name, tuple(args))
+
+        while True:
+            token = self.peek()
+            if token is not None and token.kind in ('comma', 'rparen'):
+                # 省略的参数，如IF(A1,,1)
+                args.append(('empty',))
+            else:
+                args.append(self.parse_expression(1))
+            token = self.next()
+            if token.kind == 'rparen':
+                return ('func', name, tuple(args))
+            if token.kind != 'comma':
+                raise FormulaSyntaxError(f"函数 {name} 的参数列表中出现意外的 '{token.text}'")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_formula(formula):
+    """将公式文本解析为语法树（元组形式），结果按公式文本缓存"""
+    return _Parser(tokenize(formula)).parse()
+
+
+def references(formula):
+    """返回公式中的所有引用，每项为('ref', CellRef)或('range', RangeRef)"""
+    return [(token.kind, token.value) for token in tokenize(formula)
+            if token.kind in ('ref', 'range')]
+
+
+def format_sheet(sheet):
+    """工作表名称，必要时加引号"""
+    if _PLAIN_SHEET_RE.match(sheet):
+        return sheet
+    return "'" + sheet.replace("'", "''") + "'"
+
+
+def format_cell(ref):
+    """将不带工作表的CellRef格式化为引用文本，保留$绝对引用标记"""
+    text = ('$' if ref.col_abs else '') + get_column_letter(ref.col)
+    if ref.row is not None:
+        text += ('$' if ref.row_abs else '') + str(ref.row)
+    return text
+
+
+def format_reference(ref):
+    """将CellRef或RangeRef格式化为引用文本"""
+    if isinstance(ref, RangeRef):
+        text = format_cell(ref.start) + ':' + format_cell(ref.end)
+    else:
+        text = format_cell(ref)
+    if ref.sheet is not None:
+        text = format_sheet(ref.sheet) + '!' + text
+    return text
+
+
+def rewrite_references(formula, replace):
+    """
+    按词法单元重写公式中的引用，其余文本保持原样
+
+    replace(kind, ref)返回新的引用文本（或CellRef/RangeRef），返回None表示保持不变。
+    由于按完整的引用词法单元替换，C1不会误匹配C10中的一部分，函数名（如LOG10）也不会被当作引用。
+    """
+    pieces = []
+    last = 0
+    for token in tokenize(formula):
+        if token.kind not in ('ref', 'range'):
+            continue
+        new_ref = replace(token.kind, token.value)
+        if new_ref is None:
+            continue
+        if not isinstance(new_ref, str):
+            new_ref = format_reference(new_ref)
+        pieces.append(formula[last:token.start])
+        pieces.append(new_ref)
+        last = token.end
+
+    if not pieces:
+        return formula
+    pieces.append(formula[last:])
+    return ''.join(pieces)
+
@@ -0,0 +1,285 @@
+"""
+单变量/多变量目标求解（单变量求解）
+
+给定一个输出参数和目标值，调整一个或多个输入参数使输出等于目标值：
+- 只有一个可变输入时，先确定使输出与目标之差变号的区间，再用Brent方法求根；
+- 有多个可变输入时，用带边界投影的Levenberg-Marquardt最小二乘迭代，梯度由前向自动微分得到。
+
+每次试算只重算"可变输入的下游 ∩ 目标参数的上游"这一部分参数，其余参数保持当前值。
+"""
+
+import math
+
+import numpy as np
+
+from sensitivity import ForwardDifferentiator
+
+MAX_ITERATIONS = 100
+BRACKET_SAMPLES = 64     # 边界处不变号时在区间内等距试算的点数
+BRACKET_EXPANSIONS = 40  # 未给出边界时从当前值向两侧倍增搜索的次数
+
+
+class GoalSeekError(ValueError):
+    """求解参数不合法"""
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+class ConeEvaluator:
+    """只重算可变输入影响到目标参数的那部分参数"""
+
+    def __init__(self, engine, values, input_ids, output_id):
+        self.engine = engine
+        self.values = dict(values)
+        self.input_ids = list(input_ids)
+        self.output_id = output_id
+        cone = engine.downstream(self.input_ids) & engine.upstream([output_id])
+        self.cone = [param_id for param_id in engine.order
+                     if param_id in cone and param_id in engine.compiled]
+        self.evaluations = 0
+
+    def __call__(self, x):
+        """输入取x时目标参数的值；结果不是数值（如错误值）时返回None"""
+        values = self.values
+        for param_id, value in zip(self.input_ids, x):
+            values[param_id] = float(value)
+        for param_id in self.cone:
+            values[param_id] = self.engine.evaluate_param(param_id, values)
+        self.evaluations += 1
+        result = values.get(self.output_id)
+        return result if _is_number(result) else None
+
+
+def _brent(f, a, b, fa, fb, tolerance):
+    """Brent方法求f在[a, b]内的根，要求fa、fb异号；返回(x, f(x), 迭代次数)"""
+    if abs(fa) < abs(fb):
+        a, b, fa, fb = b, a, fb, fa
+    c, fc = a, fa
+    d = e = b - a
+    for iteration in range(1, MAX_ITERATIONS + 1):
+        if fb == 0 or abs(fb) <= tolerance:
+            return b, fb, iteration
+        if fa * fb > 0:
+            a, fa = c, fc
+            d = e = b - a
+        if abs(fa) < abs(fb):
+            c, fc = b, fb
+            b, fb = a, fa
+            a, fa = c, fc
+
+        x_tolerance = 2 * np.finfo(float).eps * abs(b) + 0.5e-12
+        middle = 0.5 * (a - b)
+        if abs(middle) <= x_tolerance:
+            return b, fb, iteration
+
+        if abs(e) >= x_tolerance and abs(fc) > abs(fb):
+            # 割线法或逆二次插值
+            s = fb / fc
+            if a == c:
+                p = 2 * middle * s
+                q = 1 - s
+            else:
+                q, r = fc / fa, fb / fa
+                p = s * (2 * middle * q * (q - r) - (b - c) * (r - 1))
+                q = (q - 1) * (r - 1) * (s - 1)
+            if p > 0:
+                q = -q
+            p = abs(p)
+            if 2 * p < min(3 * middle * q - abs(x_tolerance * q), abs(e * q)):
+                e, d = d, p / q
+            else:
+                d = e = middle
+        else:
+            d = e = middle
+
+        c, fc = b, fb
+        b += d if abs(d) > x_tolerance else math.copysign(x_tolerance, middle)
+        fb = f(b)
+        if fb is None:
+            # 试算点出错时退回二分
+            b = c + middle
+            fb = f(b)
+            if fb is None:
+                raise GoalSeekError('求解区间内存在无法计算的点')
+    return b, fb, MAX_ITERATIONS
+
+
+def _find_bracket(residual, x0, lower, upper):
+    """寻找残差变号的区间，找不到时返回None，同时返回试算过的最优点"""
+    samples = []
+
+    def sample(x):
+        value = residual(x)
+        if value is not None:
+            samples.append((x, value))
+        return value
+
+    if lower is not None and upper is not None:
+        # 两端异号时直接作为求根区间，否则在区间内等距试算寻找变号的相邻两点
+        f_lower, f_upper = sample(lower), sample(upper)
+        if f_lower is not None and f_upper is not None and f_lower * f_upper <= 0:
+            return (lower, upper, f_lower, f_upper), samples
+        previous = None if f_lower is None else (lower, f_lower)
+        for i in range(1, BRACKET_SAMPLES + 1):
+            x = lower + (upper - lower) * i / BRACKET_SAMPLES
+            value = f_upper if i == BRACKET_SAMPLES else sample(x)
+            if value is None:
+                previous = None
+                continue
+            if previous is not None and previous[1] * value <= 0:
+                return (previous[0], x, previous[1], value), samples
+            previous = (x, value)
+        return None, samples
+
+    # 从当前值向两侧倍增搜索，越过给定的单侧边界时截断
+    step = max(abs(x0), 1.0) * 0.1
+    f0 = sample(x0)
+    for _ in range(BRACKET_EXPANSIONS):
+        for x in (x0 - step, x0 + step):
+            if lower is not None and x < lower:
+                x = lower
+            if upper is not None and x > upper:
+                x = upper
+            value = sample(x)
+            if value is not None and f0 is not None and f0 * value <= 0:
+                return ((x0, x, f0, value) if x > x0 else (x, x0, value, f0)), samples
+        step *= 2
+    return None, samples
+
+
+def solve_single(evaluate, target, x0, lower=None, upper=None, tolerance=1e-9):
+    """单个可变输入：区间搜索+Brent求根"""
+    def residual(x):
+        value = evaluate([x])
+        return None if value is None else value - target
+
+    bracket, samples = _find_bracket(residual, x0, lower, upper)
+    if bracket is None:
+        if not samples:
+            raise GoalSeekError('可变输入在给定范围内的所有取值都无法计算出数值结果')
+        x, value = min(samples, key=lambda item: abs(item[1]))
+        return x, value + target, False, 0
+
+    a, b, fa, fb = bracket
+    x, value, iterations = _brent(residual, a, b, fa, fb, tolerance)
+    return x, value + target, abs(value) <= tolerance or value == 0, iterations
+
+
+def solve_least_squares(evaluate, gradient, target, x0, lower, upper, tolerance=1e-9):
+    """
+    多个可变输入：带边界投影的Levenberg-Marquardt迭代，最小化(输出-目标)²
+
+    gradient(x)返回(输出值, 梯度数组)
+    """
+    x = np.clip(np.asarray(x0, dtype=float), lower, upper)
+    value, jacobian = gradient(x)
+    if value is None:
+        raise GoalSeekError('当前输入值下目标参数无法计算出数值结果')
+    r = value - target
+    damping = 1e-3
+    iteration = 0
+
+    for iteration in range(1, MAX_ITERATIONS + 1):
+        if abs(r) <= tolerance:
+            return x, r + target, True, iteration
+        normal = np.outer(jacobian, jacobian)
+        scale = np.diag(normal).copy()
+        scale[scale == 0] = 1.0
+        accepted = False
+        while damping < 1e12:
+            try:
+                step = np.linalg.solve(normal + damping * np.diag(scale), -jacobian * r)
+            except np.linalg.LinAlgError:
+                damping *= 4
+                continue
+            trial = np.clip(x + step, lower, upper)
+            if np.allclose(trial, x, rtol=1e-15, atol=0):
+                break
+            trial_value = evaluate(trial)
+            if trial_value is not None and abs(trial_value - target) < abs(r):
+                # 自动微分在个别点可能得不到数值结果（evaluate可以），此时拒绝这一步
+                trial_value, trial_jacobian = gradient(trial)
+                if trial_value is not None:
+                    x, jacobian = trial, trial_jacobian
+                    r = trial_value - target
+                    damping = max(damping / 3, 1e-12)
+                    accepted = True
+                    break
+            damping *= 4
+        if not accepted:
+            break
+
+    return x, r + target, abs(r) <= tolerance, iteration
+
+
+def goal_seek(engine, values, output_id, target, inputs, tolerance=1e-9):
+    """
+    调整inputs中的输入参数使output_id的值等于target
+
+    Args:
+        values: 当前全部参数值，作为求解起点（不会被修改）
+        inputs: [{'id': 参数ID, 'min': 下限或None, 'max': 上限或None}]
+        tolerance: 相对容差，|输出-目标| <= tolerance * max(1, |目标|)时视为收敛
+
+    Returns:
+        dict: converged, method, iterations, evaluations, values({输入ID: 解}), output_value, residual
+    """
+    input_ids = [item['id'] for item in inputs]
+    tolerance = tolerance * max(1.0, abs(target))
+    lower = np.array([-np.inf if item.get('min') is None else float(item['min']) for item in inputs])
+    upper = np.array([np.inf if item.get('max') is None else float(item['max']) for item in inputs])
+    if np.any(lower > upper):
+        raise GoalSeekError('输入参数的下限大于上限')
+
+    x0 = []
+    for param_id in input_ids:
+        value = values.get(param_id)
+        x0.append(float(value) if _is_number(value) else 0.0)
+
+    evaluate = ConeEvaluator(engine, values, input_ids, output_id)
+    if not evaluate.cone:
+        raise GoalSeekError('所选输入参数不影响目标参数')
+
+    if len(input_ids) == 1:
+        method = 'brent'
+        start = float(np.clip(x0[0], lower[0], upper[0]))
+        x, output_value, converged, iterations = solve_single(
+            evaluate, target, start,
+            None if np.isinf(lower[0]) else float(lower[0]),
+            None if np.isinf(upper[0]) else float(upper[0]),
+            tolerance)
+        solution = [x]
+    else:
+        method = 'levenberg-marquardt'
+        differentiator = ForwardDifferentiator(engine)
+        current = dict(values)
+
+        def gradient(x):
+            for param_id, value in zip(input_ids, x):
+                current[param_id] = float(value)
+            tangents = differentiator.run(current, input_ids, targets=[output_id])
+            evaluate.evaluations += 1
+            value = differentiator.values.get(output_id)
+            if not _is_number(value):
+                return None, None
+            tangent = tangents.get(output_id) or {}
+            jacobian = np.zeros(len(input_ids))
+            for i, derivative in tangent.items():
+                jacobian[i] = derivative if math.isfinite(derivative) else 0.0
+            return value, jacobian
+
+        x, output_value, converged, iterations = solve_least_squares(
+            evaluate, gradient, target, x0, lower, upper, tolerance)
+        solution = list(x)
+
+    return {
+        'converged': bool(converged),
+        'method': method,
+        'iterations': iterations,
+        'evaluations': evaluate.evaluations,
+        'values': {param_id: float(value) for param_id, value in zip(input_ids, solution)},
+        'output_value': output_value,
+        'residual': None if output_value is None else output_value - target
+    }
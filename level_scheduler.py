@@ -0,0 +1,127 @@
+"""
+按拓扑层级（波前）调度公式计算
+
+同一层级中的参数互不依赖，只依赖之前层级的参数，因此可以分块交给线程池或进程池计算。
+公式由纯Python代码求值，受GIL限制，线程池不能缩短纯Python公式的计算时间；进程池可以利用多核，
+但每个分块都要序列化公式和依赖值，只有层级很大且公式较重时才可能比串行快，需按工作簿实测后再启用。
+层级较小时直接在当前线程串行计算，避免调度开销。处于循环依赖中（或依赖循环）的参数无法分层，
+按原有顺序放在所有层级之后串行计算。
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from dependency_graph import DependencyGraph
+
+
+def topological_levels(all_params, formula_dependencies, graph=None):
+    """
+    将参数按依赖关系分为拓扑层级
+
+    graph为按all_params编号的DependencyGraph，为None时临时构建。
+
+    Returns:
+        (levels, remaining): levels为层级列表，每层是参数ID列表，第0层不依赖任何参数；
+        remaining为因循环依赖无法分层的参数，保持all_params中的顺序
+    """
+    if graph is None:
+        graph = DependencyGraph.from_dependencies(all_params, formula_dependencies)
+    levels, remaining = graph.topological_levels()
+    return [graph.to_ids(level) for level in levels], graph.to_ids(remaining)
+
+
+# ---------------------------------------------------------------------------
+# 进程池工作进程：每个分块带上只含该分块公式的精简引擎和所需的依赖值，工作进程不保存任何模型
+# ---------------------------------------------------------------------------
+
+def _evaluate_in_worker(engine, chunk, dependency_values):
+    values = dict(dependency_values)
+    return [(param_id, engine.evaluate_param(param_id, values)) for param_id in chunk]
+
+
+class LevelScheduler:
+    """
+    将一个层级的参数分块并行计算
+
+    Args:
+        max_workers: 工作线程/进程数，默认使用CPU核数；为1时始终串行
+        grain_size: 每个分块的参数数量，层级中待计算参数少于2个分块时串行计算
+        executor: 'thread'（默认）使用线程池，纯Python的公式求值受GIL限制，不会比串行更快；
+            'process'使用进程池，每个分块传输精简引擎（FormulaEngine.chunk_engine）和依赖值
+
+    线程池和进程池都由所有模型和请求共享，创建后不再重建；各请求的层级可同时提交。
+    进程池以spawn方式启动工作进程，不从多线程的Web服务进程fork。
+    """
+
+    def __init__(self, max_workers=None, grain_size=256, executor='thread'):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"不支持的执行方式: {executor}")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.grain_size = max(1, grain_size)
+        self.executor = executor
+        self._pool = None
+        self._lock = threading.Lock()  # 只保护线程池/进程池的创建和关闭
+        self.parallel_levels = 0
+        self.serial_levels = 0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                if self.executor == 'process':
+                    self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='formula-level')
+            return self._pool
+
+    def run_level(self, engine, param_ids, values):
+        """计算一个层级中的参数，返回[(参数ID, 值)]；不修改values"""
+        if self.max_workers <= 1 or len(param_ids) < 2 * self.grain_size:
+            self.serial_levels += 1
+            return self._evaluate_chunk(engine, param_ids, values)
+
+        self.parallel_levels += 1
+        chunks = [param_ids[i:i + self.grain_size] for i in range(0, len(param_ids), self.grain_size)]
+        pool = self._get_pool()
+
+        if self.executor == 'process':
+            futures = [pool.submit(_evaluate_in_worker, engine.chunk_engine(chunk), chunk,
+                                   engine.dependency_values(chunk, values))
+                       for chunk in chunks]
+            return self._collect(futures)
+
+        # 同一层级内的参数互不依赖，各线程只读取之前层级的值
+        futures = [pool.submit(self._evaluate_chunk, engine, chunk, values) for chunk in chunks]
+        return self._collect(futures)
+
+    @staticmethod
+    def _evaluate_chunk(engine, chunk, values):
+        return [(param_id, engine.evaluate_param(param_id, values)) for param_id in chunk]
+
+    @staticmethod
+    def _collect(futures):
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            self._shutdown_pool()
+
+    def _shutdown_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def stats(self):
+        return {
+            'executor': self.executor,
+            'max_workers': self.max_workers,
+            'grain_size': self.grain_size,
+            'parallel_levels': self.parallel_levels,
+            'serial_levels': self.serial_levels
+        }
@@ -0,0 +1,172 @@
+"""
+工作簿解析模型缓存
+
+同一个Excel文件的解析结果（参数、依赖关系、分类、循环依赖标记）在所有API请求之间共享。
+缓存以文件路径加修改时间和大小为键，按条目数和估算内存字节数进行LRU淘汰。
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+from itertools import chain
+
+import excel_analyzer
+from compressed_payload import CompressedPayload
+from dependency_graph import DependencyGraph
+from dependency_index import DependencySet
+
+
+class WorkbookModel:
+    """一个工作簿解析后的参数模型，创建后只读，可被多个请求共享"""
+
+    def __init__(self, file_path, all_params, formula_dependencies, categories=None, parsed_formulas=None,
+                 cycle_components=None):
+        self.file_path = file_path
+        self.all_params = all_params
+        self.formula_dependencies = formula_dependencies
+        # 循环依赖组（强连通分量）列表，为None时分类使用参数上的循环依赖标记
+        self.cycle_components = cycle_components
+        # {参数ID: 公式语法树}，从持久化文件加载时可直接使用，否则由计算引擎解析
+        self.parsed_formulas = parsed_formulas
+
+        self._derived = {}
+        # 派生数据的构建可能依赖其他派生数据，使用可重入锁
+        self._derived_lock = threading.RLock()
+
+        if categories is None:
+            categories = excel_analyzer.categorize_parameters(all_params, formula_dependencies, cycle_components,
+                                                              graph=self.graph)
+        (self.input_params, self.output_params,
+         self.intermediate_params, self.independent_params) = categories
+
+        self.estimated_size = estimate_size(all_params, formula_dependencies) + self.graph.nbytes
+
+    @property
+    def graph(self):
+        """按all_params编号的整数化依赖图（DependencyGraph），首次访问时构建"""
+        return self.derived('graph', lambda m: DependencyGraph.from_dependencies(m.all_params, m.formula_dependencies))
+
+    def derived(self, name, builder):
+        """获取由模型派生的数据（如计算引擎、索引），首次访问时调用builder构建并缓存"""
+        value = self._derived.get(name)
+        if value is None:
+            with self._derived_lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = builder(self)
+                    self._derived[name] = value
+        return value
+
+    def payload_sizes(self):
+        """已生成的压缩响应（如parameters_payload）各编码的字节数"""
+        return {name: value.sizes() for name, value in list(self._derived.items())
+                if isinstance(value, CompressedPayload)}
+
+
+def estimate_size(all_params, formula_dependencies):
+    """估算模型占用的内存字节数，用于缓存淘汰和内存统计；共享的对象（如依赖集合、参数ID）只计一次"""
+    objects = chain(all_params, all_params.values(), formula_dependencies.values(),
+                    chain.from_iterable(param_info.values() for param_info in all_params.values()))
+    unique = {id(obj): obj for obj in objects}
+    items = chain.from_iterable(obj.direct if type(obj) is DependencySet else obj
+                                for obj in list(unique.values()) if type(obj) in (DependencySet, set, list))
+    unique.update((id(item), item) for item in items)
+    return sys.getsizeof(all_params) + sys.getsizeof(formula_dependencies) + sum(map(sys.getsizeof, unique.values()))
+
+
+def load_model(file_path):
+    """解析Excel文件，构建参数模型"""
+    print(f"解析工作簿模型: {file_path}")
+    return model_from_scan(file_path, excel_analyzer.scan_workbook(file_path))
+
+
+def model_from_scan(file_path, scan):
+    """由工作簿扫描结果（WorkbookScan）构建参数模型"""
+    all_params, formula_dependencies, cycle_components = excel_analyzer.collect_model_from_scan(scan, {})
+    return WorkbookModel(file_path, all_params, formula_dependencies, cycle_components=cycle_components)
+
+
+class ModelCache:
+    """按文件路径、修改时间和大小缓存WorkbookModel，按条目数和估算字节数LRU淘汰"""
+
+    def __init__(self, max_entries=16, max_bytes=512 * 1024 * 1024, loader=load_model):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self._entries = OrderedDict()  # {(路径, 修改时间, 大小): WorkbookModel}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(file_path):
+        stat = os.stat(file_path)
+        return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+    def get(self, file_path):
+        """获取文件对应的模型，未命中时解析文件并加入缓存"""
+        key = self.make_key(file_path)
+        with self._lock:
+            model = self._entries.get(key)
+            if model is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return model
+            self.misses += 1
+
+        # 在锁外解析文件，避免阻塞其他文件的请求
+        return self._insert(key, self.loader(file_path))
+
+    def put(self, file_path, model):
+        """加入已构建好的模型（如上传分析时生成的模型），已有同一版本文件的模型时返回已有的模型"""
+        return self._insert(self.make_key(file_path), model)
+
+    def _insert(self, key, model):
+        with self._lock:
+            if key not in self._entries:
+                # 同一文件的旧版本不再需要
+                for stale_key in [k for k in self._entries if k[0] == key[0]]:
+                    self._remove(stale_key)
+                self._entries[key] = model
+                self.total_bytes += model.estimated_size
+                self._evict()
+            return self._entries[key]
+
+    def _remove(self, key):
+        model = self._entries.pop(key)
+        self.total_bytes -= model.estimated_size
+
+    def _evict(self):
+        # 至少保留最近加入的一个条目
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries
+                                          or self.total_bytes > self.max_bytes):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'models': [{
+                    'file': os.path.basename(key[0]),
+                    'params': len(model.all_params),
+                    'bytes': model.estimated_size,
+                    'bytes_per_param': round(model.estimated_size / max(len(model.all_params), 1)),
+                    'payloads': model.payload_sizes()
+                } for key, model in self._entries.items()],
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,192 @@
+"""
+工作簿分析结果持久化
+
+上传时将分析好的参数模型写入优化后Excel文件旁边的 .model.pkl 文件。文件中参数ID被编号为整数，
+依赖边和分类都以编号保存（范围依赖保存为工作表行索引中的区间），并附带解析好的公式语法树。之后的请求（包括工作进程重启后）
+直接加载该文件，不再重新解析xlsx。文件记录了源xlsx的大小和修改时间，源文件变化后自动失效。
+
+注意：持久化文件使用pickle格式，只加载由本应用在上传目录中生成的文件。
+"""
+
+import os
+import pickle
+
+import model_cache
+from dependency_index import RowIndex, DependencySet
+from formula_engine import compile_formulas
+from param_record import ParamRecord, EMPTY_DEPENDENCIES, EMPTY_DEPENDENCY_NAMES
+
+ARTIFACT_VERSION = 4
+ARTIFACT_SUFFIX = '.model.pkl'
+
+# 参数信息中按列保存的字段，依赖和依赖描述单独处理（依赖与formula_dependencies相同，不重复保存）
+_PARAM_FIELDS = ('名称', '标识符', '单位', '工作表', '行', '值', '公式', '公式描述', '是否继承', '有循环依赖')
+
+
+def artifact_path(file_path):
+    """Excel文件对应的持久化模型文件路径"""
+    return os.path.splitext(file_path)[0] + ARTIFACT_SUFFIX
+
+
+def _source_signature(file_path):
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _pack_dependencies(deps, encode):
+    """依赖集合 -> (直接引用列表, [(工作表, lo, hi)])"""
+    if isinstance(deps, DependencySet):
+        return ([encode(item) for item in deps.direct],
+                [(index.sheet, lo, hi) for index, lo, hi in deps.ranges])
+    return [encode(item) for item in deps], []
+
+
+def _unpack_dependencies(packed, field, decode, row_indexes):
+    direct, ranges = packed
+    return DependencySet(field, tuple(map(decode, direct)),
+                         tuple((row_indexes[sheet], lo, hi) for sheet, lo, hi in ranges))
+
+
+def _collect_row_indexes(model):
+    """模型中依赖集合引用的所有行索引 {工作表: RowIndex}"""
+    row_indexes = {}
+    dependency_sets = [param_info.get(field) for param_info in model.all_params.values()
+                       for field in ('依赖', '依赖描述')]
+    dependency_sets.extend(model.formula_dependencies.values())
+    for deps in dependency_sets:
+        if isinstance(deps, DependencySet):
+            for index, _, _ in deps.ranges:
+                row_indexes[index.sheet] = index
+    return row_indexes
+
+
+def save_model(model):
+    """将模型写入持久化文件（先写临时文件再原子替换）"""
+    all_params = model.all_params
+
+    # 参数ID编号（依赖中可能出现不在参数表中的ID，一并编号）
+    ids = list(all_params)
+    index = {param_id: i for i, param_id in enumerate(ids)}
+
+    def intern(param_id):
+        if param_id not in index:
+            index[param_id] = len(ids)
+            ids.append(param_id)
+        return index[param_id]
+
+    row_indexes = {sheet: (index.rows, [intern(param_id) for param_id in index.ids], index.names)
+                   for sheet, index in _collect_row_indexes(model).items()}
+
+    params = []
+    for param_id, param_info in all_params.items():
+        params.append((
+            tuple(param_info.get(field) for field in _PARAM_FIELDS),
+            _pack_dependencies(param_info.get('依赖描述', ()), lambda name: name)
+        ))
+
+    dependencies = [(intern(param_id), _pack_dependencies(deps, intern))
+                    for param_id, deps in model.formula_dependencies.items()]
+
+    categories = [[index[param_id] for param_id in category]
+                  for category in (model.input_params, model.output_params,
+                                   model.intermediate_params, model.independent_params)]
+
+    cycles = None
+    if model.cycle_components is not None:
+        cycles = [[intern(param_id) for param_id in component] for component in model.cycle_components]
+
+    parsed_formulas = model.parsed_formulas
+    if parsed_formulas is None:
+        parsed_formulas = compile_formulas(all_params)
+    formulas = {index[param_id]: tree for param_id, tree in parsed_formulas.items()}
+
+    payload = {
+        'version': ARTIFACT_VERSION,
+        'source': _source_signature(model.file_path),
+        'ids': ids,
+        'row_indexes': row_indexes,
+        'params': params,
+        'dependencies': dependencies,
+        'categories': categories,
+        'cycles': cycles,
+        'formulas': formulas
+    }
+
+    path = artifact_path(model.file_path)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(payload, f, protocol=5)
+    os.replace(temp_path, path)
+    return path
+
+
+def load_artifact(file_path):
+    """加载Excel文件对应的持久化模型；文件不存在、版本不符或源文件已变化时返回None"""
+    path = artifact_path(file_path)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            payload = pickle.load(f)
+    except Exception as e:
+        print(f"读取持久化模型失败: {path}: {str(e)}")
+        return None
+
+    if payload.get('version') != ARTIFACT_VERSION:
+        print(f"持久化模型版本不符，将重新分析: {path}")
+        return None
+    if payload.get('source') != _source_signature(file_path):
+        print(f"源文件已变化，持久化模型失效: {path}")
+        return None
+
+    ids = payload['ids']
+    row_indexes = {sheet: RowIndex(sheet, rows, [ids[i] for i in id_indexes], names)
+                   for sheet, (rows, id_indexes, names) in payload['row_indexes'].items()}
+
+    formula_dependencies = {ids[param_index]: _unpack_dependencies(packed, 'ids', ids.__getitem__, row_indexes)
+                            for param_index, packed in payload['dependencies']}
+
+    all_params = {}
+    for values, packed_names in payload['params']:
+        (name, param_id, unit, sheet, row, value, formula, formula_description,
+         inherited, circular) = values
+        deps = formula_dependencies.get(param_id, EMPTY_DEPENDENCIES)
+        dep_names = EMPTY_DEPENDENCY_NAMES
+        if any(packed_names):
+            dep_names = _unpack_dependencies(packed_names, 'names', lambda name: name, row_indexes)
+        all_params[param_id] = ParamRecord(name, param_id, unit, sheet, row, value, formula, formula_description,
+                                           deps, dep_names, inherited, circular)
+
+    categories = tuple({ids[i] for i in category} for category in payload['categories'])
+    parsed_formulas = {ids[i]: tree for i, tree in payload['formulas'].items()}
+
+    cycle_components = None
+    if payload['cycles'] is not None:
+        cycle_components = [[ids[i] for i in component] for component in payload['cycles']]
+
+    return model_cache.WorkbookModel(file_path, all_params, formula_dependencies,
+                                     categories=categories, parsed_formulas=parsed_formulas,
+                                     cycle_components=cycle_components)
+
+
+def load_model(file_path):
+    """优先加载持久化模型，不存在时解析xlsx并写入持久化文件"""
+    model = load_artifact(file_path)
+    if model is not None:
+        print(f"已加载持久化模型: {artifact_path(file_path)}")
+        return model
+
+    model = model_cache.load_model(file_path)
+    store_model(model)
+    return model
+
+
+def store_model(model):
+    """解析模型中的公式并写入持久化文件，失败时只打印错误（模型仍可使用）"""
+    try:
+        if model.parsed_formulas is None:
+            model.parsed_formulas = compile_formulas(model.all_params)
+        save_model(model)
+    except Exception as e:
+        print(f"写入持久化模型失败: {str(e)}")
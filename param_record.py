@@ -0,0 +1,87 @@
+"""
+参数信息的紧凑记录
+
+每个参数原先是一个有12个中文键的dict，十万个参数时仅这些dict就占用上百MB。
+ParamRecord用__slots__保存同样的字段，没有每个实例的__dict__；依赖集合与formula_dependencies
+共享同一个DependencySet，没有依赖的参数共享同一个空集合，依赖的整数编号数组由DependencyGraph保存。
+
+ParamRecord实现了只读映射接口（外加按字段赋值），现有代码中的 param_info['名称']、
+param_info.get('依赖')、dict(param_info) 照常可用；转换为JSON只在API返回时进行（见app.param_to_json）。
+"""
+
+from collections.abc import Mapping
+from operator import attrgetter
+
+from dependency_index import FrozenDependencySet
+
+# 中文字段名 -> 属性名，顺序即dict(record)的键顺序
+FIELDS = {
+    '名称': 'name',
+    '标识符': 'id',
+    '单位': 'unit',
+    '工作表': 'sheet',
+    '行': 'row',
+    '值': 'value',
+    '公式': 'formula',
+    '公式描述': 'formula_description',
+    '依赖': 'deps',
+    '依赖描述': 'dep_names',
+    '是否继承': 'inherited',
+    '有循环依赖': 'circular',
+}
+
+# 没有依赖的参数共享的空依赖集合，不可修改（add抛出TypeError），需要添加依赖时为参数分配新的DependencySet
+EMPTY_DEPENDENCIES = FrozenDependencySet('ids')
+EMPTY_DEPENDENCY_NAMES = FrozenDependencySet('names')
+
+
+class ParamRecord(Mapping):
+    """一个参数的信息，按中文字段名访问"""
+
+    __slots__ = tuple(FIELDS.values())
+
+    def __init__(self, name, id, unit='', sheet=None, row=None, value=None, formula='', formula_description='',
+                 deps=EMPTY_DEPENDENCIES, dep_names=EMPTY_DEPENDENCY_NAMES, inherited=False, circular=False):
+        self.name = name
+        self.id = id
+        self.unit = unit
+        self.sheet = sheet
+        self.row = row
+        self.value = value
+        self.formula = formula
+        self.formula_description = formula_description
+        self.deps = deps
+        self.dep_names = dep_names
+        self.inherited = inherited
+        self.circular = circular
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, FIELDS[key])
+        except (KeyError, TypeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in FIELDS:
+            raise KeyError(key)
+        setattr(self, FIELDS[key], value)
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def values(self):
+        """按FIELDS顺序返回所有字段的值（元组）"""
+        return _get_values(self)
+
+    def copy(self):
+        """浅拷贝（依赖集合仍然共享）"""
+        return ParamRecord(*_get_values(self))
+
+    def __repr__(self):
+        return f"ParamRecord({self.id!r}, 值={self.value!r})"
+
+
+_get_values = attrgetter(*ParamRecord.__slots__)
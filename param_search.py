@@ -0,0 +1,161 @@
+"""
+参数列表的服务端搜索索引
+
+每个模型只构建一次：参数按工作簿中的顺序编号，分类、工作表和循环依赖标记保存为NumPy数组，
+过滤时整列比较；参数名（小写）按字典序排序用于前缀匹配，另建单字和二元组(n=2)倒排索引用于子串匹配，
+中文参数名没有空格分词，按字符n-gram检索。查询结果按编号排序，游标为上一页最后一个参数的编号，
+翻页时只取游标之后的limit个参数，不需要重新构建或返回整个模型。
+"""
+
+from bisect import bisect_left
+
+import numpy as np
+
+# 分类代码，顺序与WorkbookModel的四个分类一致
+CATEGORIES = ('input', 'output', 'intermediate', 'independent')
+MATCH_MODES = ('substring', 'prefix')
+NGRAM = 2
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class SearchError(ValueError):
+    """查询参数不合法"""
+
+
+def _postings(lists):
+    return {key: np.array(positions, dtype=np.int32) for key, positions in lists.items()}
+
+
+class ParameterSearchIndex:
+    """
+    一个模型的参数搜索索引
+
+    Args:
+        model: WorkbookModel
+    """
+
+    def __init__(self, model):
+        all_params = model.all_params
+        self.ids = list(all_params)
+        n = len(self.ids)
+
+        position = {param_id: i for i, param_id in enumerate(self.ids)}
+        self.category = np.full(n, len(CATEGORIES), dtype=np.int8)
+        for code, members in enumerate((model.input_params, model.output_params,
+                                        model.intermediate_params, model.independent_params)):
+            self.category[[position[param_id] for param_id in members if param_id in position]] = code
+
+        self.sheets = []
+        sheet_codes = {}
+        self.sheet = np.empty(n, dtype=np.int32)
+        self.circular = np.zeros(n, dtype=bool)
+        self.names = []
+        for i, param_info in enumerate(all_params.values()):
+            sheet = param_info.get('工作表')
+            if sheet not in sheet_codes:
+                sheet_codes[sheet] = len(self.sheets)
+                self.sheets.append(sheet)
+            self.sheet[i] = sheet_codes[sheet]
+            self.circular[i] = bool(param_info.get('有循环依赖'))
+            self.names.append(str(param_info.get('名称', self.ids[i])).lower())
+        self._sheet_codes = sheet_codes
+
+        # 前缀匹配：按参数名排序的键和对应编号
+        order = sorted(range(n), key=self.names.__getitem__)
+        self.sorted_names = [self.names[i] for i in order]
+        self.sorted_positions = np.array(order, dtype=np.int32)
+
+        # 子串匹配：单字和二元组倒排索引，每个键的编号升序
+        unigrams = {}
+        ngrams = {}
+        for i, name in enumerate(self.names):
+            for char in set(name):
+                unigrams.setdefault(char, []).append(i)
+            for gram in {name[k:k + NGRAM] for k in range(len(name) - NGRAM + 1)}:
+                ngrams.setdefault(gram, []).append(i)
+        self.unigrams = _postings(unigrams)
+        self.ngrams = _postings(ngrams)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _match_prefix(self, query):
+        lo = bisect_left(self.sorted_names, query)
+        hi = bisect_left(self.sorted_names, query + '\U0010ffff')
+        return np.sort(self.sorted_positions[lo:hi])
+
+    def _match_substring(self, query):
+        if len(query) < NGRAM:
+            return self.unigrams.get(query, np.empty(0, dtype=np.int32))
+        grams = {query[k:k + NGRAM] for k in range(len(query) - NGRAM + 1)}
+        postings = sorted((self.ngrams.get(gram, np.empty(0, dtype=np.int32)) for gram in grams), key=len)
+        candidates = postings[0]
+        for other in postings[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(candidates, other, assume_unique=True)
+        if len(query) > NGRAM:
+            # 所有二元组都出现不代表整个查询串出现，逐个确认
+            names = self.names
+            candidates = np.array([i for i in candidates.tolist() if query in names[i]], dtype=np.int32)
+        return candidates
+
+    def search(self, query='', match='substring', categories=None, sheet=None, circular=None, cursor=None,
+               limit=DEFAULT_LIMIT):
+        """
+        按条件查询参数
+
+        Args:
+            query: 参数名（不区分大小写），为空时不按名称过滤
+            match: 'substring'或'prefix'
+            categories: 分类名列表，None表示不限
+            sheet: 工作表名，None表示不限
+            circular: True/False只返回有/没有循环依赖的参数，None表示不限
+            cursor: 上一页返回的next_cursor，None表示第一页
+            limit: 每页参数数
+
+        Returns:
+            (本页参数ID列表, 本页各参数的分类, next_cursor（没有下一页时为None）, 匹配的总数)
+        """
+        if match not in MATCH_MODES:
+            raise SearchError(f"不支持的匹配方式: {match}")
+        try:
+            cursor = None if cursor in (None, '') else int(cursor)
+        except ValueError:
+            raise SearchError(f"无效的游标: {cursor}") from None
+        limit = min(max(int(limit), 1), MAX_LIMIT)
+
+        mask = np.ones(len(self.ids), dtype=bool)
+        if categories:
+            unknown = [category for category in categories if category not in CATEGORIES]
+            if unknown:
+                raise SearchError(f"未知的参数分类: {', '.join(unknown)}")
+            mask &= np.isin(self.category, [CATEGORIES.index(category) for category in categories])
+        if sheet is not None:
+            code = self._sheet_codes.get(sheet)
+            if code is None:
+                mask[:] = False
+            else:
+                mask &= self.sheet == code
+        if circular is not None:
+            mask &= self.circular == circular
+
+        query = query.strip().lower() if query else ''
+        if query:
+            matched = self._match_prefix(query) if match == 'prefix' else self._match_substring(query)
+            name_mask = np.zeros(len(self.ids), dtype=bool)
+            name_mask[matched] = True
+            mask &= name_mask
+
+        positions = np.flatnonzero(mask)
+        total = len(positions)
+        if cursor is not None:
+            positions = positions[np.searchsorted(positions, cursor, side='right'):]
+        page = positions[:limit].tolist()
+        next_cursor = str(page[-1]) if len(positions) > limit else None
+
+        ids = self.ids
+        return ([ids[i] for i in page],
+                [CATEGORIES[code] if code < len(CATEGORIES) else None for code in self.category[page].tolist()],
+                next_cursor, total)
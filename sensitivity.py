@@ -0,0 +1,402 @@
+"""
+基于前向模式自动微分的敏感性分析
+
+沿公式依赖图按拓扑顺序计算一遍，每个参数除了值以外还携带一个切向量（对所有输入参数的偏导数），
+因此一次遍历即可得到全部输入对输出的雅可比矩阵，不需要对每个输入分别扰动重算。
+求值规则与FormulaEngine一致：比较、文本运算、计数、INT等分段常数的运算导数为0；
+ROUND/ROUNDUP/ROUNDDOWN通常只用于控制显示精度，按舍入前的值求导；
+IF/IFERROR只对实际取到的分支求导；在不可导点（如SQRT(0)）导数记为NaN。
+循环依赖中的参数与引擎一样按顺序计算一次，其导数只是近似值。
+"""
+
+import bisect
+import math
+
+from formula_engine import (FUNCTIONS, VALUE_COL, ErrorValue, FormulaError, RangeValue, _RANGE_FUNCTIONS,
+                            arithmetic, compare, to_bool, to_number, to_text)
+
+
+# ---------------------------------------------------------------------------
+# 切向量运算：切向量为稀疏字典{输入序号: 偏导数}，None表示恒为0
+# 大多数参数只受少数输入影响，稀疏表示使范围求和等运算的开销与实际相关的输入数成正比
+# ---------------------------------------------------------------------------
+
+def _add(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if len(left) < len(right):
+        left, right = right, left
+    result = dict(left)
+    for index, value in right.items():
+        result[index] = result.get(index, 0.0) + value
+    return result
+
+
+def _scale(tangent, factor):
+    if tangent is None or factor == 0:
+        return None
+    return {index: value * factor for index, value in tangent.items()}
+
+
+def _sum(tangents):
+    """多个切向量求和，只复制一次"""
+    result = None
+    for tangent in tangents:
+        if tangent is None:
+            continue
+        if result is None:
+            result = dict(tangent)
+            continue
+        for index, value in tangent.items():
+            result[index] = result.get(index, 0.0) + value
+    return result
+
+
+def _has_tangent(tangent):
+    if isinstance(tangent, list):
+        return any(item is not None for item in tangent)
+    return tangent is not None
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _scalar(value, tangent):
+    """范围值在标量上下文中只允许单个单元格"""
+    if isinstance(value, RangeValue):
+        if len(value) == 1:
+            return value[0], tangent[0]
+        raise FormulaError('#VALUE!')
+    return value, tangent
+
+
+def _numbers(args):
+    """聚合函数的数值参数及其切向量，计数规则与formula_engine._numbers一致"""
+    numbers = []
+    for value, tangent in args:
+        if isinstance(value, RangeValue):
+            for item, item_tangent in zip(value, tangent):
+                if isinstance(item, ErrorValue):
+                    raise FormulaError(str(item))
+                if _is_number(item):
+                    numbers.append((item, item_tangent))
+        elif isinstance(value, ErrorValue):
+            raise FormulaError(str(value))
+        elif value is not None:
+            numbers.append((to_number(value), tangent))
+    return numbers
+
+
+def _power_tangent(base, exponent, result, base_tangent, exponent_tangent):
+    """d(base^exponent)"""
+    tangent = None
+    if base_tangent is not None:
+        if base == 0 and exponent < 1:
+            tangent = _scale(base_tangent, math.nan)
+        else:
+            tangent = _scale(base_tangent, exponent * float(base) ** (exponent - 1))
+    if exponent_tangent is not None and result != 0:
+        factor = result * math.log(base) if base > 0 else math.nan
+        tangent = _add(tangent, _scale(exponent_tangent, factor))
+    return tangent
+
+
+def _unary_derivative(name, x):
+    """单参数函数在x处的导数"""
+    if name == 'ABS':
+        return 1.0 if x > 0 else (-1.0 if x < 0 else math.nan)
+    if name == 'SQRT':
+        return 0.5 / math.sqrt(x) if x > 0 else math.nan
+    if name == 'LN':
+        return 1.0 / x
+    if name == 'LOG10':
+        return 1.0 / (x * math.log(10))
+    if name == 'EXP':
+        return math.exp(x)
+    if name == 'SIN':
+        return math.cos(x)
+    if name == 'COS':
+        return -math.sin(x)
+    if name == 'TAN':
+        return 1.0 / math.cos(x) ** 2
+    if name == 'ASIN':
+        return 1.0 / math.sqrt(1 - x * x) if abs(x) < 1 else math.nan
+    if name == 'ACOS':
+        return -1.0 / math.sqrt(1 - x * x) if abs(x) < 1 else math.nan
+    if name == 'ATAN':
+        return 1.0 / (1 + x * x)
+    if name == 'RADIANS':
+        return math.pi / 180
+    if name == 'DEGREES':
+        return 180 / math.pi
+    # INT等分段常数函数
+    return 0.0
+
+
+_UNARY_FUNCTIONS = {'ABS', 'SQRT', 'LN', 'LOG10', 'EXP', 'SIN', 'COS', 'TAN', 'ASIN', 'ACOS',
+                    'ATAN', 'RADIANS', 'DEGREES', 'INT'}
+
+
+class ForwardDifferentiator:
+    """
+    前向模式自动微分：在给定的参数值处计算输入参数到其他参数的偏导数
+
+    用法：
+        diff = ForwardDifferentiator(engine)
+        tangents = diff.run(values, input_ids, targets=[输出参数ID])
+        tangents[输出参数ID][i]  # 输出对input_ids[i]的偏导数
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.values = {}
+        self.evaluated = 0
+
+    def run(self, values, input_ids, targets=None):
+        """
+        values为当前的全部参数值（不会被修改）；targets不为None时只计算这些参数上游所需的部分
+
+        Returns:
+            {参数ID: 切向量}，切向量为{input_ids中的序号: 偏导数}；不受输入影响的参数不在结果中
+        """
+        engine = self.engine
+        self.values = dict(values)
+        tangents = {param_id: {i: 1.0} for i, param_id in enumerate(input_ids)}
+
+        affected = engine.downstream(input_ids)
+        if targets is not None:
+            affected &= engine.upstream(targets)
+
+        self.evaluated = 0
+        for param_id in engine.order:
+            if param_id in affected and param_id in engine.compiled:
+                value, tangent = self._evaluate_param(param_id, tangents)
+                self.values[param_id] = value
+                if tangent is not None:
+                    tangents[param_id] = tangent
+                self.evaluated += 1
+        return tangents
+
+    def _evaluate_param(self, param_id, tangents):
+        sheet = self.engine.all_params[param_id].get('工作表', '')
+        try:
+            value, tangent = _scalar(*self._dual(self.engine.compiled[param_id], sheet, tangents))
+        except FormulaError as e:
+            return ErrorValue(e.code), None
+        if value is None:
+            return 0, None
+        if not _is_number(value):
+            tangent = None
+        return value, tangent
+
+    def _cell(self, sheet, row, col, tangents):
+        engine = self.engine
+        if col != VALUE_COL:
+            return engine._cell_value(sheet, row, col, self.values), None
+        param_id = engine.cell_map.get((sheet, row))
+        if param_id is None:
+            return None, None
+        return self.values.get(param_id), tangents.get(param_id)
+
+    def _range(self, ref, sheet, tangents):
+        engine = self.engine
+        sheet = ref.sheet or sheet
+        values = engine._range_values(ref, sheet, self.values)
+        first_col, last_col = sorted((ref.start.col, ref.end.col))
+        if first_col > VALUE_COL or last_col < VALUE_COL:
+            return values, [None] * len(values)
+
+        # 与_range_values相同的行优先顺序，只有第三列携带切向量
+        rows = engine.sheet_rows.get(sheet, [])
+        if ref.start.row is None:
+            lo, hi = 0, len(rows)
+        else:
+            lo = bisect.bisect_left(rows, min(ref.start.row, ref.end.row))
+            hi = bisect.bisect_right(rows, max(ref.start.row, ref.end.row))
+        range_tangents = []
+        for row in rows[lo:hi]:
+            param_id = engine.cell_map.get((sheet, row))
+            for col in range(first_col, last_col + 1):
+                range_tangents.append(tangents.get(param_id) if col == VALUE_COL else None)
+        return values, range_tangents
+
+    def _dual(self, node, sheet, tangents):
+        """计算语法树节点的(值, 切向量)；范围节点的切向量为与各单元格对应的列表"""
+        kind = node[0]
+
+        if kind == 'num' or kind == 'str' or kind == 'bool':
+            return node[1], None
+        if kind == 'ref':
+            ref = node[1]
+            value, tangent = self._cell(ref.sheet or sheet, ref.row, ref.col, tangents)
+            if isinstance(value, ErrorValue):
+                raise FormulaError(str(value))
+            return value, tangent
+        if kind == 'binop':
+            return self._binop(node[1], node[2], node[3], sheet, tangents)
+        if kind == 'func':
+            return self._call(node[1], node[2], sheet, tangents)
+        if kind == 'neg':
+            value, tangent = _scalar(*self._dual(node[1], sheet, tangents))
+            return -to_number(value), _scale(tangent, -1.0)
+        if kind == 'pos':
+            return _scalar(*self._dual(node[1], sheet, tangents))
+        if kind == 'pct':
+            value, tangent = _scalar(*self._dual(node[1], sheet, tangents))
+            return to_number(value) / 100, _scale(tangent, 0.01)
+        if kind == 'range':
+            return self._range(node[1], sheet, tangents)
+        if kind == 'empty':
+            return None, None
+        if kind == 'err':
+            raise FormulaError(node[1])
+        raise FormulaError('#NAME?')
+
+    def _binop(self, op, left_node, right_node, sheet, tangents):
+        left, left_tangent = _scalar(*self._dual(left_node, sheet, tangents))
+        right, right_tangent = _scalar(*self._dual(right_node, sheet, tangents))
+        if op == '&':
+            return to_text(left) + to_text(right), None
+        if op not in ('+', '-', '*', '/', '^'):
+            return compare(op, left, right), None
+
+        result = arithmetic(op, left, right)
+        if left_tangent is None and right_tangent is None:
+            return result, None
+        left, right = to_number(left), to_number(right)
+        if op == '+':
+            return result, _add(left_tangent, right_tangent)
+        if op == '-':
+            return result, _add(left_tangent, _scale(right_tangent, -1.0))
+        if op == '*':
+            return result, _add(_scale(left_tangent, right), _scale(right_tangent, left))
+        if op == '/':
+            return result, _add(_scale(left_tangent, 1.0 / right), _scale(right_tangent, -left / (right * right)))
+        return result, _power_tangent(left, right, result, left_tangent, right_tangent)
+
+    def _call(self, name, arg_nodes, sheet, tangents):
+        # IF和IFERROR只对实际取到的分支求导
+        if name == 'IF':
+            if not 1 <= len(arg_nodes) <= 3:
+                raise FormulaError('#VALUE!')
+            condition, _ = _scalar(*self._dual(arg_nodes[0], sheet, tangents))
+            if to_bool(condition):
+                return self._dual(arg_nodes[1], sheet, tangents) if len(arg_nodes) > 1 else (True, None)
+            return self._dual(arg_nodes[2], sheet, tangents) if len(arg_nodes) > 2 else (False, None)
+        if name == 'IFERROR':
+            if len(arg_nodes) != 2:
+                raise FormulaError('#VALUE!')
+            try:
+                return _scalar(*self._dual(arg_nodes[0], sheet, tangents))
+            except FormulaError:
+                return self._dual(arg_nodes[1], sheet, tangents)
+
+        func = FUNCTIONS.get(name)
+        if func is None:
+            raise FormulaError('#NAME?')
+
+        args = [self._dual(arg, sheet, tangents) for arg in arg_nodes]
+        if name not in _RANGE_FUNCTIONS:
+            args = [_scalar(value, tangent) for value, tangent in args]
+        try:
+            result = func(*[value for value, _ in args])
+        except TypeError:
+            raise FormulaError('#VALUE!')
+
+        if not any(_has_tangent(tangent) for _, tangent in args):
+            return result, None
+        return result, self._call_tangent(name, args, result)
+
+    def _call_tangent(self, name, args, result):
+        if name in ('SUM', 'AVERAGE', 'PRODUCT', 'MIN', 'MAX'):
+            numbers = _numbers(args)
+            if name == 'SUM':
+                return _sum(item_tangent for _, item_tangent in numbers)
+            if name == 'AVERAGE':
+                return _scale(_sum(item_tangent for _, item_tangent in numbers), 1.0 / len(numbers))
+            if name == 'PRODUCT':
+                # 前缀积×后缀积得到除自身以外的乘积，避免除以0
+                prefix = [1.0]
+                for number, _ in numbers:
+                    prefix.append(prefix[-1] * number)
+                terms = []
+                suffix = 1.0
+                for i in range(len(numbers) - 1, -1, -1):
+                    number, item_tangent = numbers[i]
+                    terms.append(_scale(item_tangent, prefix[i] * suffix))
+                    suffix *= number
+                return _sum(terms)
+            if not numbers:
+                return None
+            # MIN/MAX取第一个取到极值的参数的导数
+            for number, item_tangent in numbers:
+                if number == result:
+                    return item_tangent
+            return None
+
+        if name in ('ROUND', 'ROUNDUP', 'ROUNDDOWN'):
+            return args[0][1]
+        if name in _UNARY_FUNCTIONS:
+            value, tangent = args[0]
+            return _scale(tangent, _unary_derivative(name, to_number(value)))
+        if name == 'POWER':
+            (base, base_tangent), (exponent, exponent_tangent) = args
+            return _power_tangent(to_number(base), to_number(exponent), result, base_tangent, exponent_tangent)
+        if name == 'MOD':
+            (number, number_tangent), (divisor, divisor_tangent) = args
+            number, divisor = to_number(number), to_number(divisor)
+            return _add(number_tangent, _scale(divisor_tangent, -math.floor(number / divisor)))
+        if name == 'LOG':
+            (number, number_tangent) = args[0]
+            number = to_number(number)
+            base, base_tangent = args[1] if len(args) > 1 else (10, None)
+            log_base = math.log(to_number(base))
+            tangent = _scale(number_tangent, 1.0 / (number * log_base))
+            return _add(tangent, _scale(base_tangent, -math.log(number) / (to_number(base) * log_base * log_base)))
+        # 舍入、计数、逻辑和文本函数的导数为0
+        return None
+
+
+def finite_or_none(value):
+    """NaN/无穷大的导数在JSON中记为null"""
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def tornado(output_value, input_ids, input_values, gradient, relative_change=0.1):
+    """
+    gradient为输出参数的切向量；按线性近似计算每个输入变化±relative_change时输出的变化范围，按影响从大到小排序
+
+    Returns:
+        [{id, value, derivative, elasticity, low, high, swing}]，输入值为0时变化幅度为0
+    """
+    rows = []
+    numeric_output = _is_number(output_value)
+    gradient = gradient or {}
+    for i, param_id in enumerate(input_ids):
+        derivative = float(gradient.get(i, 0.0))
+        value = input_values.get(param_id)
+        row = {
+            'id': param_id,
+            'value': value,
+            'derivative': finite_or_none(derivative),
+            'elasticity': None,
+            'low': None,
+            'high': None,
+            'swing': None
+        }
+        if numeric_output and _is_number(value) and math.isfinite(derivative):
+            change = derivative * abs(value) * relative_change
+            row['low'] = output_value - abs(change)
+            row['high'] = output_value + abs(change)
+            row['swing'] = 2 * abs(change)
+            if output_value != 0:
+                row['elasticity'] = derivative * value / output_value
+        rows.append(row)
+
+    # 无法计算变化幅度的输入排在最后
+    rows.sort(key=lambda row: (row['swing'] is None, -(row['swing'] or 0)))
+    return rows
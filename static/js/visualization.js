@@ -13,6 +13,26 @@ let nodes = [];                 // 节点数据
 let links = [];                 // 连接线数据
 let displayMode = 'all';        // 显示模式：all-所有参数, dependencies-仅依赖
 let calculatedValues = {};      // 计算结果
+let inputValues = {};           // 用户输入的参数值（包括当前未显示在列表中的参数）
+let parameterIndex = {};        // 已加载的参数：{参数ID: 参数信息}
+let listCursors = {};           // 各参数列表下一页的游标，null表示已全部加载
+let listRequests = {};          // 各参数列表最近一次查询的序号，用于丢弃过期的结果
+let searchTimer = null;         // 搜索框输入防抖
+let layoutData = null;          // 服务端计算的分层布局：{ids, x, y, layer, ...}，加载失败时为null
+let visibleLinks = [];          // 当前显示的连接线（全部参数或子图）
+let graphModelSize = 0;         // 工作簿的参数总数
+let fullGraphLoaded = false;    // 是否已加载全部参数的依赖关系图
+let subgraphRequest = 0;        // 最近一次子图查询的序号，用于丢弃过期的结果
+
+const PAGE_SIZE = 50;           // 参数列表每页的参数数
+const GRAPH_MAX_NODES = 2000;   // 参数数不超过该值时才加载并绘制全部参数的依赖关系图
+const LIST_CATEGORIES = ['input', 'intermediate', 'output'];  // 侧边栏中的参数列表
+const LAYOUT_RELAX_ALPHA = 0.1;   // 有分层布局时力导向只做短暂微调的初始alpha
+const LAYOUT_RELAX_DECAY = 0.2;   // 微调时alpha的衰减率，约20次tick后停止
+const SUBGRAPH_UP = 3;            // "仅显示依赖"模式显示的上游（依赖）跳数
+const SUBGRAPH_DOWN = 1;          // "仅显示依赖"模式显示的下游（被依赖）跳数
+const SUBGRAPH_HOP_SPACING = 180; // 子图中相邻两跳的水平距离
+const SUBGRAPH_NODE_SPACING = 40; // 子图中同一跳相邻两个参数的垂直距离
 
 // 初始化
 $(document).ready(function() {
@@ -44,47 +64,136 @@ $(document).ready(function() {
     $(document).on('change', '.param-input', function() {
         calculateParameters();
     });
+    
+    // 参数搜索和过滤：输入停顿后重新查询各参数列表的第一页
+    $('#param-search-query').on('input', function() {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(reloadParameterLists, 250);
+    }).on('keydown', function(e) {
+        if (e.key === 'Enter') {
+            e.preventDefault();
+            clearTimeout(searchTimer);
+            reloadParameterLists();
+        }
+    });
+    $('#param-search-sheet, #param-search-circular').on('change', reloadParameterLists);
+    
+    // 加载下一页
+    $('.load-more').click(function() {
+        loadParameterPage($(this).data('category'), false);
+    });
 });
 
-// 加载参数数据
+// 加载参数数据：侧边栏各列表只加载第一页，参数不多时再加载全部参数绘制依赖关系图
 function loadParameters() {
     console.log('开始加载参数数据...');
+    loadParameterPage('input', true)
+        .done(function(data) {
+            console.log(`参数列表加载成功，共 ${data.model_size} 个参数`);
+            
+            // 工作表过滤选项
+            data.sheets.forEach(function(sheet) {
+                $('#param-search-sheet').append($('<option>').val(sheet).text(sheet));
+            });
+            
+            graphModelSize = data.model_size;
+            if (data.model_size <= GRAPH_MAX_NODES) {
+                loadGraphParameters();
+            } else {
+                showLargeModelNotice();
+            }
+        })
+        .fail(function(xhr, status, error) {
+            console.error('加载参数数据失败:', xhr.responseText);
+            console.error('状态码:', xhr.status);
+            console.error('错误信息:', error);
+            
+            let errorMsg = '加载参数数据失败';
+            if (xhr.responseJSON && xhr.responseJSON.error) {
+                errorMsg += ': ' + xhr.responseJSON.error;
+            }
+            
+            alert(errorMsg);
+            $('#visualization-container').html('<div class="alert alert-danger p-5 text-center">' + errorMsg + '<br>请返回重新上传文件</div>');
+        });
+    loadParameterPage('intermediate', true);
+    loadParameterPage('output', true);
+}
+
+// 加载全部参数，用于绘制依赖关系图
+function loadGraphParameters() {
     $.ajax({
         url: '/api/parameters',
         type: 'GET',
         dataType: 'json',
         success: function(data) {
-            console.log('参数数据加载成功:', data);
             allParameters = data;
             
             // 确保参数数据格式一致性
             normalizeParameterData(allParameters);
             
-            // 渲染参数列表
-            renderParameterLists(data);
-            
             // 加载依赖关系
             loadDependencies();
         },
-        error: function(xhr, status, error) {
+        error: function(xhr) {
             console.error('加载参数数据失败:', xhr.responseText);
-            console.error('状态码:', xhr.status);
-            console.error('错误信息:', error);
-            
-            let errorMsg = '加载参数数据失败';
-            if (xhr.responseJSON && xhr.responseJSON.error) {
-                errorMsg += ': ' + xhr.responseJSON.error;
-            }
-            
-            alert(errorMsg);
-            $('#visualization-container').html('<div class="alert alert-danger p-5 text-center">' + errorMsg + '<br>请返回重新上传文件</div>');
+            $('#visualization-container').html('<div class="alert alert-danger p-5 text-center">加载依赖关系图失败，请刷新页面重试</div>');
         }
     });
 }
 
+// 按当前搜索条件重新加载各参数列表的第一页
+function reloadParameterLists() {
+    LIST_CATEGORIES.forEach(category => loadParameterPage(category, true));
+}
+
+// 加载参数列表的一页；reset为true时从第一页开始并替换已有的行
+function loadParameterPage(category, reset) {
+    const requestId = (listRequests[category] || 0) + 1;
+    listRequests[category] = requestId;
+    
+    const query = {
+        category: category,
+        limit: PAGE_SIZE,
+        q: $('#param-search-query').val() || '',
+        sheet: $('#param-search-sheet').val() || '',
+        circular: $('#param-search-circular').prop('checked') ? 1 : ''
+    };
+    if (!reset && listCursors[category]) {
+        query.cursor = listCursors[category];
+    }
+    
+    return $.ajax({
+        url: '/api/parameters/search',
+        type: 'GET',
+        data: query,
+        dataType: 'json'
+    }).done(function(data) {
+        // 搜索条件已改变，丢弃过期的结果
+        if (listRequests[category] !== requestId) {
+            return;
+        }
+        
+        const table = $(`#${category}-params-table`);
+        if (reset) {
+            table.empty();
+        }
+        table.append(data.items.map(param => renderParameterRow(category, param)).join(''));
+        table.find('tr').each(function() {
+            applyCalculatedValue($(this));
+        });
+        
+        listCursors[category] = data.next_cursor;
+        $(`.load-more[data-category="${category}"]`).toggleClass('d-none', !data.next_cursor);
+        $(`#${category}-params-count`).text(`共 ${data.total} 个`);
+    }).fail(function(xhr) {
+        console.error('查询参数失败:', xhr.responseText);
+    });
+}
+
 // 生成输入参数表单
 function generateInputForm(params) {
-    // 这个函数不再需要，因为输入表单已经在renderParameterLists中创建
+    // 这个函数不再需要，因为输入表单已经在renderParameterRow中创建
     // 保留这个函数是为了向后兼容，但不执行任何操作
 }
 
@@ -93,14 +202,15 @@ function calculateParameters() {
     // 清除错误信息
     $('#calc-error').addClass('d-none');
     
-    // 收集输入参数值
-    const inputValues = {};
+    // 收集输入参数值（当前未显示在列表中的参数保留之前输入的值）
     $('.param-input').each(function() {
-        const paramId = $(this).data('param-id');
+        const paramId = $(this).attr('data-param-id');
         const value = $(this).val();
         
         if (value) {
             inputValues[paramId] = parseFloat(value);
+        } else {
+            delete inputValues[paramId];
         }
     });
     
@@ -112,8 +222,8 @@ function calculateParameters() {
         data: JSON.stringify(inputValues),
         dataType: 'json',
         success: function(response) {
-            // 保存计算结果
-            calculatedValues = response.calculated_values;
+            // 保存计算结果（服务器只返回发生变化的参数，与已有结果合并）
+            calculatedValues = Object.assign({}, calculatedValues, response.calculated_values);
             
             // 更新可视化中的值
             updateVisualizedValues();
@@ -150,65 +260,47 @@ function updateVisualizedValues() {
     }
 }
 
-// 更新参数列表
+// 更新参数列表中已显示的参数值
 function updateParameterLists() {
     // 清除所有错误信息
     $('.param-error').addClass('d-none').text('');
     
-    // 更新输入参数值
-    allParameters.input_params.forEach(function(param, index) {
-        if (calculatedValues[param.标识符]) {
-            allParameters.input_params[index].值 = calculatedValues[param.标识符].value;
-            // 更新输入参数表格中的值
-            $(`#input-params-table tr[data-param-id="${param.标识符}"] input`).val(calculatedValues[param.标识符].value);
-        }
+    $('#input-params-table tr, #intermediate-params-table tr, #output-params-table tr').each(function() {
+        applyCalculatedValue($(this));
     });
+}
+
+// 用计算结果更新参数列表中的一行
+function applyCalculatedValue(row) {
+    const paramId = row.attr('data-param-id');
+    const result = calculatedValues[paramId];
+    if (!result) {
+        return;
+    }
     
-    // 更新中间参数值
-    allParameters.intermediate_params.forEach(function(param, index) {
-        if (calculatedValues[param.标识符]) {
-            allParameters.intermediate_params[index].值 = calculatedValues[param.标识符].value;
-            
-            // 更新中间参数表格中的值
-            const valueCell = $(`#intermediate-params-table tr[data-param-id="${param.标识符}"] input`);
-            valueCell.val(formatParameterValue(calculatedValues[param.标识符].value, param.单位));
-            
-            // 检查是否有错误
-            if (calculatedValues[param.标识符].error) {
-                const errorDiv = $(`#intermediate-params-table tr[data-param-id="${param.标识符}"] .param-error`);
-                errorDiv.text(calculatedValues[param.标识符].error).removeClass('d-none');
-                // 对于有错误的单元格，添加错误样式
-                valueCell.addClass('is-invalid');
-            } else {
-                // 移除错误样式
-                valueCell.removeClass('is-invalid');
-            }
-        }
-    });
+    const param = parameterIndex[paramId];
+    if (param) {
+        param.值 = result.value;
+    }
     
-    // 更新输出参数值
-    allParameters.output_params.forEach(function(param, index) {
-        if (calculatedValues[param.标识符]) {
-            // 保存原始值，不做任何转换
-            allParameters.output_params[index].值 = calculatedValues[param.标识符].value;
-            
-            // 更新输出参数表格中的值
-            const valueCell = $(`#output-params-table tr[data-param-id="${param.标识符}"] input`);
-            // 使用格式化函数处理值，但字符串直接显示
-            valueCell.val(formatParameterValue(calculatedValues[param.标识符].value, param.单位));
-            
-            // 检查是否有错误
-            if (calculatedValues[param.标识符].error) {
-                const errorDiv = $(`#output-params-table tr[data-param-id="${param.标识符}"] .param-error`);
-                errorDiv.text(calculatedValues[param.标识符].error).removeClass('d-none');
-                // 对于有错误的单元格，添加错误样式
-                valueCell.addClass('is-invalid');
-            } else {
-                // 移除错误样式
-                valueCell.removeClass('is-invalid');
-            }
-        }
-    });
+    const valueCell = row.find('input');
+    if (row.hasClass('input-param')) {
+        valueCell.val(result.value);
+        return;
+    }
+    
+    // 使用格式化函数处理值，但字符串直接显示
+    valueCell.val(formatParameterValue(result.value, param ? param.单位 : ''));
+    
+    // 检查是否有错误
+    if (result.error) {
+        row.find('.param-error').text(result.error).removeClass('d-none');
+        // 对于有错误的单元格，添加错误样式
+        valueCell.addClass('is-invalid');
+    } else {
+        // 移除错误样式
+        valueCell.removeClass('is-invalid');
+    }
 }
 
 // 更新参数详情
@@ -225,29 +317,38 @@ function normalizeParameterData(data) {
     ['input_params', 'intermediate_params', 'output_params', 'independent_params'].forEach(category => {
         if (data[category]) {
             data[category].forEach(param => {
-                // 确保关键属性存在
-                if (!param.hasOwnProperty('标识符')) {
-                    param.标识符 = param.id || param.名称;
-                }
-                if (!param.hasOwnProperty('依赖')) {
-                    param.依赖 = param.dependencies || [];
-                }
-                if (!param.hasOwnProperty('依赖描述')) {
-                    param.依赖描述 = param.dependency_names || [];
-                }
-                if (!param.hasOwnProperty('公式描述')) {
-                    param.公式描述 = param.formula_description || param.公式 || '';
-                }
-                
-                // 确保值类型正确
-                if (typeof param.值 === 'undefined' || param.值 === null) {
-                    param.值 = 0;
-                }
+                param.category = param.category || category.replace('_params', '');
+                normalizeParameter(param);
             });
         }
     });
 }
 
+// 标准化单个参数，并记录到已加载的参数中
+function normalizeParameter(param) {
+    // 确保关键属性存在
+    if (!param.hasOwnProperty('标识符')) {
+        param.标识符 = param.id || param.名称;
+    }
+    if (!param.hasOwnProperty('依赖')) {
+        param.依赖 = param.dependencies || [];
+    }
+    if (!param.hasOwnProperty('依赖描述')) {
+        param.依赖描述 = param.dependency_names || [];
+    }
+    if (!param.hasOwnProperty('公式描述')) {
+        param.公式描述 = param.formula_description || param.公式 || '';
+    }
+    
+    // 确保值类型正确
+    if (typeof param.值 === 'undefined' || param.值 === null) {
+        param.值 = 0;
+    }
+    
+    parameterIndex[param.标识符] = param;
+    return param;
+}
+
 // 加载依赖关系
 function loadDependencies() {
     $.ajax({
@@ -257,8 +358,8 @@ function loadDependencies() {
         success: function(data) {
             dependencyData = data;
             
-            // 初始化可视化
-            initVisualization();
+            // 加载布局后初始化可视化
+            loadLayout();
         },
         error: function(xhr) {
             console.error('加载依赖关系失败:', xhr.responseText);
@@ -267,60 +368,57 @@ function loadDependencies() {
     });
 }
 
-// 渲染参数列表
-function renderParameterLists(data) {
-    // 清空现有表格
-    $('#input-params-table, #intermediate-params-table, #output-params-table').empty();
-    
-    // 渲染输入参数表格
-    data.input_params.forEach(function(param) {
-        $('#input-params-table').append(`
-            <tr data-param-id="${param.标识符}" class="input-param">
-                <td class="param-label">
-                    <a href="#" onclick="showParameterDetails('${param.标识符}'); return false;">${param.名称}</a>
-                    <small class="text-muted">${param.单位 ? '(' + param.单位 + ')' : ''}</small>
-                </td>
-                <td class="param-input-cell">
-                    <input type="number" class="form-control form-control-sm param-input" 
-                           data-param-id="${param.标识符}" value="${param.值 !== null ? param.值 : ''}" step="any">
-                </td>
-            </tr>
-        `);
+// 加载服务端计算的分层布局，失败时退回完整的力导向布局
+function loadLayout() {
+    $.ajax({
+        url: '/api/layout',
+        type: 'GET',
+        dataType: 'json',
+        success: function(data) {
+            layoutData = data;
+            console.log(`分层布局加载成功，共 ${data.layers} 层，相邻层交叉数 ${data.crossings.before} -> ${data.crossings.after}`);
+        },
+        error: function(xhr) {
+            console.error('加载图布局失败，使用力导向布局:', xhr.responseText);
+            layoutData = null;
+        },
+        complete: function() {
+            initVisualization();
+        }
     });
+}
+
+// 渲染参数列表中的一行：输入参数可编辑，中间参数和输出参数只读
+function renderParameterRow(category, param) {
+    normalizeParameter(param);
     
-    // 渲染中间参数表格
-    data.intermediate_params.forEach(function(param) {
-        $('#intermediate-params-table').append(`
-            <tr data-param-id="${param.标识符}" class="intermediate-param">
+    const label = `
                 <td class="param-label">
                     <a href="#" onclick="showParameterDetails('${param.标识符}'); return false;">${param.名称}</a>
                     <small class="text-muted">${param.单位 ? '(' + param.单位 + ')' : ''}</small>
-                </td>
+                </td>`;
+    
+    if (category === 'input') {
+        const value = inputValues.hasOwnProperty(param.标识符) ? inputValues[param.标识符] : param.值;
+        return `
+            <tr data-param-id="${param.标识符}" class="input-param">${label}
                 <td class="param-input-cell">
-                    <input type="text" class="form-control form-control-sm" 
-                           value="${formatParameterValue(param.值, param.单位)}" readonly>
-                    <div class="param-error d-none"></div>
+                    <input type="number" class="form-control form-control-sm param-input" 
+                           data-param-id="${param.标识符}" value="${value !== null ? value : ''}" step="any">
                 </td>
             </tr>
-        `);
-    });
+        `;
+    }
     
-    // 渲染输出参数表格
-    data.output_params.forEach(function(param) {
-        $('#output-params-table').append(`
-            <tr data-param-id="${param.标识符}" class="output-param">
-                <td class="param-label">
-                    <a href="#" onclick="showParameterDetails('${param.标识符}'); return false;">${param.名称}</a>
-                    <small class="text-muted">${param.单位 ? '(' + param.单位 + ')' : ''}</small>
-                </td>
+    return `
+            <tr data-param-id="${param.标识符}" class="${category}-param">${label}
                 <td class="param-input-cell">
                     <input type="text" class="form-control form-control-sm" 
                            value="${formatParameterValue(param.值, param.单位)}" readonly>
                     <div class="param-error d-none"></div>
                 </td>
             </tr>
-        `);
-    });
+        `;
 }
 
 // 格式化参数值，添加单位和控制小数位
@@ -375,9 +473,32 @@ function countDecimals(value) {
 function initVisualization() {
     // 准备可视化数据
     prepareVisualizationData();
+    fullGraphLoaded = true;
     
-    // 创建SVG容器
+    // 初始视图以原点为中心；有分层布局时缩放到能显示全部节点
+    createGraphCanvas(layoutData ? fitLayoutScale : null);
+    
+    updateVisualization();
+}
+
+// 参数较多时不绘制全部参数的依赖关系图，显示提示
+function showLargeModelNotice() {
+    if (simulation) {
+        simulation.stop();
+        simulation = null;
+    }
+    svg = null;
+    $('#visualization-container').html(`
+        <div class="alert alert-info m-3">
+            该工作簿共有 ${graphModelSize} 个参数，为保证页面响应，不绘制全部参数的依赖关系图。
+            请在左侧搜索参数，点击参数名称查看详情；切换到"仅显示依赖"可查看所选参数上下游的依赖关系。
+        </div>`);
+}
+
+// 创建SVG容器、缩放和连接线/节点图层；fitScale(width, height)返回初始缩放比例，为null时不缩放
+function createGraphCanvas(fitScale) {
     const container = d3.select('#visualization-container');
+    $('#visualization-container').empty();
     const width = container.node().getBoundingClientRect().width;
     const height = container.node().getBoundingClientRect().height;
     
@@ -394,16 +515,10 @@ function initVisualization() {
             svg.attr('transform', event.transform);
         });
     
+    const scale = fitScale ? fitScale(width, height) : 1;
     d3.select('#visualization-container svg')
-        .call(zoom);
-    
-    // 创建力导向图
-    simulation = d3.forceSimulation(nodes)
-        .force('link', d3.forceLink(links).id(d => d.id).distance(100))
-        .force('charge', d3.forceManyBody().strength(-300))
-        .force('center', d3.forceCenter(0, 0))
-        .force('collide', d3.forceCollide(30))
-        .on('tick', ticked);
+        .call(zoom)
+        .call(zoom.transform, d3.zoomIdentity.translate(width / 2, height / 2).scale(scale));
     
     // 创建连接线的容器
     svg.append('g')
@@ -413,34 +528,93 @@ function initVisualization() {
     svg.append('g')
         .attr('class', 'nodes');
     
+    // 点击背景时取消高亮
+    svg.on('click', function() {
+        clearHighlights();
+        selectedNodeId = null;
+    });
+}
+
+// 用给定的节点和连接线重建依赖关系图；anchored为true时节点已放在layoutX/layoutY处，只做短暂微调
+function renderGraph(graphNodes, graphLinks, anchored) {
+    if (simulation) {
+        simulation.stop();
+    }
+    visibleLinks = graphLinks;
+    
+    if (anchored) {
+        // 节点已按布局放置：只做短暂微调，并把节点拉向各自的布局位置
+        simulation = d3.forceSimulation(graphNodes)
+            .force('link', d3.forceLink(graphLinks).id(d => d.id).distance(100).strength(0.05))
+            .force('x', d3.forceX(d => d.layoutX || 0).strength(0.5))
+            .force('y', d3.forceY(d => d.layoutY || 0).strength(0.5))
+            .force('collide', d3.forceCollide(15))
+            .alpha(LAYOUT_RELAX_ALPHA)
+            .alphaDecay(LAYOUT_RELAX_DECAY)
+            .on('tick', ticked);
+    } else {
+        // 创建力导向图
+        simulation = d3.forceSimulation(graphNodes)
+            .force('link', d3.forceLink(graphLinks).id(d => d.id).distance(100))
+            .force('charge', d3.forceManyBody().strength(-300))
+            .force('center', d3.forceCenter(0, 0))
+            .force('collide', d3.forceCollide(30))
+            .on('tick', ticked);
+    }
+    
     // 绘制连接线
+    svg.select('.links').selectAll('*').remove();
     svg.select('.links')
         .selectAll('line')
-        .data(links)
+        .data(graphLinks)
         .enter().append('line')
         .attr('class', 'link')
         .attr('stroke-width', 1.5);
     
-    // 使用新的方法构建节点
-    rebuildAllNodes(nodes);
+    // 重建所有节点 - 这个部分解决了中文编码问题
+    rebuildAllNodes(graphNodes);
     
-    // 点击背景时取消高亮
-    svg.on('click', function() {
-        clearHighlights();
-        selectedNodeId = null;
-    });
+    // 如果有选中的节点，高亮其依赖链
+    if (selectedNodeId) {
+        highlightDependencyChain(selectedNodeId);
+    }
+}
+
+// 力导向图tick函数
+function ticked() {
+    svg.selectAll('.link')
+        .attr('x1', d => d.source.x)
+        .attr('y1', d => d.source.y)
+        .attr('x2', d => d.target.x)
+        .attr('y2', d => d.target.y);
     
-    // 力导向图tick函数
-    function ticked() {
-        svg.selectAll('.link')
-            .attr('x1', d => d.source.x)
-            .attr('y1', d => d.source.y)
-            .attr('x2', d => d.target.x)
-            .attr('y2', d => d.target.y);
-        
-        svg.selectAll('.node')
-            .attr('transform', d => `translate(${d.x}, ${d.y})`);
+    svg.selectAll('.node')
+        .attr('transform', d => `translate(${d.x}, ${d.y})`);
+}
+
+// 按分层布局的范围计算初始缩放比例（不超过1，不小于缩放下限）
+function fitLayoutScale(width, height) {
+    const margin = 100;
+    const layoutWidth = d3.max(layoutData.x, Math.abs) * 2 + margin || 1;
+    const layoutHeight = d3.max(layoutData.y, Math.abs) * 2 + margin || 1;
+    return Math.max(0.1, Math.min(1, width / layoutWidth, height / layoutHeight));
+}
+
+// 把分层布局的坐标作为节点的初始位置
+function applyLayoutPositions() {
+    if (!layoutData) {
+        return;
     }
+    const position = new Map(layoutData.ids.map((id, i) => [id, i]));
+    nodes.forEach(node => {
+        const i = position.get(node.id);
+        if (i === undefined) {
+            return;
+        }
+        node.x = node.layoutX = layoutData.x[i];
+        node.y = node.layoutY = layoutData.y[i];
+        node.layer = layoutData.layer[i];
+    });
 }
 
 // 准备可视化数据
@@ -501,56 +675,90 @@ function prepareVisualizationData() {
             value: 1
         });
     });
+    
+    applyLayoutPositions();
 }
 
 // 更新可视化
 function updateVisualization() {
-    // 根据显示模式过滤节点和连接线
-    let filteredNodes = [];
-    let filteredLinks = [];
-    
-    if (displayMode === 'all') {
-        // 显示所有参数
-        filteredNodes = nodes;
-        filteredLinks = links;
-    } else if (displayMode === 'dependencies' && selectedNodeId) {
-        // 仅显示当前选中参数的依赖链
-        const dependencyChain = new Set();
-        collectDependencyChain(selectedNodeId, dependencyChain);
-        dependencyChain.add(selectedNodeId);
-        
-        filteredNodes = nodes.filter(node => dependencyChain.has(node.id));
-        filteredLinks = links.filter(link => 
-            dependencyChain.has(link.source.id || link.source) && 
-            dependencyChain.has(link.target.id || link.target)
-        );
-    } else {
-        // 默认显示所有
-        filteredNodes = nodes;
-        filteredLinks = links;
+    if (displayMode === 'dependencies' && selectedNodeId) {
+        // 仅显示当前选中参数上下游若干跳以内的子图，由服务端按邻接索引查询
+        loadSubgraph(selectedNodeId);
+        return;
     }
     
-    // 更新力导向图
-    simulation.nodes(filteredNodes);
-    simulation.force('link').links(filteredLinks);
-    simulation.alpha(1).restart();
+    if (!fullGraphLoaded) {
+        // 参数较多时没有绘制全部参数的依赖关系图；参数不多时等待加载完成
+        if (graphModelSize > GRAPH_MAX_NODES && svg) {
+            showLargeModelNotice();
+        }
+        return;
+    }
     
-    // 更新链接线
-    const link = svg.select('.links').selectAll('.link')
-        .data(filteredLinks, d => `${d.source.id || d.source}-${d.target.id || d.target}`);
+    renderGraph(nodes, links, layoutData !== null);
+}
+
+// 加载并显示参数上游SUBGRAPH_UP跳、下游SUBGRAPH_DOWN跳以内的子图
+function loadSubgraph(centerId) {
+    const requestId = ++subgraphRequest;
+    $.ajax({
+        url: '/api/subgraph',
+        type: 'GET',
+        data: {center: centerId, up: SUBGRAPH_UP, down: SUBGRAPH_DOWN},
+        dataType: 'json',
+        success: function(data) {
+            if (requestId !== subgraphRequest || displayMode !== 'dependencies') {
+                return;
+            }
+            if (data.truncated) {
+                console.warn(`子图超过 ${data.max_nodes} 个参数，只显示了一部分`);
+            }
+            if (!svg) {
+                createGraphCanvas(null);
+            }
+            const [subgraphNodes, subgraphLinks] = prepareSubgraphData(data);
+            renderGraph(subgraphNodes, subgraphLinks, true);
+        },
+        error: function(xhr) {
+            console.error('加载子图失败:', xhr.responseText);
+        }
+    });
+}
+
+// 子图的节点按跳数分列：上游在左、下游在右，同一跳内按返回顺序排列
+function prepareSubgraphData(data) {
+    const hopCounts = {};
+    data.nodes.forEach(node => {
+        hopCounts[node.hops] = (hopCounts[node.hops] || 0) + 1;
+    });
+    const hopOffsets = {};
     
-    link.exit().remove();
+    const subgraphNodes = data.nodes.map(node => {
+        const k = hopOffsets[node.hops] || 0;
+        hopOffsets[node.hops] = k + 1;
+        const x = node.hops * SUBGRAPH_HOP_SPACING;
+        const y = (k - (hopCounts[node.hops] - 1) / 2) * SUBGRAPH_NODE_SPACING;
+        return {
+            id: node.id,
+            name: node.name,
+            type: node.category,
+            value: calculatedValues[node.id] ? calculatedValues[node.id].value : node.value,
+            unit: node.unit,
+            x: x,
+            y: y,
+            layoutX: x,
+            layoutY: y
+        };
+    });
     
-    const linkEnter = link.enter().append('line')
-        .attr('class', 'link');
-        
-    // 重建所有节点 - 这个部分解决了中文编码问题
-    rebuildAllNodes(filteredNodes);
+    // 与全图相同：从依赖指向被依赖
+    const subgraphLinks = data.edges.map(edge => ({
+        source: edge.target,
+        target: edge.source,
+        value: 1
+    }));
     
-    // 如果有选中的节点，高亮其依赖链
-    if (selectedNodeId) {
-        highlightDependencyChain(selectedNodeId);
-    }
+    return [subgraphNodes, subgraphLinks];
 }
 
 // 完全重建所有节点的函数
@@ -623,8 +831,8 @@ function collectDependencyChain(nodeId, chain, visited = new Set()) {
     // 标记当前节点为已访问
     visited.add(nodeId);
     
-    // 查找该节点的所有依赖
-    links.forEach(link => {
+    // 在当前显示的连接线中查找该节点的所有依赖
+    visibleLinks.forEach(link => {
         if ((link.target.id || link.target) === nodeId) {
             const sourceId = link.source.id || link.source;
             chain.add(sourceId);
@@ -635,8 +843,11 @@ function collectDependencyChain(nodeId, chain, visited = new Set()) {
 
 // 高亮依赖链
 function highlightDependencyChain(nodeId) {
-    clearHighlights();
     selectedNodeId = nodeId;
+    if (!svg) {
+        return;
+    }
+    clearHighlights();
     
     // 收集依赖链
     const dependencyChain = new Set();
@@ -665,6 +876,9 @@ function highlightDependencyChain(nodeId) {
 
 // 清除所有高亮
 function clearHighlights() {
+    if (!svg) {
+        return;
+    }
     svg.selectAll('.node').classed('highlighted', false);
     svg.selectAll('.link').classed('highlighted', false);
     $('.list-group-item').removeClass('active');
@@ -705,33 +919,12 @@ function renderParameterDetails(data) {
     $('#param-detail-title').text(data.name);
     
     // 确定参数类型
-    let paramType = '';
-    let typeClass = '';
-    for (let i = 0; i < allParameters.input_params.length; i++) {
-        if (allParameters.input_params[i].标识符 === data.id) {
-            paramType = '输入参数';
-            typeClass = 'input-param-badge';
-            break;
-        }
-    }
-    if (!paramType) {
-        for (let i = 0; i < allParameters.intermediate_params.length; i++) {
-            if (allParameters.intermediate_params[i].标识符 === data.id) {
-                paramType = '中间参数';
-                typeClass = 'intermediate-param-badge';
-                break;
-            }
-        }
-    }
-    if (!paramType) {
-        for (let i = 0; i < allParameters.output_params.length; i++) {
-            if (allParameters.output_params[i].标识符 === data.id) {
-                paramType = '输出参数';
-                typeClass = 'output-param-badge';
-                break;
-            }
-        }
-    }
+    const categoryBadges = {
+        input: ['输入参数', 'input-param-badge'],
+        intermediate: ['中间参数', 'intermediate-param-badge'],
+        output: ['输出参数', 'output-param-badge']
+    };
+    const [paramType, typeClass] = categoryBadges[data.category] || ['', ''];
     
     // 格式化显示值
     const formattedValue = formatParameterValue(data.value, data.unit);
@@ -817,22 +1010,9 @@ function renderParameterDetails(data) {
     if (data.has_circular_dependency) {
         hasCyclicDependency = true;
     } else {
-        // 备用方法：检查依赖链中是否有循环
-        if (data.dependency_chain) {
-            const checkForCycles = (nodes) => {
-                if (!nodes) return false;
-                for (let node of nodes) {
-                    if (node.is_cycle) {
-                        hasCyclicDependency = true;
-                        return true;
-                    }
-                    if (checkForCycles(node.children)) {
-                        return true;
-                    }
-                }
-                return false;
-            };
-            checkForCycles(data.dependency_chain);
+        // 备用方法：检查上游依赖中是否有循环依赖参数
+        if (data.dependency_graph) {
+            hasCyclicDependency = data.dependency_graph.nodes.some(node => node.has_circular_dependency);
         }
     }
     
@@ -848,6 +1028,7 @@ function renderParameterDetails(data) {
     
     if (data.dependency_names && data.dependency_names.length > 0) {
         html += '<div class="table-responsive"><table class="table table-sm"><thead><tr><th>参数名称</th><th>当前值</th></tr></thead><tbody>';
+        const graphNodes = new Map((data.dependency_graph ? data.dependency_graph.nodes : []).map(node => [node.id, node]));
         data.dependency_names.forEach((depName, index) => {
             if (index < data.dependencies.length) {
                 const depId = data.dependencies[index];
@@ -860,22 +1041,13 @@ function renderParameterDetails(data) {
                 if (calculatedValues[depId]) {
                     depValue = formatParameterValue(calculatedValues[depId].value);
                     
-                    // 查找单位和类型
-                    for (const paramList of [allParameters.input_params, allParameters.intermediate_params, allParameters.output_params]) {
-                        for (const param of paramList) {
-                            if (param.标识符 === depId) {
-                                depUnit = param.单位 || '';
-                                if (paramList === allParameters.input_params) {
-                                    depType = 'input-param-badge';
-                                } else if (paramList === allParameters.intermediate_params) {
-                                    depType = 'intermediate-param-badge';
-                                } else {
-                                    depType = 'output-param-badge';
-                                }
-                                break;
-                            }
-                        }
-                        if (depType) break;
+                    // 查找单位和类型（依赖图中的节点带有分类）
+                    const depNode = graphNodes.get(depId);
+                    const depParam = parameterIndex[depId];
+                    depUnit = depNode ? depNode.unit || '' : (depParam ? depParam.单位 || '' : '');
+                    const depCategory = depNode ? depNode.category : (depParam ? depParam.category : null);
+                    if (categoryBadges[depCategory]) {
+                        depType = categoryBadges[depCategory][1];
                     }
                 }
                 
@@ -900,6 +1072,56 @@ function renderParameterDetails(data) {
     html += `
                     </div>
                 </div>
+    `;
+    
+    // 有公式的参数可以查看输入参数的敏感性
+    if (data.formula) {
+        html += `
+                <div class="card mt-3">
+                    <div class="card-header d-flex justify-content-between align-items-center">
+                        <span>敏感性分析</span>
+                        <button class="btn btn-sm btn-outline-primary" onclick="loadSensitivity('${data.id}'); return false;">计算敏感性</button>
+                    </div>
+                    <div class="card-body" id="sensitivity-chart">
+                        <p class="text-muted mb-0">在当前输入值处计算各输入参数变化±10%时该参数的变化范围</p>
+                    </div>
+                </div>
+        `;
+        
+        // 目标求解：可变输入为该参数上游的输入参数
+        const upstreamInputs = data.dependency_graph
+            ? data.dependency_graph.nodes.filter(node => node.category === 'input')
+            : [];
+        if (upstreamInputs.length > 0) {
+            html += `
+                <div class="card mt-3">
+                    <div class="card-header">目标求解</div>
+                    <div class="card-body">
+                        <div class="form-inline mb-2">
+                            <label class="mr-2" for="goal-seek-target">目标值</label>
+                            <input type="number" step="any" class="form-control form-control-sm mr-2" id="goal-seek-target">
+                            <button class="btn btn-sm btn-primary" onclick="runGoalSeek('${data.id}'); return false;">求解</button>
+                        </div>
+                        <table class="table table-sm mb-2" id="goal-seek-inputs">
+                            <thead><tr><th>可变输入</th><th>下限</th><th>上限</th></tr></thead>
+                            <tbody>
+                                ${upstreamInputs.map((node, index) => `
+                                    <tr data-param-id="${node.id}">
+                                        <td><label class="mb-0"><input type="checkbox" class="goal-seek-free" ${index === 0 ? 'checked' : ''}> ${node.name}</label></td>
+                                        <td><input type="number" step="any" class="form-control form-control-sm goal-seek-min"></td>
+                                        <td><input type="number" step="any" class="form-control form-control-sm goal-seek-max"></td>
+                                    </tr>
+                                `).join('')}
+                            </tbody>
+                        </table>
+                        <div id="goal-seek-result"></div>
+                    </div>
+                </div>
+            `;
+        }
+    }
+    
+    html += `
             </div>
         </div>
     `;
@@ -907,6 +1129,192 @@ function renderParameterDetails(data) {
     $('#param-details').html(html);
 }
 
+// 目标求解：调整选中的输入参数使该参数等于目标值
+function runGoalSeek(paramId) {
+    const target = parseFloat($('#goal-seek-target').val());
+    if (isNaN(target)) {
+        $('#goal-seek-result').html('<div class="alert alert-warning mb-0">请输入目标值</div>');
+        return;
+    }
+    
+    const inputs = [];
+    $('#goal-seek-inputs tbody tr').each(function() {
+        if (!$(this).find('.goal-seek-free').prop('checked')) {
+            return;
+        }
+        const min = parseFloat($(this).find('.goal-seek-min').val());
+        const max = parseFloat($(this).find('.goal-seek-max').val());
+        inputs.push({
+            id: $(this).data('param-id'),
+            min: isNaN(min) ? null : min,
+            max: isNaN(max) ? null : max
+        });
+    });
+    if (inputs.length === 0) {
+        $('#goal-seek-result').html('<div class="alert alert-warning mb-0">请至少选择一个可变输入</div>');
+        return;
+    }
+    
+    $('#goal-seek-result').html('<p class="text-muted mb-0">正在求解...</p>');
+    $.ajax({
+        url: '/api/goal_seek',
+        type: 'POST',
+        contentType: 'application/json',
+        data: JSON.stringify({ output: paramId, target: target, inputs: inputs }),
+        dataType: 'json',
+        success: function(result) {
+            renderGoalSeekResult(result);
+        },
+        error: function(xhr) {
+            console.error('目标求解失败:', xhr.responseText);
+            let errorMsg = '目标求解失败';
+            if (xhr.responseJSON && xhr.responseJSON.error) {
+                errorMsg += ': ' + xhr.responseJSON.error;
+            }
+            $('#goal-seek-result').html(`<div class="alert alert-danger mb-0">${errorMsg}</div>`);
+        }
+    });
+}
+
+// 显示目标求解结果，可一键将解应用到输入参数并重新计算
+function renderGoalSeekResult(result) {
+    const alertClass = result.converged ? 'alert-success' : 'alert-warning';
+    const status = result.converged
+        ? `已求解（${result.iterations} 次迭代，${result.evaluations} 次试算）`
+        : `未找到精确解，以下为最接近目标的结果（输出值 ${formatParameterValue(result.output_value)}）`;
+    
+    let html = `<div class="alert ${alertClass} mb-2">${status}</div><table class="table table-sm mb-2"><tbody>`;
+    Object.entries(result.values).forEach(([paramId, value]) => {
+        const param = parameterIndex[paramId];
+        const name = param ? param.名称 : paramId;
+        const unit = param && param.单位 ? ` ${param.单位}` : '';
+        html += `<tr><td>${name}</td><td>${formatParameterValue(value)}${unit}</td></tr>`;
+    });
+    html += '</tbody></table>';
+    html += '<button class="btn btn-sm btn-outline-primary" id="goal-seek-apply">应用到输入参数</button>';
+    $('#goal-seek-result').html(html);
+    
+    $('#goal-seek-apply').click(function() {
+        Object.entries(result.values).forEach(([paramId, value]) => {
+            $(`.param-input[data-param-id="${paramId}"]`).val(value);
+        });
+        calculateParameters();
+    });
+}
+
+// 加载敏感性分析结果
+function loadSensitivity(paramId) {
+    $('#sensitivity-chart').html('<p class="text-muted mb-0">正在计算...</p>');
+    $.ajax({
+        url: '/api/sensitivity',
+        type: 'GET',
+        data: { output: paramId, change: 10 },
+        dataType: 'json',
+        success: function(data) {
+            renderTornadoChart(data);
+        },
+        error: function(xhr) {
+            console.error('敏感性分析失败:', xhr.responseText);
+            let errorMsg = '敏感性分析失败';
+            if (xhr.responseJSON && xhr.responseJSON.error) {
+                errorMsg += ': ' + xhr.responseJSON.error;
+            }
+            $('#sensitivity-chart').html(`<div class="alert alert-danger mb-0">${errorMsg}</div>`);
+        }
+    });
+}
+
+// 绘制龙卷风图：每个输入一条横条，表示输入变化±change时输出的变化范围，按影响从大到小排列
+function renderTornadoChart(data) {
+    const container = $('#sensitivity-chart');
+    const rows = data.inputs.filter(row => row.swing !== null && row.swing > 0).slice(0, 15);
+    
+    if (typeof data.output.value !== 'number') {
+        container.html('<p class="text-muted mb-0">该参数的当前值不是数值，无法进行敏感性分析</p>');
+        return;
+    }
+    if (rows.length === 0) {
+        container.html('<p class="text-muted mb-0">该参数不受输入参数影响</p>');
+        return;
+    }
+    container.empty();
+    
+    const baseValue = data.output.value;
+    const margin = { top: 24, right: 70, bottom: 24, left: 120 };
+    const barHeight = 22;
+    const width = Math.max(container.width(), 360) - margin.left - margin.right;
+    const height = rows.length * barHeight;
+    
+    const minValue = d3.min(rows, row => row.low);
+    const maxValue = d3.max(rows, row => row.high);
+    const x = d3.scaleLinear().domain([minValue, maxValue]).nice().range([0, width]);
+    const y = d3.scaleBand().domain(rows.map(row => row.id)).range([0, height]).padding(0.2);
+    
+    const chart = d3.select('#sensitivity-chart').append('svg')
+        .attr('width', width + margin.left + margin.right)
+        .attr('height', height + margin.top + margin.bottom)
+        .append('g')
+        .attr('transform', `translate(${margin.left},${margin.top})`);
+    
+    chart.append('g')
+        .attr('transform', `translate(0,${height})`)
+        .call(d3.axisBottom(x).ticks(5));
+    
+    // 输入减小一侧和增大一侧分别着色；导数为负时输入增大使输出减小
+    rows.forEach(row => {
+        const decreased = row.derivative >= 0 ? row.low : row.high;
+        const increased = row.derivative >= 0 ? row.high : row.low;
+        [[decreased, '#4682B4'], [increased, '#CD5C5C']].forEach(([value, color]) => {
+            chart.append('rect')
+                .attr('x', x(Math.min(value, baseValue)))
+                .attr('y', y(row.id))
+                .attr('width', Math.abs(x(value) - x(baseValue)))
+                .attr('height', y.bandwidth())
+                .attr('fill', color)
+                .append('title')
+                .text(`${row.name}: ${formatParameterValue(value, data.output.unit)}`);
+        });
+        
+        chart.append('text')
+            .attr('x', -6)
+            .attr('y', y(row.id) + y.bandwidth() / 2)
+            .attr('dy', '0.35em')
+            .attr('text-anchor', 'end')
+            .style('font-size', '12px')
+            .text(row.name)
+            .append('title')
+            .text(`偏导数: ${row.derivative}`);
+        
+        chart.append('text')
+            .attr('x', width + 6)
+            .attr('y', y(row.id) + y.bandwidth() / 2)
+            .attr('dy', '0.35em')
+            .style('font-size', '11px')
+            .text(row.elasticity !== null ? `弹性 ${row.elasticity.toFixed(2)}` : '');
+    });
+    
+    // 当前值基准线
+    chart.append('line')
+        .attr('x1', x(baseValue))
+        .attr('x2', x(baseValue))
+        .attr('y1', -6)
+        .attr('y2', height)
+        .attr('stroke', '#333')
+        .attr('stroke-dasharray', '3,3');
+    
+    chart.append('text')
+        .attr('x', x(baseValue))
+        .attr('y', -10)
+        .attr('text-anchor', 'middle')
+        .style('font-size', '11px')
+        .text(`当前值 ${formatParameterValue(baseValue, data.output.unit)}`);
+    
+    if (data.inputs.length > rows.length) {
+        container.append(`<p class="text-muted small mb-0">仅显示影响最大的 ${rows.length} 个输入参数（共 ${data.inputs.length} 个）</p>`);
+    }
+    container.append('<p class="text-muted small mb-0"><span style="color:#4682B4">■</span> 输入减小10%　<span style="color:#CD5C5C">■</span> 输入增大10%</p>');
+}
+
 // 转义正则表达式中的特殊字符
 function escapeRegExp(string) {
     return string.replace(/[.*+?^${}()|[\]\\]/g, '\\$&'); // $& 表示匹配到的子字符串
@@ -914,27 +1322,12 @@ function escapeRegExp(string) {
 
 // 根据参数名获取参数ID
 function getDependencyId(name, dependencies) {
-    for (let i = 0; i < allParameters.input_params.length; i++) {
-        if (allParameters.input_params[i].名称 === name) {
-            return allParameters.input_params[i].标识符;
-        }
-    }
-    
-    for (let i = 0; i < allParameters.intermediate_params.length; i++) {
-        if (allParameters.intermediate_params[i].名称 === name) {
-            return allParameters.intermediate_params[i].标识符;
+    for (const paramId in parameterIndex) {
+        if (parameterIndex[paramId].名称 === name) {
+            return paramId;
         }
     }
-    
-    for (let i = 0; i < allParameters.output_params.length; i++) {
-        if (allParameters.output_params[i].名称 === name) {
-            return allParameters.output_params[i].标识符;
-        }
-    }
-    
-    // 如果在各个参数组中都找不到，直接返回依赖数组中相应的ID
-    const index = allParameters.dependency_names.indexOf(name);
-    return index !== -1 ? dependencies[index] : null;
+    return null;
 }
 
 // 在前端接收和显示值时添加特殊处理
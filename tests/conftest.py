@@ -0,0 +1,42 @@
+import uuid
+
+import openpyxl
+import pytest
+
+import app as app_module
+
+# 名称、单位、数值三列的参数表：输入为长度、宽度、高度、密度，输出为周长和质量
+ROWS = [
+    ['名称', '单位', '数值'],
+    ['长度', 'm', 10],
+    ['宽度', 'm', 4],
+    ['面积', 'm2', '=C2*C3'],
+    ['高度', 'm', 2.5],
+    ['体积', 'm3', '=C4*C5'],
+    ['周长', 'm', '=2*(C2+C3)'],
+    ['密度', 'kg/m3', 7850],
+    ['质量', 'kg', '=C8*C6'],
+]
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'Sheet1'
+    for row in ROWS:
+        ws.append(row)
+    path = str(tmp_path / 'params.xlsx')
+    wb.save(path)
+    return path
+
+
+@pytest.fixture
+def client(workbook_path):
+    """已分析workbook_path的会话"""
+    with app_module.app.test_client() as client:
+        with client.session_transaction() as session:
+            session['session_id'] = str(uuid.uuid4())
+            session['file_path'] = workbook_path
+        yield client
+    app_module.model_cache.clear()
@@ -0,0 +1,41 @@
+from batch_engine import BatchEvaluator, column_value
+from formula_engine import FormulaEngine
+
+
+def make_engine(formula):
+    """三个输入参数（第2-4行）和一个公式参数（第5行）"""
+    all_params = {
+        name: {'名称': name, '单位': '', '工作表': 'S', '行': row, '值': 0, '公式': ''}
+        for row, name in ((2, 'a'), (3, 'b'), (4, 'c'))
+    }
+    all_params['结果'] = {'名称': '结果', '单位': '', '工作表': 'S', '行': 5, '值': None, '公式': formula}
+    return FormulaEngine(all_params, {'结果': ['a', 'b', 'c']})
+
+
+def run_both(formula, rows):
+    engine = make_engine(formula)
+    evaluator = BatchEvaluator(engine)
+    columns = evaluator.run(['a', 'b', 'c'], rows)
+    # 出错的方案在数值列中为NaN，错误值记录在evaluator.errors中
+    errors = evaluator.errors.get('结果', {})
+    batch = [errors[i] if i in errors else column_value(columns['结果'], i) for i in range(len(rows))]
+    single = [engine.calculate(dict(zip('abc', row)))['结果'] for row in rows]
+    return batch, single
+
+
+def test_sum_matches_single_scenario_exactly():
+    # 成对或逐行累加会丢失中间的1，fsum不会
+    rows = [[1e16, 1.0, -1e16], [0.1, 0.2, 0.3], [1e308, 1e308, -1e308]]
+    batch, single = run_both('=SUM(C2:C4)', rows)
+    assert batch == single == [1.0, 0.6, '#NUM!']
+
+
+def test_average_matches_single_scenario_exactly():
+    rows = [[1e16, 1.0, -1e16], [0.1, 0.2, 0.3]]
+    batch, single = run_both('=AVERAGE(C2:C4)', rows)
+    assert batch == single
+
+
+def test_product_without_numbers_is_zero():
+    batch, single = run_both('=PRODUCT(B2:B4)', [[1, 2, 3], [4, 5, 6]])
+    assert batch == single == [0, 0]
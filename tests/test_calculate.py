@@ -0,0 +1,35 @@
+def calculate(client, inputs):
+    response = client.post('/api/calculate', json=inputs)
+    assert response.status_code == 200
+    return {param_id: item['value'] for param_id, item in response.get_json()['calculated_values'].items()}
+
+
+def test_first_call_returns_every_value(client):
+    values = calculate(client, {})
+    assert set(values) == {'长度', '宽度', '面积', '高度', '体积', '周长', '密度', '质量'}
+    assert values['体积'] == 100
+    assert values['质量'] == 785000
+
+
+def test_later_calls_return_changed_input_and_its_cone(client):
+    calculate(client, {})
+    values = calculate(client, {'高度': 5})
+    assert values == {'高度': 5, '体积': 200, '质量': 1570000}
+
+
+def test_unchanged_input_returns_nothing(client):
+    calculate(client, {'高度': 5})
+    assert calculate(client, {'高度': 5}) == {}
+
+
+def test_cleared_input_reverts_to_workbook_value(client):
+    calculate(client, {})
+    assert calculate(client, {'长度': 3}) == {'长度': 3, '面积': 12, '体积': 30, '周长': 14, '质量': 235500}
+    # 清空输入框时前端不再传入该参数
+    assert calculate(client, {}) == {'长度': 10, '面积': 40, '体积': 100, '周长': 28, '质量': 785000}
+
+
+def test_explicit_null_reverts_to_workbook_value(client):
+    calculate(client, {'长度': 3, '宽度': 5})
+    values = calculate(client, {'长度': None, '宽度': 5})
+    assert values['长度'] == 10 and values['周长'] == 30 and '宽度' not in values
@@ -0,0 +1,43 @@
+import gzip
+import json
+
+from compressed_payload import CompressedPayload
+
+
+def test_payload_encodings_have_distinct_strong_etags():
+    payload = CompressedPayload(b'{"a":1}\n')
+    assert payload.etag('identity') != payload.etag('gzip')
+    assert payload.etag('gzip').endswith('-gzip')
+    assert gzip.decompress(payload.bodies['gzip']) == payload.body('identity') == b'{"a":1}\n'
+    assert payload.sizes()['identity'] == 8
+
+
+def test_parameters_gzip_response(client):
+    response = client.get('/api/parameters', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    etag, weak = response.get_etag()
+    assert not weak and etag.endswith('-gzip')
+    params = json.loads(gzip.decompress(response.get_data()))
+    assert {param['名称'] for param in params['input_params']} == {'长度', '宽度', '高度', '密度'}
+
+
+def test_identity_response_has_its_own_etag(client):
+    gzip_etag = client.get('/api/parameters', headers={'Accept-Encoding': 'gzip'}).get_etag()[0]
+    response = client.get('/api/parameters', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_etag()[0] != gzip_etag
+    assert json.loads(response.get_data())['output_params']
+
+
+def test_if_none_match_returns_304(client):
+    first = client.get('/api/parameters', headers={'Accept-Encoding': 'gzip'})
+    etag = first.headers['ETag']
+    again = client.get('/api/parameters', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.get_data() == b''
+    assert again.headers['ETag'] == etag
+    # 不同编码的ETag不匹配，返回完整响应
+    other = client.get('/api/parameters', headers={'Accept-Encoding': 'identity', 'If-None-Match': etag})
+    assert other.status_code == 200
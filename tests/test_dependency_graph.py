@@ -0,0 +1,96 @@
+import numpy as np
+
+from dependency_graph import DependencyGraph
+from dependency_index import RowIndex, DependencySet
+
+
+def graph_of(dependencies, ids=None):
+    """dependencies: {参数ID: [依赖的参数ID]}"""
+    ids = ids or sorted(set(dependencies) | {dep for deps in dependencies.values() for dep in deps})
+    return DependencyGraph.from_dependencies(ids, dependencies)
+
+
+def components(graph):
+    return sorted(sorted(graph.to_ids(component)) for component in graph.cycle_components())
+
+
+def test_acyclic_graph_has_no_cycles():
+    graph = graph_of({'b': ['a'], 'c': ['a', 'b']})
+    assert components(graph) == []
+
+
+def test_cycle_components():
+    # a -> b -> c -> a 构成循环，d依赖循环但不在循环中，e、f构成另一个循环
+    graph = graph_of({'a': ['b'], 'b': ['c'], 'c': ['a'], 'd': ['c'], 'e': ['f'], 'f': ['e', 'x']})
+    assert components(graph) == [['a', 'b', 'c'], ['e', 'f']]
+
+
+def test_self_loop_is_a_cycle():
+    graph = graph_of({'a': ['a'], 'b': ['a']})
+    assert components(graph) == [['a']]
+
+
+def test_range_segment_expands_to_rows_in_nodes():
+    # 工作表S的第2-6行是参数r2..r6，total依赖C3:C5（索引位置1-3）和直接引用r6
+    index = RowIndex('S', [2, 3, 4, 5, 6], ['r2', 'r3', 'r4', 'r5', 'r6'], ['r2', 'r3', 'r4', 'r5', 'r6'])
+    deps = DependencySet('ids')
+    deps.add('r6')
+    deps.add_range(index, 1, 4)
+    deps.compact()
+    ids = ['r2', 'r3', 'r5', 'r6', 'total']  # r4不在nodes中，被忽略
+    graph = DependencyGraph.from_dependencies(ids, {'total': deps})
+    assert sorted(graph.to_ids(graph.dependencies(graph.index['total']))) == ['r3', 'r5', 'r6']
+    assert graph.edge_count == 3
+    assert graph.to_ids(graph.dependents(graph.index['r3'])) == ['total']
+
+
+def test_topological_levels():
+    graph = graph_of({'b': ['a'], 'c': ['a', 'b'], 'd': ['d'], 'e': ['d', 'a']})
+    levels, remaining = graph.topological_levels()
+    assert [graph.to_ids(level) for level in levels] == [['a'], ['b'], ['c']]
+    assert graph.to_ids(remaining) == ['d', 'e']
+    order = graph.to_ids(graph.topological_order())
+    assert order.index('a') < order.index('b') < order.index('c') and order[-2:] == ['d', 'e']
+
+
+def test_reachable():
+    graph = graph_of({'b': ['a'], 'c': ['b'], 'd': ['a']})
+    upstream = graph.reachable(graph.nodes(['c']))
+    assert graph.to_ids(np.flatnonzero(upstream)) == ['a', 'b', 'c']
+    downstream = graph.reachable(graph.nodes(['b']), reverse=True)
+    assert graph.to_ids(np.flatnonzero(downstream)) == ['b', 'c']
+
+
+def test_dependencies_of_nodes():
+    graph = graph_of({'c': ['a', 'b'], 'd': ['b']})
+    assert graph.to_ids(graph.dependencies_of(graph.nodes(['c', 'd']))) == ['a', 'b']
+    assert len(graph.dependencies_of(graph.nodes(['a']))) == 0
+
+
+def neighborhood(graph, center, **kwargs):
+    nodes, hops, truncated = graph.neighborhood(graph.index[center], **kwargs)
+    return dict(zip(graph.to_ids(nodes), hops.tolist())), truncated
+
+
+def test_neighborhood_hop_limits():
+    # e -> d -> c -> b -> a（箭头指向依赖）
+    graph = graph_of({'b': ['a'], 'c': ['b'], 'd': ['c'], 'e': ['d']})
+    assert neighborhood(graph, 'c', up=1, down=0) == ({'c': 0, 'b': -1}, False)
+    assert neighborhood(graph, 'c', up=2, down=1) == ({'c': 0, 'b': -1, 'a': -2, 'd': 1}, False)
+    assert neighborhood(graph, 'c', up=0, down=5) == ({'c': 0, 'd': 1, 'e': 2}, False)
+
+
+def test_neighborhood_truncates_at_max_nodes():
+    graph = graph_of({'total': ['a', 'b', 'c', 'd'], 'report': ['total']})
+    nodes, truncated = neighborhood(graph, 'total', up=1, down=1, max_nodes=3)
+    assert truncated and nodes == {'total': 0, 'a': -1, 'b': -1}
+    nodes, truncated = neighborhood(graph, 'total', up=1, down=1, max_nodes=6)
+    assert not truncated and len(nodes) == 6
+
+
+def test_induced_edges_with_dense_node():
+    # total的依赖数多于nodes，走二分查找分支
+    graph = graph_of({'total': ['a', 'b', 'c', 'd', 'e'], 'b': ['a']})
+    sources, targets = graph.induced_edges(graph.nodes(['b', 'total', 'a']))
+    edges = list(zip(graph.to_ids(sources), graph.to_ids(targets)))
+    assert edges == [('b', 'a'), ('total', 'a'), ('total', 'b')]
@@ -0,0 +1,48 @@
+from excel_analyzer import RowShifts, _rewrite_formula_value, make_reference_remapper
+
+
+def make_remapper():
+    """S!2 被 S!5 替换：第2行被删除，其后的行上移一行"""
+    param_id_to_location = {'A': ('S', 2), 'B': ('S', 5)}
+    row_shifts = RowShifts({'S': {2}})
+    return make_reference_remapper(param_id_to_location, {'A': 'B'}, row_shifts.new_row)
+
+
+def test_replaced_reference_points_to_source():
+    remap = make_remapper()
+    assert _rewrite_formula_value('=C2*2', remap, 'S') == '=C4*2'
+
+
+def test_references_after_deleted_row_shift_up():
+    remap = make_remapper()
+    assert _rewrite_formula_value('=C3+C6', remap, 'S') == '=C2+C5'
+
+
+def test_range_shrinks_over_deleted_row():
+    remap = make_remapper()
+    assert _rewrite_formula_value('=SUM(C2:C4)', remap, 'S') == '=SUM(C2:C3)'
+
+
+def test_other_sheet_reference_keeps_sheet():
+    remap = make_remapper()
+    assert _rewrite_formula_value('=S!C2+1', remap, 'T') == '=S!C4+1'
+
+
+def test_unchanged_formula_returns_same_object():
+    remap = make_remapper()
+    formula = '=C1+T!C9'
+    assert _rewrite_formula_value(formula, remap, 'S') is formula
+
+
+def test_repeated_references_are_memoized():
+    calls = []
+    row_shifts = RowShifts({'S': {2}})
+
+    def shift_row(sheet_name, row, end=False):
+        calls.append((sheet_name, row, end))
+        return row_shifts.new_row(sheet_name, row, end)
+
+    remap = make_reference_remapper({}, {}, shift_row)
+    for _ in range(3):
+        assert _rewrite_formula_value('=C3+C3*C3', remap, 'S') == '=C2+C2*C2'
+    assert calls == [('S', 3, False)]
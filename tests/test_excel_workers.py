@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+import app as app_module
+import model_cache
+from excel_workers import ExcelWorkerPool, FakeBackend, PoolBusyError, cell_blocks
+
+INPUT_CELLS = [('Sheet1', 2), ('Sheet1', 3), ('Sheet1', 5), ('Sheet1', 8)]  # 长度、宽度、高度、密度
+RESULT_CELLS = [('Sheet1', 4), ('Sheet1', 6), ('Sheet1', 7), ('Sheet1', 9)]  # 面积、体积、周长、质量
+
+
+def make_pool(**kwargs):
+    """返回(线程池, 已创建的FakeBackend列表)"""
+    backends = []
+
+    def factory():
+        backend = FakeBackend(model_cache.load_model)
+        backends.append(backend)
+        return backend
+
+    return ExcelWorkerPool(factory, **kwargs), backends
+
+
+def test_cell_blocks():
+    cells = [('A', 5), ('A', 2), ('B', 1), ('A', 3), ('A', 9)]
+    assert cell_blocks(cells) == [('A', 2, 3), ('A', 5, 5), ('A', 9, 9), ('B', 1, 1)]
+    assert cell_blocks(cells, max_gap=4) == [('A', 2, 9), ('B', 1, 1)]
+
+
+def test_calculate_uses_one_call_per_row_block(workbook_path):
+    pool, backends = make_pool(size=1)
+    try:
+        results = pool.calculate(workbook_path, INPUT_CELLS, [20, 4, 2.5, 7850], RESULT_CELLS, timeout=10)
+        assert results == [80, 200, 48, 1570000]
+        calls = backends[0].calls
+        # 输入在第2-3、5、8行，写入3块；结果在第4-9行之间，读取1块
+        assert calls == {'start': 1, 'open_workbook': 1, 'set_range': 3, 'get_range': 1, 'calculate': 1}
+    finally:
+        pool.shutdown()
+
+
+def test_same_workbook_stays_on_the_same_worker(workbook_path):
+    pool, backends = make_pool(size=3)
+    try:
+        for _ in range(4):
+            pool.calculate(workbook_path, INPUT_CELLS[:1], [10], RESULT_CELLS[:1], timeout=10)
+        assert len(backends) == 1
+        assert backends[0].calls['open_workbook'] == 1 and backends[0].calls['calculate'] == 4
+        assert [worker['completed'] for worker in pool.stats()['workers']].count(4) == 1
+    finally:
+        pool.shutdown()
+
+
+def test_full_queue_raises_pool_busy(workbook_path):
+    pool, _ = make_pool(size=1, max_queue=1)
+    release = threading.Event()
+    try:
+        blocked = pool.submit(workbook_path, lambda backend, path: release.wait(10))
+        with pytest.raises(PoolBusyError):
+            pool.submit(workbook_path, lambda backend, path: None)
+        assert pool.stats()['rejected'] == 1
+        release.set()
+        assert blocked.result(10) is True
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_backend_recycled_after_max_uses(workbook_path):
+    pool, backends = make_pool(size=1, max_uses=2)
+    try:
+        for _ in range(5):
+            pool.calculate(workbook_path, INPUT_CELLS[:1], [10], RESULT_CELLS[:1], timeout=10)
+        # 每个后端处理2个请求后重启：共3个后端，前两个已关闭
+        assert len(backends) == 3
+        assert [backend.started for backend in backends] == [False, False, True]
+        assert [backend.calls['calculate'] for backend in backends] == [2, 2, 1]
+        assert pool.stats()['workers'][0]['restarts'] == 3
+    finally:
+        pool.shutdown()
+
+
+def test_calculate_endpoint_returns_503_when_busy(client, monkeypatch):
+    pool, _ = make_pool(size=1, max_queue=0)
+    monkeypatch.setitem(app_module.app.config, 'CALC_BACKEND', 'excel')
+    monkeypatch.setattr(app_module, 'excel_pool', pool)
+    try:
+        response = client.post('/api/calculate', json={'高度': 5})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '5'
+    finally:
+        pool.shutdown()
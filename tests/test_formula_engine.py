@@ -0,0 +1,29 @@
+from formula_engine import FormulaEngine
+
+
+def make_params(formula):
+    """一个工作表：两个文本参数（单位列和数值列都是文本）和一个公式参数"""
+    return {
+        '名称A': {'名称': '名称A', '单位': 'mm', '工作表': 'S', '行': 2, '值': 'abc', '公式': ''},
+        '名称B': {'名称': '名称B', '单位': 'mm', '工作表': 'S', '行': 3, '值': '', '公式': ''},
+        '结果': {'名称': '结果', '单位': '', '工作表': 'S', '行': 4, '值': None, '公式': formula},
+    }
+
+
+def calculate(formula):
+    all_params = make_params(formula)
+    engine = FormulaEngine(all_params, {'结果': []})
+    return engine.calculate()['结果']
+
+
+def test_product_without_numbers_is_zero():
+    # Excel: PRODUCT over a range containing no numbers returns 0, not 1
+    assert calculate('=PRODUCT(C2:C3)') == 0
+
+
+def test_product_of_numbers():
+    assert calculate('=PRODUCT(2,3,4)') == 24
+
+
+def test_sum_overflow_is_num_error():
+    assert calculate('=SUM(1E308,1E308,-1E308)') == '#NUM!'
@@ -0,0 +1,51 @@
+from formula_parser import tokenize, rewrite_references, parse_formula
+
+
+def kinds(formula):
+    return [(token.kind, token.value) for token in tokenize(formula)]
+
+
+def test_function_name_with_digits_is_not_a_reference():
+    tokens = kinds('=LOG10(C2)')
+    assert tokens[0] == ('func', 'LOG10')
+    assert [value.row for kind, value in tokens if kind == 'ref'] == [2]
+
+
+def test_cell_does_not_match_inside_longer_cell():
+    def replace(kind, ref):
+        return 'D7' if kind == 'ref' and ref.row == 1 else None
+
+    assert rewrite_references('=C1+C10*C1', replace) == '=D7+C10*D7'
+
+
+def test_rewrite_keeps_function_names_and_strings():
+    def replace(kind, ref):
+        return ref._replace(row=ref.row + 1) if kind == 'ref' else None
+
+    assert rewrite_references('=LOG10(C2)&"C2"', replace) == '=LOG10(C3)&"C2"'
+
+
+def test_quoted_sheet_name_with_escaped_quote():
+    (kind, ref), = kinds("='My ''Sheet'''!C3")
+    assert kind == 'ref' and ref.sheet == "My 'Sheet'" and (ref.col, ref.row) == (3, 3)
+
+    def replace(kind, ref):
+        return ref._replace(row=4)
+
+    assert rewrite_references("='My ''Sheet'''!C3+1", replace) == "='My ''Sheet'''!C4+1"
+
+
+def test_xlfn_prefix_is_stripped():
+    assert kinds('=_xlfn.CONCAT(A1,B2)')[0] == ('func', 'CONCAT')
+    assert parse_formula('=_xlfn.CONCAT(A1,B2)')[1] == 'CONCAT'
+
+
+def test_whole_column_range():
+    (kind, ref), = kinds('=C:C')[:1]
+    assert kind == 'range'
+    assert (ref.start.col, ref.start.row, ref.end.col, ref.end.row) == (3, None, 3, None)
+
+    def replace(kind, ref):
+        return ref._replace(sheet='表2') if kind == 'range' else None
+
+    assert rewrite_references('=SUM(C:C)', replace) == '=SUM(表2!C:C)'
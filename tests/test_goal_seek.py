@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from goal_seek import solve_least_squares
+
+
+def test_step_rejected_when_gradient_has_no_value():
+    start = np.array([1.0, 1.0])
+
+    def evaluate(x):
+        return float(x.sum())
+
+    def gradient(x):
+        # 自动微分只在起点得到数值
+        if np.array_equal(x, start):
+            return float(x.sum()), np.array([1.0, 1.0])
+        return None, None
+
+    x, value, converged, _ = solve_least_squares(evaluate, gradient, 10.0, start,
+                                                 np.full(2, -np.inf), np.full(2, np.inf))
+    assert not converged
+    assert np.array_equal(x, start) and value == 2.0
+
+
+def test_least_squares_converges():
+    def evaluate(x):
+        return float(x[0] * x[1])
+
+    def gradient(x):
+        return evaluate(x), np.array([x[1], x[0]])
+
+    x, value, converged, _ = solve_least_squares(evaluate, gradient, 12.0, [1.0, 2.0],
+                                                 np.full(2, -np.inf), np.full(2, np.inf))
+    assert converged and value == pytest.approx(12.0)
+
+
+@pytest.mark.parametrize('body', [
+    {'target': 'inf'},
+    {'target': 'nan'},
+    {'target': 1000, 'tolerance': 'nan'},
+    {'target': 1000, 'tolerance': 'inf'},
+])
+def test_non_finite_target_or_tolerance_is_rejected(client, body):
+    response = client.post('/api/goal_seek', json=dict(body, output='质量', inputs=['高度']))
+    assert response.status_code == 400
+
+
+def test_goal_seek_endpoint(client):
+    response = client.post('/api/goal_seek', json={'output': '质量', 'target': 1570000, 'inputs': ['高度']})
+    result = response.get_json()
+    assert response.status_code == 200 and result['converged']
+    assert result['values']['高度'] == pytest.approx(5.0)
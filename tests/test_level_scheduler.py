@@ -0,0 +1,58 @@
+import pytest
+
+from formula_engine import FormulaEngine
+from level_scheduler import LevelScheduler
+
+
+def make_params(count):
+    """第2行起count个输入参数，其后每个公式参数引用一个输入和全部输入的范围"""
+    all_params = {}
+    dependencies = {}
+    last_row = count + 1
+    for i in range(count):
+        all_params[f'x{i}'] = {'名称': f'x{i}', '单位': 'mm', '工作表': 'S', '行': i + 2, '值': i, '公式': ''}
+    inputs = list(all_params)
+    for i in range(count):
+        param_id = f'y{i}'
+        all_params[param_id] = {'名称': param_id, '单位': '', '工作表': 'S', '行': last_row + 1 + i, '值': None,
+                                '公式': f'C{i + 2}*2+SUM(C2:C{last_row})&B{i + 2}'}
+        dependencies[param_id] = inputs
+    return all_params, dependencies
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_parallel_levels_match_serial(executor):
+    all_params, dependencies = make_params(12)
+    expected = FormulaEngine(all_params, dependencies).calculate()
+
+    scheduler = LevelScheduler(max_workers=2, grain_size=3, executor=executor)
+    try:
+        engine = FormulaEngine(all_params, dependencies, scheduler=scheduler)
+        assert engine.calculate() == expected
+        assert engine.calculate({'x0': 100}) == FormulaEngine(all_params, dependencies).calculate({'x0': 100})
+        assert scheduler.stats()['parallel_levels'] == 2
+    finally:
+        scheduler.shutdown()
+
+
+def test_pool_is_shared_across_engines():
+    scheduler = LevelScheduler(max_workers=2, grain_size=3, executor='thread')
+    try:
+        first = FormulaEngine(*make_params(8), scheduler=scheduler)
+        second = FormulaEngine(*make_params(10), scheduler=scheduler)
+        first.calculate()
+        pool = scheduler._pool
+        second.calculate()
+        first.calculate()
+        assert scheduler._pool is pool
+    finally:
+        scheduler.shutdown()
+
+
+def test_chunk_engine_only_carries_chunk_and_dependencies():
+    engine = FormulaEngine(*make_params(6))
+    chunk = engine.chunk_engine(['y0', 'y1'])
+    assert set(chunk.compiled) == {'y0', 'y1'}
+    assert set(chunk.all_params) == {'y0', 'y1'} | {f'x{i}' for i in range(6)}
+    values = engine.dependency_values(['y0'], engine.initial_values())
+    assert chunk.evaluate_param('y0', values) == engine.evaluate_param('y0', engine.initial_values())
@@ -0,0 +1,25 @@
+import pickle
+
+import pytest
+
+from param_record import ParamRecord, EMPTY_DEPENDENCIES, EMPTY_DEPENDENCY_NAMES
+
+
+def test_shared_empty_dependencies_are_immutable():
+    a = ParamRecord('A', 'S_A')
+    b = ParamRecord('B', 'S_B')
+    assert a['依赖'] is b['依赖'] is EMPTY_DEPENDENCIES
+    with pytest.raises(TypeError):
+        a['依赖'].add('S_B')
+    with pytest.raises(TypeError):
+        a['依赖描述'].add_range(None, 0, 1)
+    with pytest.raises(TypeError):
+        EMPTY_DEPENDENCY_NAMES.ranges = [(None, 0, 1)]
+    assert not b['依赖'] and len(b['依赖描述']) == 0
+
+
+def test_empty_dependencies_survive_pickle():
+    record = pickle.loads(pickle.dumps(ParamRecord('A', 'S_A')))
+    assert record['依赖'] == set() and record['依赖'].field == 'ids'
+    with pytest.raises(TypeError):
+        record['依赖'].add('S_B')
@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+
+import pytest
+
+from param_search import ParameterSearchIndex, SearchError
+
+NAMES = ['长度', '宽度', '总长度', '高度', '长度系数', 'Length', 'width', '面积']
+
+
+def make_index():
+    all_params = {name: {'名称': name, '工作表': 'S' if i < 5 else 'T', '有循环依赖': name == '面积'}
+                  for i, name in enumerate(NAMES)}
+    model = SimpleNamespace(all_params=all_params,
+                            input_params={'长度', '宽度', '高度', 'Length', 'width'},
+                            output_params={'面积'},
+                            intermediate_params={'总长度', '长度系数'},
+                            independent_params=set())
+    return ParameterSearchIndex(model)
+
+
+def test_prefix_match():
+    ids, _, _, total = make_index().search('长度', match='prefix')
+    assert ids == ['长度', '长度系数'] and total == 2
+
+
+def test_substring_match_uses_bigrams():
+    ids, _, _, _ = make_index().search('长度')
+    assert ids == ['长度', '总长度', '长度系数']
+    # 三个字的查询要求整个串出现，而不只是两个二元组都出现
+    assert make_index().search('总长度')[0] == ['总长度']
+    assert make_index().search('度长')[0] == []
+
+
+def test_single_character_and_case_insensitive():
+    index = make_index()
+    assert index.search('宽')[0] == ['宽度']
+    assert index.search('LEN', match='prefix')[0] == ['Length']
+
+
+def test_filters():
+    index = make_index()
+    ids, categories, _, _ = index.search(categories=['intermediate', 'output'])
+    assert ids == ['总长度', '长度系数', '面积']
+    assert categories == ['intermediate', 'intermediate', 'output']
+    assert index.search(sheet='T')[0] == ['Length', 'width', '面积']
+    assert index.search(sheet='没有')[0] == []
+    assert index.search(circular=True)[0] == ['面积']
+
+
+def test_cursor_pages_are_stable_and_complete():
+    index = make_index()
+    pages = []
+    cursor = None
+    while True:
+        ids, _, cursor, total = index.search(cursor=cursor, limit=3)
+        pages.append(ids)
+        if cursor is None:
+            break
+    assert [len(page) for page in pages] == [3, 3, 2]
+    assert [param_id for page in pages for param_id in page] == NAMES
+    assert total == len(NAMES)
+    # 同一游标再次请求得到同样的一页
+    second_cursor = index.search(limit=3)[2]
+    assert index.search(cursor=second_cursor, limit=3)[0] == pages[1]
+
+
+def test_invalid_queries():
+    index = make_index()
+    with pytest.raises(SearchError):
+        index.search(categories=['unknown'])
+    with pytest.raises(SearchError):
+        index.search(cursor='abc')
+    with pytest.raises(SearchError):
+        index.search(match='regex')
+
+
+@pytest.mark.parametrize('query', ['category=input,bogus', 'cursor=abc', 'match=regex'])
+def test_search_endpoint_rejects_bad_queries(client, query):
+    response = client.get(f'/api/parameters/search?{query}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_search_endpoint_pages(client):
+    first = client.get('/api/parameters/search?category=input&limit=3').get_json()
+    assert [item['名称'] for item in first['items']] == ['长度', '宽度', '高度']
+    assert first['total'] == 4 and first['next_cursor'] is not None
+    second = client.get(f"/api/parameters/search?category=input&limit=3&cursor={first['next_cursor']}").get_json()
+    assert [item['名称'] for item in second['items']] == ['密度'] and second['next_cursor'] is None
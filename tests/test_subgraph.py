@@ -0,0 +1,23 @@
+def test_subgraph_hops_and_edges(client):
+    data = client.get('/api/subgraph?center=体积&up=1&down=1').get_json()
+    assert {node['id']: node['hops'] for node in data['nodes']} == {'体积': 0, '面积': -1, '高度': -1, '质量': 1}
+    edges = {(edge['source'], edge['target']) for edge in data['edges']}
+    assert edges == {('体积', '面积'), ('体积', '高度'), ('质量', '体积')}
+    assert data['truncated'] is False
+
+
+def test_subgraph_up_two_hops(client):
+    data = client.get('/api/subgraph?center=体积&up=2&down=0').get_json()
+    assert {node['id'] for node in data['nodes']} == {'体积', '面积', '高度', '长度', '宽度'}
+
+
+def test_subgraph_truncated(client):
+    data = client.get('/api/subgraph?center=体积&up=2&down=1&max_nodes=3').get_json()
+    assert data['truncated'] is True and data['max_nodes'] == 3
+    assert len(data['nodes']) == 3 and data['nodes'][0]['id'] == '体积'
+
+
+def test_subgraph_errors(client):
+    assert client.get('/api/subgraph').status_code == 400
+    assert client.get('/api/subgraph?center=体积&up=x').status_code == 400
+    assert client.get('/api/subgraph?center=不存在').status_code == 404